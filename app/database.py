@@ -1,10 +1,14 @@
+import logging
 import os
+from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorClient
 from pymongo import IndexModel, ASCENDING
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class Database:
     client: AsyncIOMotorClient = None
     db = None
@@ -21,43 +25,102 @@ async def connect_to_mongo():
     db.client = AsyncIOMotorClient(os.getenv("MONGODB_URI"))
     db.db = db.client[os.getenv("DATABASE_NAME", "assignment06")]
     
-    # Create indexes for better performance
-    await create_indexes()
-    print("Connected to MongoDB")
+    # Reconcile indexes only when this build expects a newer schema than the database has
+    await ensure_schema(force=os.getenv("SCHEMA_RECONCILE", "auto").lower() == "always")
+    logger.info("Connected to MongoDB", extra={"database": db.db.name})
 
 async def close_mongo_connection():
     """Close database connection"""
     if db.client:
         db.client.close()
-        print("Disconnected from MongoDB")
+        logger.info("Disconnected from MongoDB")
+
+# Bump whenever INDEXES or OBSOLETE_INDEXES change
+SCHEMA_VERSION = 4
+
+# One index per query shape issued by app.storage.mongo; the comment names the queries each serves.
+# Equality fields come first, then the sort/range fields, so no query needs a collection scan or
+# an in-memory sort. test_query_plans.py checks this with explain().
+INDEXES = {
+    "messages": [
+        # get_recent_messages, get_messages_after (keyset on created_at, _id), iter_messages,
+        # count_messages without role, get_daily_message_counts ($match on user_id), get_idle_sessions
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+        # count_messages(role=...), answered from the index alone
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("role", ASCENDING)]),
+    ],
+    # Used instead of messages with MESSAGE_LAYOUT=buckets (app.storage.mongo_buckets)
+    "message_buckets": [
+        # get_recent_messages, get_messages_after and the append path's newest-bucket lookup, count_messages,
+        # iter_messages, get_daily_message_counts ($match on user_id), get_idle_sessions; unique so racing writers
+        # can't both open a bucket
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("seq", ASCENDING)], unique=True),
+        # get_messages_by_ids, delete_messages, get_recent_user_ids (ObjectIds start with their creation time)
+        IndexModel([("messages._id", ASCENDING)]),
+    ],
+    "message_embeddings": [
+        # find_message_embeddings for one session, optionally within a time range
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING)]),
+        # find_message_embeddings across sessions
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING)]),
+    ],
+    "summaries": [
+        # get_latest_summary for one session or the lifetime summary (session_id null), upsert_summary,
+        # get_latest_summaries ($in on user_id and session_id)
+        IndexModel([("user_id", ASCENDING), ("scope", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING)]),
+        # get_session_summaries (keyset), get_latest_summary across sessions, iter_summaries
+        IndexModel([("user_id", ASCENDING), ("scope", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "episodes": [
+        # find_episodes, find_session_episodes, get_recent_episodes (keyset), count_episodes, list_episode_user_ids
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)]),
+        # iter_episodes for one user, resumable by _id
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "profile_queue": [
+        # mark_profile_dirty upserts, clear_profile_dirty
+        IndexModel([("user_id", ASCENDING)], unique=True),
+        # get_dirty_profiles, stalest first
+        IndexModel([("dirty_since", ASCENDING)]),
+    ],
+}
+
+# Indexes earlier versions created that no query shape needs any more; each one costs a write
+# on every insert. Only these names are dropped, never indexes added by hand.
+OBSOLETE_INDEXES = {
+    "messages": ["user_id_1", "session_id_1", "created_at_1", "user_id_1_session_id_1_created_at_1"],
+    "summaries": ["user_id_1", "scope_1", "user_id_1_scope_1", "created_at_1"],
+    "episodes": ["user_id_1", "session_id_1", "created_at_1", "user_id_1_session_id_1"],
+}
 
 async def create_indexes():
-    """Create database indexes"""
-    # Messages collection indexes
-    messages_indexes = [
-        IndexModel([("user_id", ASCENDING)]),
-        IndexModel([("session_id", ASCENDING)]),
-        IndexModel([("created_at", ASCENDING)]),
-        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING)])
-    ]
-    await db.db.messages.create_indexes(messages_indexes)
-    
-    # Summaries collection indexes
-    summaries_indexes = [
-        IndexModel([("user_id", ASCENDING)]),
-        IndexModel([("scope", ASCENDING)]),
-        IndexModel([("user_id", ASCENDING), ("scope", ASCENDING)]),
-        IndexModel([("created_at", ASCENDING)])
-    ]
-    await db.db.summaries.create_indexes(summaries_indexes)
-    
-    # Episodes collection indexes
-    episodes_indexes = [
-        IndexModel([("user_id", ASCENDING)]),
-        IndexModel([("session_id", ASCENDING)]),
-        IndexModel([("created_at", ASCENDING)]),
-        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING)])
-    ]
-    await db.db.episodes.create_indexes(episodes_indexes)
+    """Create the query-shape indexes and drop obsolete ones"""
+    for collection, indexes in INDEXES.items():
+        await db.db[collection].create_indexes(indexes)
+
+    for collection, names in OBSOLETE_INDEXES.items():
+        existing = await db.db[collection].index_information()
+        for name in names:
+            if name in existing:
+                await db.db[collection].drop_index(name)
+                logger.info("Dropped obsolete index", extra={"collection": collection, "index": name})
     
-    print("Database indexes created")
+    logger.info("Database indexes created")
+
+async def ensure_schema(force: bool = False) -> bool:
+    """Run index reconciliation if the stored schema version is older than SCHEMA_VERSION; returns whether it ran"""
+    meta = await db.db.schema_meta.find_one({"_id": "indexes"})
+    stored_version = meta.get("version", 0) if meta else 0
+    # Only upgrade: during a rolling deploy, older workers must not undo a newer worker's indexes
+    if not force and stored_version >= SCHEMA_VERSION:
+        logger.info("Index reconciliation skipped", extra={"schema_version": stored_version})
+        return False
+
+    await create_indexes()
+    await db.db.schema_meta.update_one(
+        {"_id": "indexes"},
+        {"$set": {"version": max(stored_version, SCHEMA_VERSION), "applied_at": datetime.utcnow()}},
+        upsert=True
+    )
+    logger.info("Indexes reconciled", extra={"from_version": stored_version, "schema_version": SCHEMA_VERSION})
+    return True
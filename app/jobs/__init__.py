@@ -0,0 +1 @@
+# Offline and background jobs
@@ -0,0 +1,96 @@
+"""Move sessions idle for longer than --idle-days out of storage into the cold archive (ARCHIVE_DIR).
+
+Each archived session's messages, episodes and message vectors are written to one compressed file
+and deleted from storage; summaries stay. Resuming or exporting the session brings it back.
+
+The background job starts in every worker; only the one holding the `session_archiving` job
+lease runs it.
+
+Usage:
+    python -m app.jobs.archive_sessions [--idle-days 30] [--limit 1000] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.services.cold_archive import cold_archive
+from app.services.job_lease import JobLease, lease_grace
+
+logger = logging.getLogger(__name__)
+
+def idle_days() -> float:
+    """Days without a message after which a session is archived"""
+    return float(os.getenv("ARCHIVE_IDLE_DAYS", "30"))
+
+async def archive(days: float, limit: int = 1000, dry_run: bool = False, lease: Optional[JobLease] = None) -> dict:
+    """Archive up to `limit` sessions idle for `days`, longest idle first.
+
+    With a `lease`, it is renewed before each session and the run stops if it was lost.
+    """
+    idle_before = datetime.utcnow() - timedelta(days=days)
+    sessions = await get_storage().get_idle_sessions(idle_before, limit)
+    totals = {"sessions": 0, "messages": 0, "episodes": 0, "bytes": 0, "skipped": 0, "failed": 0}
+    for session in sessions:
+        if lease is not None and not await lease.hold():
+            logger.info("Session archiving stopped: job lease lost")
+            break
+        if dry_run:
+            logger.info("Would archive session", extra=session)
+            totals["sessions"] += 1
+            continue
+        try:
+            moved = await cold_archive.archive_session(session["user_id"], session["session_id"], idle_before)
+        except Exception as e:
+            totals["failed"] += 1
+            logger.error("Archiving session failed", extra={
+                "user_id": session["user_id"], "session_id": session["session_id"], "error": str(e)
+            })
+            continue
+        if moved is None:
+            totals["skipped"] += 1
+            continue
+        totals["sessions"] += 1
+        for key, value in moved.items():
+            totals[key] += value
+    return totals
+
+async def run_periodically(interval_seconds: float):
+    """Background loop started from the app lifespan"""
+    lease = JobLease("session_archiving", interval_seconds + lease_grace())
+    while True:
+        await asyncio.sleep(interval_seconds)
+        if not await lease.hold():
+            continue
+        try:
+            totals = await archive(idle_days(), lease=lease)
+            logger.info("Background session archiving finished", extra=totals)
+        except Exception as e:
+            logger.error("Background session archiving failed", extra={"error": str(e)})
+
+def archive_interval() -> float:
+    """Seconds between background archiving runs; 0 (the default) disables the background job"""
+    return float(os.getenv("ARCHIVE_INTERVAL_S", "0"))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--idle-days", type=float, default=idle_days(), help="Override ARCHIVE_IDLE_DAYS")
+    parser.add_argument("--limit", type=int, default=1000, help="Most sessions to archive in this run")
+    parser.add_argument("--dry-run", action="store_true", help="List the sessions that would be archived")
+    args = parser.parse_args()
+
+    configure_logging()
+    await connect_storage()
+    try:
+        totals = await archive(args.idle_days, args.limit, args.dry_run)
+        logger.info("Archiving finished", extra=dict(totals, dry_run=args.dry_run))
+        print(totals)
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
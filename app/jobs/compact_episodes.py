@@ -0,0 +1,91 @@
+"""Compact the episodes collection: merge near-duplicates and evict down to the per-user capacity.
+
+The background job starts in every worker; only the one holding the `episode_compaction` job
+lease runs it.
+
+Usage:
+    python -m app.jobs.compact_episodes [--user USER_ID] [--threshold 0.92] [--capacity 500]
+                                        [--no-dedup] [--no-evict] [--dry-run]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from typing import Optional
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.memory.episodic import episodic_memory
+from app.services.job_lease import JobLease, lease_grace
+
+logger = logging.getLogger(__name__)
+
+async def compact(user_ids=None, dry_run: bool = False, dedup: bool = True, evict: bool = True,
+                  lease: Optional[JobLease] = None) -> dict:
+    """Run compaction for the given users, or for every user with episodes.
+
+    With a `lease`, it is renewed before each user and the run stops if it was lost.
+    """
+    if not user_ids:
+        user_ids = await get_storage().list_episode_user_ids()
+
+    totals = {"merged": 0, "evicted": 0}
+    for user_id in user_ids:
+        if lease is not None and not await lease.hold():
+            logger.info("Episode compaction stopped: job lease lost")
+            break
+        merged = evicted = 0
+        if dedup:
+            merged = await episodic_memory.compact_duplicates(user_id, dry_run=dry_run)
+        if evict and not dry_run:
+            evicted = await episodic_memory.enforce_capacity(user_id)
+        if merged or evicted:
+            logger.info("Compacted episodes", extra={
+                "user_id": user_id, "merged": merged, "evicted": evicted, "dry_run": dry_run
+            })
+        totals["merged"] += merged
+        totals["evicted"] += evicted
+    return totals
+
+async def run_periodically(interval_seconds: float):
+    """Background loop started from the app lifespan"""
+    lease = JobLease("episode_compaction", interval_seconds + lease_grace())
+    while True:
+        await asyncio.sleep(interval_seconds)
+        if not await lease.hold():
+            continue
+        try:
+            totals = await compact(lease=lease)
+            logger.info("Background episode compaction finished", extra=totals)
+        except Exception as e:
+            logger.error("Background episode compaction failed", extra={"error": str(e)})
+
+def compaction_interval() -> float:
+    """Seconds between background compaction runs; 0 disables the background job"""
+    return float(os.getenv("EPISODE_COMPACTION_INTERVAL_S", "3600"))
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", action="append", dest="users", help="Only compact this user (repeatable)")
+    parser.add_argument("--threshold", type=float, help="Override EPISODE_DEDUP_THRESHOLD")
+    parser.add_argument("--capacity", type=int, help="Override EPISODE_CAPACITY_PER_USER")
+    parser.add_argument("--no-dedup", action="store_true", help="Skip near-duplicate merging")
+    parser.add_argument("--no-evict", action="store_true", help="Skip capacity eviction")
+    parser.add_argument("--dry-run", action="store_true", help="Report duplicates without changing anything")
+    args = parser.parse_args()
+
+    configure_logging()
+    if args.threshold is not None:
+        episodic_memory.dedup_threshold = args.threshold
+    if args.capacity is not None:
+        episodic_memory.capacity = args.capacity
+
+    await connect_storage()
+    try:
+        totals = await compact(args.users, dry_run=args.dry_run, dedup=not args.no_dedup, evict=not args.no_evict)
+        logger.info("Compaction finished", extra=dict(totals, dry_run=args.dry_run))
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,146 @@
+"""Backfill message vectors for /api/search with the active (or a given) embedding model.
+
+Only messages stored through /api/chat and the WebSocket are embedded as they arrive. This job
+embeds the rest: history from before message search existed, messages the embedder dropped or
+failed on, and everything after an EMBED_MODEL change (search only uses vectors from the
+active model). Users are processed in id order and the checkpoint file records the last one
+finished, so an interrupted run resumes where it stopped. Messages that already have a vector
+from the target model are skipped, which makes re-running safe.
+
+Typical cutover:
+    1. Set EMBED_MODEL (and optionally EMBED_MODEL_VERSION) to the new model and restart
+    2. python -m app.jobs.embed_messages --workers 4
+
+Usage:
+    python -m app.jobs.embed_messages [--model NAME] [--version V] [--user USER_ID]
+                                      [--batch-size 32] [--workers 4] [--checkpoint PATH] [--restart]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Dict, Any, Optional
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.memory.message_search import message_search
+from app.services.ollama_client import OllamaClient
+from app.jobs.reembed import save_checkpoint
+
+logger = logging.getLogger(__name__)
+
+def load_checkpoint(path: str, model_tag: str) -> Dict[str, Any]:
+    """Read the checkpoint for `model_tag`; a checkpoint for another model starts over"""
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("model") == model_tag:
+            return checkpoint
+        logger.warning("Ignoring checkpoint for a different model", extra={"checkpoint_model": checkpoint.get("model")})
+    return {"model": model_tag, "last_user": None, "users": 0, "processed": 0, "embedded": 0, "failed": 0}
+
+class EmbedMessagesJob:
+    def __init__(self, client: OllamaClient, batch_size: int, workers: int, checkpoint_path: str):
+        self.client = client
+        self.model_tag = client.embedding_model_tag
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = load_checkpoint(checkpoint_path, self.model_tag)
+
+    async def _embed(self, batch: List[Dict[str, Any]]) -> int:
+        try:
+            return await message_search.embed_batch([(message, None) for message in batch], self.client)
+        except Exception as e:
+            logger.error("Message embedding batch failed", extra={"first_id": str(batch[0]["_id"]), "error": str(e)})
+            return 0
+
+    async def embed_user(self, user_id: str) -> Dict[str, int]:
+        """Embed the user's messages that have no vector from the target model"""
+        storage = get_storage()
+        done = {row["_id"] for row in await storage.find_message_embeddings(user_id, self.model_tag)}
+        result = {"processed": 0, "embedded": 0, "failed": 0}
+        # Up to `workers` batches are embedded at once; the next wave is read once they finish
+        wave: List[List[Dict[str, Any]]] = [[]]
+
+        async def flush():
+            batches = [batch for batch in wave if batch]
+            embedded = sum(await asyncio.gather(*(self._embed(batch) for batch in batches)))
+            result["embedded"] += embedded
+            result["failed"] += sum(len(batch) for batch in batches) - embedded
+            wave[:] = [[]]
+
+        async for message in storage.iter_messages(user_id):
+            result["processed"] += 1
+            if message["_id"] in done or not message.get("content"):
+                continue
+            wave[-1].append(message)
+            if len(wave[-1]) == self.batch_size:
+                if len(wave) == self.workers:
+                    await flush()
+                else:
+                    wave.append([])
+        await flush()
+        return result
+
+    async def run(self, user_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Embed every user's messages, resuming after the checkpoint; `user_ids` runs only those users
+        and leaves the checkpoint alone"""
+        start = time.perf_counter()
+        last_user = self.checkpoint["last_user"]
+        resumable = user_ids is None
+        if resumable:
+            user_ids = [user_id for user_id in await get_storage().list_message_user_ids()
+                        if last_user is None or user_id > last_user]
+        logger.info("Embedding messages", extra={"model": self.model_tag, "users": len(user_ids), "resume_after": last_user})
+
+        for user_id in user_ids:
+            result = await self.embed_user(user_id)
+            self.checkpoint["users"] += 1
+            for key in ("processed", "embedded", "failed"):
+                self.checkpoint[key] += result[key]
+            if resumable:
+                self.checkpoint["last_user"] = user_id
+                save_checkpoint(self.checkpoint_path, self.checkpoint)
+            elapsed = time.perf_counter() - start
+            logger.info("Message embedding progress", extra=dict(
+                {k: self.checkpoint[k] for k in ("users", "processed", "embedded", "failed")},
+                rate_per_s=round(self.checkpoint["processed"] / elapsed, 1) if elapsed else 0
+            ))
+
+        logger.info("Message embedding finished", extra={
+            k: self.checkpoint[k] for k in ("model", "users", "processed", "embedded", "failed")
+        })
+        return self.checkpoint
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Embedding model to embed with (default: EMBED_MODEL)")
+    parser.add_argument("--version", help="Embedding model version tag (default: EMBED_MODEL_VERSION)")
+    parser.add_argument("--user", action="append", dest="users", help="Only embed this user's messages (repeatable)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Messages per embedding call")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding calls")
+    parser.add_argument("--checkpoint", default=".embed_messages_checkpoint.json", help="Progress file for resuming")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint")
+    args = parser.parse_args()
+
+    configure_logging()
+    client = OllamaClient()
+    if args.model:
+        client.embed_model = args.model
+    if args.version is not None:
+        client.embed_model_version = args.version
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    await connect_storage()
+    try:
+        await EmbedMessagesJob(client, args.batch_size, args.workers, args.checkpoint).run(args.users)
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""Export everything stored for a user as NDJSON.
+
+One JSON object per line, tagged with "type": "message", "summary" or "episode". Records are
+streamed from storage cursors, so memory use stays flat however much the user has stored.
+Episode embeddings are omitted by default; `--embeddings base64` writes them as base64-encoded
+little-endian float32 (`embedding_b64`), about a quarter the size of a JSON float list.
+
+Usage:
+    python -m app.jobs.export user123 [-o user123.ndjson.gz] [--gzip] [--embeddings base64]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import sys
+import zlib
+from datetime import datetime
+from typing import Dict, Any, AsyncIterator, List
+import numpy as np
+from bson import ObjectId
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.services.cold_archive import cold_archive
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODES = ("omit", "base64")
+# Bytes to accumulate before yielding a chunk, so responses aren't written a line at a time
+CHUNK_SIZE = 64 * 1024
+
+def encode_embedding(embedding: List[float]) -> str:
+    """Pack a vector as base64 little-endian float32"""
+    return base64.b64encode(np.asarray(embedding, dtype="<f4").tobytes()).decode("ascii")
+
+def decode_embedding(encoded: str) -> List[float]:
+    return np.frombuffer(base64.b64decode(encoded), dtype="<f4").tolist()
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _record(kind: str, doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"type": kind, **doc}
+
+async def export_records(user_id: str, embeddings: str = "omit") -> AsyncIterator[Dict[str, Any]]:
+    """Yield every message, summary and episode of a user as tagged records"""
+    if embeddings not in EMBEDDING_MODES:
+        raise ValueError(f"embeddings must be one of {EMBEDDING_MODES}")
+    storage = get_storage()
+    # Archived sessions are brought back so the export is complete
+    await cold_archive.ensure_user_hot(user_id)
+
+    async for message in storage.iter_messages(user_id):
+        yield _record("message", message)
+
+    async for summary in storage.iter_summaries(user_id):
+        yield _record("summary", summary)
+
+    async for episode in storage.iter_episodes(user_id=user_id):
+        embedding = episode.pop("embedding", None)
+        if embeddings == "base64" and embedding:
+            episode["embedding_b64"] = encode_embedding(embedding)
+            episode["embedding_dim"] = len(embedding)
+        yield _record("episode", episode)
+
+async def export_ndjson(user_id: str, embeddings: str = "omit", compress: bool = False) -> AsyncIterator[bytes]:
+    """Yield the export as NDJSON byte chunks, gzip-compressed when `compress` is set"""
+    # wbits=31 produces a gzip container rather than a raw zlib stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    pending: List[bytes] = []
+    pending_size = 0
+    count = 0
+
+    async for record in export_records(user_id, embeddings):
+        line = json.dumps(record, default=_json_default).encode("utf-8") + b"\n"
+        if compressor:
+            line = compressor.compress(line)
+        pending.append(line)
+        pending_size += len(line)
+        count += 1
+        if pending_size >= CHUNK_SIZE:
+            yield b"".join(pending)
+            pending, pending_size = [], 0
+
+    if compressor:
+        pending.append(compressor.flush())
+    if pending:
+        yield b"".join(pending)
+    logger.info("Export complete", extra={"user_id": user_id, "records": count})
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("user_id", help="User to export")
+    parser.add_argument("-o", "--output", help="Output file (default stdout); a .gz name implies --gzip")
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output")
+    parser.add_argument("--embeddings", choices=EMBEDDING_MODES, default="omit", help="How to write episode embeddings")
+    args = parser.parse_args()
+
+    configure_logging()
+    compress = args.gzip or bool(args.output and args.output.endswith(".gz"))
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+
+    await connect_storage()
+    try:
+        async for chunk in export_ndjson(args.user_id, args.embeddings, compress):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
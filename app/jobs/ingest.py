@@ -0,0 +1,304 @@
+"""Bulk-import conversation history from NDJSON.
+
+Each line is one message:
+    {"user_id": "u1", "session_id": "s1", "role": "user", "content": "...", "created_at": "2024-05-01T10:00:00Z"}
+`session_id` defaults to "default" and `created_at` to the ingest time. Files written by
+app.jobs.export can be ingested directly; their summary and episode records are skipped.
+
+Messages are written with batched inserts. Fact extraction (optional) runs on background workers
+over chunks of each session's user messages, and session summaries are generated once per
+session after its messages are in, rather than once per message like /api/chat. With message
+search enabled, the same workers embed every inserted message for /api/search.
+
+Usage:
+    python -m app.jobs.ingest history.ndjson[.gz] [--extract] [--no-summarize] [--no-embed]
+                              [--batch-size 1000]
+    cat history.ndjson | python -m app.jobs.ingest -
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Iterable, Callable, Set, Union
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.memory.episodic import episodic_memory
+from app.memory.long_term import long_term_memory
+from app.memory.message_search import message_search
+from app.services.ollama_client import ollama_client
+from app.services.metrics import registry
+from app.services.resilience import set_deadline
+
+logger = logging.getLogger(__name__)
+
+ingested_messages = registry.counter("ingest_messages_total", "Messages processed by bulk ingest, by outcome")
+
+VALID_ROLES = ("user", "assistant")
+MAX_ERROR_SAMPLES = 20
+
+def parse_message(line: str) -> Optional[Dict[str, Any]]:
+    """Validate one NDJSON line and turn it into a message document; None for non-message export records"""
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("line is not a JSON object")
+    if record.get("type", "message") != "message":
+        return None
+
+    user_id = record.get("user_id")
+    content = record.get("content")
+    role = record.get("role")
+    if not user_id or not isinstance(user_id, str):
+        raise ValueError("missing user_id")
+    if role not in VALID_ROLES:
+        raise ValueError(f"role must be one of {VALID_ROLES}")
+    if not isinstance(content, str):
+        raise ValueError("missing content")
+
+    created_at = record.get("created_at")
+    if created_at:
+        created_at = datetime.fromisoformat(str(created_at).replace("Z", "+00:00"))
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    else:
+        created_at = datetime.utcnow()
+
+    return {
+        "user_id": user_id,
+        "session_id": str(record.get("session_id") or "default"),
+        "role": role,
+        "content": content,
+        "created_at": created_at
+    }
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Split a byte stream into lines without holding more than one partial line.
+
+    Lines stay undecoded, so an invalid UTF-8 sequence is reported against its line by `add_line`.
+    """
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+class BulkIngestor:
+    def __init__(
+        self,
+        extract: bool = False,
+        summarize: bool = True,
+        embed: bool = True,
+        batch_size: int = None,
+        on_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ):
+        self.extract = extract
+        self.summarize = summarize
+        self.embed = embed and message_search.enabled
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "1000"))
+        self.extract_chunk = int(os.getenv("INGEST_EXTRACT_CHUNK", "10"))
+        self.llm_workers = int(os.getenv("INGEST_LLM_WORKERS", "2"))
+        self.report_every = int(os.getenv("INGEST_REPORT_EVERY", "10000"))
+        self.on_progress = on_progress
+
+        self.buffer: List[Dict[str, Any]] = []
+        self.sessions: Set[Tuple[str, str]] = set()
+        # (user_id, session_id) -> user message texts waiting for extraction
+        self.pending_extraction: Dict[Tuple[str, str], List[str]] = {}
+
+        self.stats = {"ingested": 0, "errors": 0, "episodes": 0, "summaries": 0, "embedded": 0, "error_samples": []}
+        self.started = time.perf_counter()
+        self._next_report = self.report_every
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    # Background LLM work
+
+    def _start_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.llm_workers * 4)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.llm_workers)]
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await job()
+            except Exception as e:
+                logger.error("Ingest background job failed", extra={"error": str(e)})
+            finally:
+                self._queue.task_done()
+
+    async def _submit(self, job):
+        self._start_workers()
+        # Bounded queue: ingest slows down rather than buffering unlimited LLM work
+        await self._queue.put(job)
+
+    async def _extract(self, user_id: str, session_id: str, contents: List[str]):
+        facts = await ollama_client.extract_episodes("\n".join(contents), max_facts=min(3 * len(contents), 10))
+        stored = await episodic_memory.store_episodes(user_id, session_id, facts)
+        self.stats["episodes"] += len(stored)
+
+    async def _embed(self, messages: List[Dict[str, Any]]):
+        stored = await message_search.embed_batch([(message, None) for message in messages])
+        self.stats["embedded"] += stored
+
+    async def _summarize(self, user_id: str, session_id: str):
+        if await long_term_memory.generate_session_summary(user_id, session_id):
+            self.stats["summaries"] += 1
+
+    # Ingest
+
+    def _report(self, force: bool = False):
+        if not force and self.stats["ingested"] < self._next_report:
+            return
+        self._next_report = self.stats["ingested"] + self.report_every
+        progress = self.progress()
+        logger.info("Ingest progress", extra={k: v for k, v in progress.items() if k != "error_samples"})
+        if self.on_progress:
+            self.on_progress(progress)
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return dict(
+            self.stats,
+            sessions=len(self.sessions),
+            elapsed_s=round(elapsed, 3),
+            rate_per_s=round(self.stats["ingested"] / elapsed, 1) if elapsed else 0.0
+        )
+
+    async def _flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        stored = await get_storage().insert_messages(batch)
+        self.stats["ingested"] += stored
+        ingested_messages.inc(stored, outcome="ok")
+
+        if self.embed:
+            searchable = [message for message in batch if message["content"]]
+            for i in range(0, len(searchable), message_search.batch_size):
+                await self._submit(lambda c=searchable[i:i + message_search.batch_size]: self._embed(c))
+
+        if self.extract:
+            for message in batch:
+                if message["role"] != "user":
+                    continue
+                key = (message["user_id"], message["session_id"])
+                chunk = self.pending_extraction.setdefault(key, [])
+                chunk.append(message["content"])
+                if len(chunk) >= self.extract_chunk:
+                    del self.pending_extraction[key]
+                    await self._submit(lambda k=key, c=chunk: self._extract(k[0], k[1], c))
+
+        self._report()
+
+    async def add_line(self, line: Union[str, bytes], line_number: int = 0):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            # UnicodeDecodeError is a ValueError, so a bad byte sequence is a per-line error
+            message = parse_message(line.decode("utf-8") if isinstance(line, bytes) else line)
+        except (ValueError, TypeError) as e:
+            self.stats["errors"] += 1
+            ingested_messages.inc(outcome="error")
+            if len(self.stats["error_samples"]) < MAX_ERROR_SAMPLES:
+                self.stats["error_samples"].append({"line": line_number, "error": str(e)})
+            return
+        if message is None:
+            return
+
+        self.sessions.add((message["user_id"], message["session_id"]))
+        self.buffer.append(message)
+        if len(self.buffer) >= self.batch_size:
+            await self._flush()
+
+    async def ingest(self, lines) -> Dict[str, Any]:
+        """Write every message from an (async) iterable of NDJSON lines; returns progress so far"""
+        line_number = 0
+        if hasattr(lines, "__aiter__"):
+            async for line in lines:
+                line_number += 1
+                await self.add_line(line, line_number)
+        else:
+            for line in lines:
+                line_number += 1
+                await self.add_line(line, line_number)
+        await self._flush()
+        self._report(force=True)
+        return self.progress()
+
+    async def complete(self) -> Dict[str, Any]:
+        """Run the remaining extraction and the once-per-session summaries, then wait for them"""
+        for (user_id, session_id), chunk in list(self.pending_extraction.items()):
+            await self._submit(lambda u=user_id, s=session_id, c=chunk: self._extract(u, s, c))
+        self.pending_extraction.clear()
+
+        if self.summarize:
+            for user_id, session_id in sorted(self.sessions):
+                await self._submit(lambda u=user_id, s=session_id: self._summarize(u, s))
+
+        if self._queue is not None:
+            await self._queue.join()
+            for worker in self._workers:
+                worker.cancel()
+
+        stats = self.progress()
+        logger.info("Ingest complete", extra={k: v for k, v in stats.items() if k != "error_samples"})
+        return stats
+
+# Background completions started by the API; held so they aren't garbage collected mid-run
+background_completions: Set[asyncio.Task] = set()
+
+async def _complete_detached(ingestor: BulkIngestor) -> Dict[str, Any]:
+    # Outlives the request that started it, so that request's deadline must not cut it short
+    set_deadline(None)
+    return await ingestor.complete()
+
+def complete_in_background(ingestor: BulkIngestor) -> asyncio.Task:
+    task = asyncio.create_task(_complete_detached(ingestor))
+    background_completions.add(task)
+    task.add_done_callback(background_completions.discard)
+    return task
+
+def read_lines(path: str) -> Iterable[bytes]:
+    # Binary, so add_line decodes (and reports) each line on its own
+    if path == "-":
+        return sys.stdin.buffer
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="NDJSON file (.gz supported) or - for stdin")
+    parser.add_argument("--extract", action="store_true", help="Extract and embed facts from user messages")
+    parser.add_argument("--no-summarize", action="store_true", help="Skip per-session summaries")
+    parser.add_argument("--no-embed", action="store_true", help="Skip embedding messages for search")
+    parser.add_argument("--batch-size", type=int, help="Messages per insert (default INGEST_BATCH_SIZE)")
+    args = parser.parse_args()
+
+    configure_logging()
+    ingestor = BulkIngestor(
+        extract=args.extract, summarize=not args.no_summarize, embed=not args.no_embed, batch_size=args.batch_size
+    )
+
+    await connect_storage()
+    try:
+        await ingestor.ingest(read_lines(args.path))
+        stats = await ingestor.complete()
+        print(json.dumps(stats, indent=2))
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
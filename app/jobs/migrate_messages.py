@@ -0,0 +1,101 @@
+"""Copy MongoDB messages between the document and bucket layouts (MESSAGE_LAYOUT).
+
+Copies session by session in (created_at, _id) order. Each batch read from the source is checked
+against the target by message id, and only the messages the target doesn't hold are copied. A
+re-run therefore resumes an interrupted copy and also picks up messages written during a rollout,
+including ones older than messages the new layout already holds. Message ids are kept, so message
+embeddings and summary watermarks still point at the right messages.
+
+Typical cutover to buckets:
+    1. python -m app.jobs.migrate_messages --to buckets
+    2. Set MESSAGE_LAYOUT=buckets and restart the workers
+    3. python -m app.jobs.migrate_messages --to buckets --drop-source
+       (copies what old workers wrote during the restart, then deletes each session's documents
+       once both layouts hold the same number of messages)
+
+Usage:
+    python -m app.jobs.migrate_messages --to {buckets,documents} [--user USER_ID]
+                                        [--batch-size 1000] [--drop-source]
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, Optional
+from app.logging_config import configure_logging
+from app.database import get_database, connect_to_mongo, close_mongo_connection
+from app.storage.mongo import MongoStorage
+from app.storage.mongo_buckets import BucketedMongoStorage
+
+logger = logging.getLogger(__name__)
+
+# Layout name -> (collection, storage class)
+LAYOUTS = {
+    "documents": ("messages", MongoStorage),
+    "buckets": ("message_buckets", BucketedMongoStorage),
+}
+
+async def migrate(to: str, batch_size: int = 1000, drop_source: bool = False,
+                  user_id: Optional[str] = None) -> Dict[str, int]:
+    """Copy every session (or one user's) into the `to` layout; returns counts"""
+    source_layout = "documents" if to == "buckets" else "buckets"
+    source_collection, source_class = LAYOUTS[source_layout]
+    source, target = source_class(), LAYOUTS[to][1]()
+    db = await get_database()
+    stats = {"users": 0, "sessions": 0, "copied": 0, "dropped_sessions": 0, "mismatched_sessions": 0}
+
+    user_ids = [user_id] if user_id else await db[source_collection].distinct("user_id")
+    for uid in user_ids:
+        for session_id in await db[source_collection].distinct("session_id", {"user_id": uid}):
+            after = None
+            while True:
+                batch = await source.get_messages_after(uid, session_id, after, batch_size)
+                if not batch:
+                    break
+                after = (batch[-1]["created_at"], batch[-1]["_id"])
+                # By id rather than by time: once new-layout workers write to a session, messages old
+                # workers wrote during the restart are older than the target's newest one
+                present = {message["_id"] for message in await target.get_messages_by_ids([m["_id"] for m in batch])}
+                missing = [message for message in batch if message["_id"] not in present]
+                if missing:
+                    await target.insert_messages(missing)
+                    stats["copied"] += len(missing)
+            stats["sessions"] += 1
+
+            if drop_source:
+                # Never delete a session the target doesn't fully hold
+                source_count = await source.count_messages(uid, session_id)
+                target_count = await target.count_messages(uid, session_id)
+                if source_count != target_count:
+                    stats["mismatched_sessions"] += 1
+                    logger.warning("Source kept: message counts differ", extra={
+                        "user_id": uid, "session_id": session_id, "source": source_count, "target": target_count
+                    })
+                    continue
+                await db[source_collection].delete_many({"user_id": uid, "session_id": session_id})
+                stats["dropped_sessions"] += 1
+        stats["users"] += 1
+        logger.info("Migrated user", extra={"user_id": uid, "to": to, "copied": stats["copied"]})
+
+    logger.info("Message migration finished", extra=dict(stats, to=to))
+    return stats
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", required=True, choices=sorted(LAYOUTS), help="Target layout")
+    parser.add_argument("--user", help="Only migrate this user")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Messages read and written per round trip")
+    parser.add_argument("--drop-source", action="store_true",
+                        help="Delete each session from the source layout once the target holds all of it")
+    args = parser.parse_args()
+
+    configure_logging()
+    await connect_to_mongo()
+    try:
+        stats = await migrate(args.to, args.batch_size, args.drop_source, args.user)
+        print(stats)
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
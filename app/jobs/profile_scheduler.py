@@ -0,0 +1,139 @@
+"""Regenerate lifetime profiles for users whose session summaries changed.
+
+Users are marked dirty when a session summary is written. Dirty profiles are regenerated in
+batches during the configured low-traffic windows, with at most PROFILE_MAX_CONCURRENCY LLM
+calls in flight. Profiles dirty for longer than PROFILE_STALENESS_SLO_S are regenerated
+whenever the scheduler runs, window or not. Every worker starts the scheduler, but only the one
+holding the `profile_scheduler` job lease runs batches, so the cap holds across workers.
+
+Usage:
+    python -m app.jobs.profile_scheduler --once [--force]
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, time, timedelta
+from typing import List, Tuple, Optional
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.memory.long_term import long_term_memory
+from app.services.ollama_client import ollama_client
+from app.services.metrics import registry
+from app.services.job_lease import JobLease, lease_grace
+
+logger = logging.getLogger(__name__)
+
+profiles_regenerated = registry.counter(
+    "profile_regenerations_total", "Lifetime profile regenerations by trigger and outcome"
+)
+profile_staleness = registry.histogram(
+    "profile_staleness_seconds", "Time a profile was dirty before it was regenerated",
+    buckets=(60, 300, 900, 3600, 4 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400)
+)
+
+def parse_windows(spec: str) -> List[Tuple[time, time]]:
+    """Parse "HH:MM-HH:MM,..." (UTC); a window may wrap past midnight"""
+    windows = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        start, end = part.split("-")
+        windows.append((time.fromisoformat(start.strip()), time.fromisoformat(end.strip())))
+    return windows
+
+def in_windows(now: datetime, windows: List[Tuple[time, time]]) -> bool:
+    """True when `now` falls in any window; no windows means always"""
+    if not windows:
+        return True
+    current = now.time()
+    for start, end in windows:
+        if start <= end and start <= current < end:
+            return True
+        if start > end and (current >= start or current < end):
+            return True
+    return False
+
+class ProfileScheduler:
+    def __init__(self):
+        self.windows = parse_windows(os.getenv("PROFILE_WINDOWS", "02:00-06:00"))
+        self.max_concurrency = int(os.getenv("PROFILE_MAX_CONCURRENCY", "2"))
+        self.batch_size = int(os.getenv("PROFILE_BATCH_SIZE", "50"))
+        self.staleness_slo = timedelta(seconds=float(os.getenv("PROFILE_STALENESS_SLO_S", "86400")))
+        self.poll_interval = float(os.getenv("PROFILE_POLL_INTERVAL_S", "60"))
+        self.enabled = os.getenv("PROFILE_SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.lease = JobLease("profile_scheduler", self.poll_interval + lease_grace())
+
+    async def run_batch(self, now: datetime = None, force: bool = False, lease: Optional[JobLease] = None) -> int:
+        """Regenerate one batch of dirty profiles; returns how many were regenerated.
+
+        With a `lease`, it is renewed before each regeneration and the batch stops if it was lost.
+        """
+        now = now or datetime.utcnow()
+        # With the summarize breaker open every regeneration would fail; leave the profiles dirty for later
+        if not ollama_client.available("summarize"):
+            logger.info("Profile batch skipped while summaries are degraded")
+            return 0
+        in_window = force or in_windows(now, self.windows)
+
+        # Outside the window only profiles that are about to breach the SLO are worth an LLM call
+        dirty_before = None if in_window else now - self.staleness_slo
+        entries = await get_storage().get_dirty_profiles(self.batch_size, dirty_before=dirty_before)
+        if not entries:
+            return 0
+
+        trigger = "window" if in_window else "slo"
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def regenerate(entry) -> bool:
+            async with semaphore:
+                if lease is not None and not await lease.hold():
+                    return False
+                try:
+                    await long_term_memory.generate_lifetime_summary(entry["user_id"])
+                except Exception as e:
+                    logger.error("Profile regeneration failed", extra={"user_id": entry["user_id"], "error": str(e)})
+                    profiles_regenerated.inc(trigger=trigger, outcome="error")
+                    return False
+                # A summary written mid-regeneration leaves the user dirty for the next batch
+                await get_storage().clear_profile_dirty(entry["user_id"], entry["marked_at"])
+                profile_staleness.observe((now - entry["dirty_since"]).total_seconds())
+                profiles_regenerated.inc(trigger=trigger, outcome="ok")
+                return True
+
+        results = await asyncio.gather(*(regenerate(entry) for entry in entries))
+        regenerated = sum(results)
+        logger.info("Profile batch finished", extra={"trigger": trigger, "regenerated": regenerated, "batch": len(entries)})
+        return regenerated
+
+    async def run_forever(self):
+        """Background loop started from the app lifespan"""
+        while True:
+            try:
+                # Drain back-to-back while there is work, then wait for the next poll
+                while await self.lease.hold() and await self.run_batch(lease=self.lease) == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error("Profile scheduler tick failed", extra={"error": str(e)})
+            await asyncio.sleep(self.poll_interval)
+
+# Global instance
+profile_scheduler = ProfileScheduler()
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--once", action="store_true", help="Run a single batch and exit")
+    parser.add_argument("--force", action="store_true", help="Ignore the low-traffic windows")
+    args = parser.parse_args()
+
+    configure_logging()
+    await connect_storage()
+    try:
+        if args.once:
+            await profile_scheduler.run_batch(force=args.force)
+        else:
+            await profile_scheduler.run_forever()
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,175 @@
+"""Re-embed stored episodes with the active (or a given) embedding model.
+
+Streams the episodes collection in `_id` order, re-embeds facts in batches across concurrent
+workers and records progress in a checkpoint file, so an interrupted run resumes where it
+stopped. Episodes already tagged with the target model are skipped, which makes re-running
+safe. Until the backfill finishes, retrieval only uses vectors tagged with the active model.
+
+Typical cutover:
+    1. Set EMBED_MODEL (and optionally EMBED_MODEL_VERSION) to the new model and restart
+    2. python -m app.jobs.reembed --workers 4 --batch-size 32
+
+Usage:
+    python -m app.jobs.reembed [--model NAME] [--version V] [--batch-size 32] [--workers 4]
+                               [--checkpoint PATH] [--restart]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from bson import ObjectId
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage, get_storage
+from app.memory.episodic import episodic_memory
+from app.services.ollama_client import OllamaClient
+from app.services.embedding_store import embedding_store
+
+logger = logging.getLogger(__name__)
+
+def load_checkpoint(path: str, model_tag: str) -> Dict[str, Any]:
+    """Read the checkpoint for `model_tag`; a checkpoint for another model starts over"""
+    if os.path.exists(path):
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("model") == model_tag:
+            return checkpoint
+        logger.warning("Ignoring checkpoint for a different model", extra={"checkpoint_model": checkpoint.get("model")})
+    return {"model": model_tag, "last_id": None, "processed": 0, "reembedded": 0, "failed": 0}
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]):
+    """Write atomically so a crash mid-write never leaves a truncated checkpoint"""
+    checkpoint["updated_at"] = datetime.utcnow().isoformat()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+class ReembedJob:
+    def __init__(self, client: OllamaClient, batch_size: int, workers: int, checkpoint_path: str):
+        self.client = client
+        self.model_tag = client.embedding_model_tag
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint = load_checkpoint(checkpoint_path, self.model_tag)
+
+        # Batches finish out of order; only advance the checkpoint over a contiguous done prefix
+        self._next_to_commit = 0
+        self._done: Dict[int, Dict[str, Any]] = {}
+
+    async def _embed_batch(self, episodes: List[Dict[str, Any]]) -> Dict[str, Any]:
+        stale = [ep for ep in episodes if episodic_memory.embedding_model_of(ep) != self.model_tag]
+        embeddings = await self.client.generate_embeddings([ep["fact"] for ep in stale])
+
+        reembedded = failed = 0
+        storage = get_storage()
+        for episode, embedding in zip(stale, embeddings):
+            if not embedding:
+                failed += 1
+                continue
+            await storage.update_episode(episode["_id"], {"embedding": embedding, "embed_model": self.model_tag})
+            reembedded += 1
+
+        return {"last_id": episodes[-1]["_id"], "processed": len(episodes), "reembedded": reembedded, "failed": failed}
+
+    def _commit(self, seq: int, result: Dict[str, Any]):
+        self._done[seq] = result
+        advanced = False
+        while self._next_to_commit in self._done:
+            done = self._done.pop(self._next_to_commit)
+            self.checkpoint["last_id"] = str(done["last_id"])
+            for key in ("processed", "reembedded", "failed"):
+                self.checkpoint[key] += done[key]
+            self._next_to_commit += 1
+            advanced = True
+        if advanced:
+            save_checkpoint(self.checkpoint_path, self.checkpoint)
+
+    async def run(self):
+        after_id: Optional[ObjectId] = ObjectId(self.checkpoint["last_id"]) if self.checkpoint["last_id"] else None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        start = time.perf_counter()
+        logger.info("Re-embedding episodes", extra={"model": self.model_tag, "resume_after": str(after_id)})
+
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                seq, batch = item
+                try:
+                    result = await self._embed_batch(batch)
+                except Exception as e:
+                    # Left uncommitted, so the checkpoint stops before it and a resumed run retries it
+                    logger.error("Re-embed batch failed", extra={"first_id": str(batch[0]["_id"]), "error": str(e)})
+                    continue
+                self._commit(seq, result)
+                elapsed = time.perf_counter() - start
+                logger.info("Re-embed progress", extra={
+                    "processed": self.checkpoint["processed"],
+                    "reembedded": self.checkpoint["reembedded"],
+                    "failed": self.checkpoint["failed"],
+                    "rate_per_s": round(self.checkpoint["processed"] / elapsed, 1) if elapsed else 0
+                })
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        try:
+            seq = 0
+            batch: List[Dict[str, Any]] = []
+            async for episode in get_storage().iter_episodes(after_id=after_id, batch_size=self.batch_size * self.workers):
+                batch.append(episode)
+                if len(batch) == self.batch_size:
+                    await queue.put((seq, batch))
+                    seq, batch = seq + 1, []
+            if batch:
+                await queue.put((seq, batch))
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        logger.info("Re-embedding finished", extra={
+            "model": self.model_tag,
+            "processed": self.checkpoint["processed"],
+            "reembedded": self.checkpoint["reembedded"],
+            "failed": self.checkpoint["failed"]
+        })
+        # Running servers drop their cached vectors for the re-embedded episodes
+        await embedding_store.request_rebuild()
+        return self.checkpoint
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Embedding model to re-embed with (default: EMBED_MODEL)")
+    parser.add_argument("--version", help="Embedding model version tag (default: EMBED_MODEL_VERSION)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Facts per embedding call")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding calls")
+    parser.add_argument("--checkpoint", default=".reembed_checkpoint.json", help="Progress file for resuming")
+    parser.add_argument("--restart", action="store_true", help="Ignore any existing checkpoint")
+    args = parser.parse_args()
+
+    configure_logging()
+    client = OllamaClient()
+    if args.model:
+        client.embed_model = args.model
+    if args.version is not None:
+        client.embed_model_version = args.version
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    await connect_storage()
+    try:
+        await ReembedJob(client, args.batch_size, args.workers, args.checkpoint).run()
+    finally:
+        await close_storage()
+
+if __name__ == "__main__":
+    asyncio.run(main())
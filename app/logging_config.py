@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+# Attributes every LogRecord carries; anything else came in through `extra=`
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {k: v for k, v in vars(record).items() if k not in _RESERVED}
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats records as `ts level logger msg key=value ...`"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        timestamp = datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat()
+        parts = [
+            timestamp,
+            "level=" + record.levelname,
+            "logger=" + record.name,
+            "msg=" + json.dumps(record.getMessage()),
+        ]
+        for key, value in _extra_fields(record).items():
+            text = str(value)
+            parts.append(f"{key}={json.dumps(text) if ' ' in text or not text else text}")
+        line = " ".join(parts)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        payload.update(_extra_fields(record))
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
+
+def configure_logging():
+    """Configure the `app` logger from LOG_LEVEL and LOG_FORMAT (text or json)"""
+    logger = logging.getLogger("app")
+    if getattr(logger, "_configured", False):
+        return
+
+    handler = logging.StreamHandler()
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(KeyValueFormatter())
+
+    logger.addHandler(handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+    logger._configured = True
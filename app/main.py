@@ -1,25 +1,88 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from contextlib import asynccontextmanager
-from typing import Dict, Any
+from contextlib import asynccontextmanager, aclosing
+from typing import Dict, Any, Optional
+import asyncio
+import json
+import logging
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
 
-from app.database import connect_to_mongo, close_mongo_connection
-from app.models import ChatRequest, ChatResponse, MemoryRequest, MemoryResponse, AggregateResponse
+from app.logging_config import configure_logging
+from app.storage import connect_storage, close_storage
+from app.models import (
+    ChatRequest, ChatBatchRequest, ChatResponse, MemoryRequest, MemoryResponse, AggregateResponse, PageResponse, SearchResponse
+)
 from app.memory.short_term import short_term_memory
 from app.memory.long_term import long_term_memory
 from app.memory.episodic import episodic_memory
+from app.memory.message_search import message_search
+from app.memory.session_state import session_states
+from app.memory.batch_chat import batch_chat
 from app.services.ollama_client import ollama_client
+from app.services.startup import startup
+from app.services.embedding_store import embedding_store
+from app.services.summary_cache import summary_cache
+from app.services.lexical_index import lexical_index
+from app.services.resilience import deadline_scope
+from app.services.prompt import compose_chat_messages
+from app.services.cold_archive import cold_archive
+from app.services.traffic_capture import TrafficCaptureMiddleware, traffic_capture
+from app.jobs.compact_episodes import run_periodically as run_episode_compaction, compaction_interval
+from app.jobs.archive_sessions import run_periodically as run_session_archiving, archive_interval
+from app.jobs.profile_scheduler import profile_scheduler
+from app.jobs.ingest import BulkIngestor, iter_lines, complete_in_background
+from app.jobs.export import export_ndjson, EMBEDDING_MODES
+from app.services.metrics import (
+    registry, span, start_request_timing, server_timing_header, http_request_duration
+)
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+TIMING_HEADERS = os.getenv("TIMING_HEADERS", "false").lower() in ("1", "true", "yes")
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "200"))
+# Time a chat turn may spend waiting on Ollama unless the client sends X-Request-Timeout-Ms (0 disables)
+CHAT_DEADLINE_S = float(os.getenv("CHAT_DEADLINE_S", "60"))
+
+# Per-worker caches the startup prefetch fills for recently active users (STARTUP_PREFETCH_USERS)
+startup.add_prefetcher(long_term_memory.prefetch_summaries)
+if episodic_memory.candidate_mode == "lexical":
+    startup.add_prefetcher(lexical_index.user_index)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    await connect_to_mongo()
+    # Startup: connect (index reconciliation only runs on a schema change), then warm up in the
+    # background; /health/ready reports 503 until the warm-up finishes
+    await connect_storage()
+    # One worker becomes the shared embedding store's writer; the rest map its file read-only
+    await embedding_store.start()
+    # Other workers' summary writes reach this worker's cache through the change stream, if enabled
+    summary_cache.start()
+    background_tasks = [asyncio.create_task(startup.run())]
+    if compaction_interval() > 0:
+        background_tasks.append(asyncio.create_task(run_episode_compaction(compaction_interval())))
+    if archive_interval() > 0:
+        background_tasks.append(asyncio.create_task(run_session_archiving(archive_interval())))
+    if profile_scheduler.enabled:
+        background_tasks.append(asyncio.create_task(profile_scheduler.run_forever()))
+    if message_search.enabled:
+        background_tasks.append(asyncio.create_task(message_search.run_forever()))
     yield
     # Shutdown
-    await close_mongo_connection()
+    for task in background_tasks:
+        task.cancel()
+    # Let open WebSocket sessions finish their queued writes
+    await session_states.flush()
+    await embedding_store.stop()
+    await summary_cache.stop()
+    traffic_capture.close()
+    await close_storage()
 
 app = FastAPI(
     title="AI Memory System",
@@ -39,114 +102,168 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+# Opt-in (TRAFFIC_CAPTURE); added before the timing middleware so it runs inside it
+app.add_middleware(TrafficCaptureMiddleware)
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Record request latency and optionally return the per-stage breakdown"""
+    timings = start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    http_request_duration.observe(elapsed, method=request.method, path=path, status=str(response.status_code))
+
+    if TIMING_HEADERS or request.headers.get("x-timing-breakdown"):
+        timings.append(("total", elapsed))
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+@app.middleware("http")
+async def deadline_middleware(request: Request, call_next):
+    """Propagate the caller's deadline to every Ollama call made while serving the request"""
+    seconds = CHAT_DEADLINE_S if request.url.path == "/api/chat" else None
+    header = request.headers.get("x-request-timeout-ms")
+    if header:
+        try:
+            seconds = int(header) / 1000
+        except ValueError:
+            return JSONResponse(status_code=400, content={"detail": "X-Request-Timeout-Ms must be an integer"})
+    with deadline_scope(seconds):
+        return await call_next(request)
+
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
+    """Liveness check; `ready` reports whether startup warm-up has finished"""
     return {
         "status": "healthy",
+        "ready": startup.ready,
+        "summary_cache": summary_cache.stats(),
+        "websockets": session_states.stats(),
+        "ollama_breakers": ollama_client.breaker_status(),
         "timestamp": datetime.utcnow().isoformat(),
         "service": "AI Memory System"
     }
 
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness check for load balancers: 503 until models and caches are warm"""
+    status = startup.status()
+    if not startup.ready:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics endpoint"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """Main chat endpoint with full memory pipeline"""
     try:
-        from app.database import get_database
-        db = await get_database()
-        
+        # Resuming an archived session brings it back into storage first
+        with span("chat.rehydrate"):
+            await cold_archive.ensure_hot(request.user_id, request.session_id)
+
         # 1. Save user message
-        user_message = {
-            "user_id": request.user_id,
-            "session_id": request.session_id,
-            "role": "user",
-            "content": request.message,
-            "created_at": datetime.utcnow()
-        }
-        await db.messages.insert_one(user_message)
+        with span("chat.save_user_message"):
+            user_message = await short_term_memory.add_message(
+                request.user_id, request.session_id, "user", request.message
+            )
+        
+        # Stages whose Ollama breaker is open are skipped rather than waited on, and reported in memory_used
+        degraded = []
+        
+        # One embedding of the message serves episodic retrieval, message search and the message's
+        # own search vector; it is computed while short- and long-term memory are read
+        query_embedding_task = None
+        if ollama_client.available("embed"):
+            query_embedding_task = asyncio.create_task(episodic_memory.query_embedding(request.message))
+        else:
+            degraded.append("embedding_retrieval")
         
         # 2. Get short-term memory (recent messages)
-        recent_messages = await short_term_memory.get_recent_messages(
-            request.user_id, request.session_id
-        )
+        with span("chat.short_term"):
+            recent_messages = await short_term_memory.get_recent_messages(
+                request.user_id, request.session_id
+            )
         
         # 3. Get long-term memory (summaries)
-        session_summary = await long_term_memory.get_latest_summary(
-            request.user_id, "session", request.session_id
-        )
-        lifetime_summary = await long_term_memory.get_latest_summary(
-            request.user_id, "user"
-        )
+        with span("chat.long_term"):
+            session_summary = await long_term_memory.get_latest_summary(
+                request.user_id, "session", request.session_id
+            )
+            lifetime_summary = await long_term_memory.get_latest_summary(
+                request.user_id, "user"
+            )
         
         # 4. Get episodic memory (relevant facts)
-        relevant_episodes = await episodic_memory.retrieve_relevant_episodes(
-            request.user_id, request.message, request.session_id
-        )
+        # An empty embedding leaves retrieval to the lexical index, if enabled
+        with span("chat.query_embedding"):
+            query_embedding = await query_embedding_task if query_embedding_task is not None else []
         
-        # 5. Compose prompt for LLM
-        system_prompt = "You are a helpful AI assistant. Give brief, helpful responses."
-        
-        # Build context from memory
-        context_parts = []
-        
-        # Add lifetime summary if available
-        if lifetime_summary:
-            context_parts.append("User Profile: " + lifetime_summary['text'])
+        with span("chat.episodic_retrieval"):
+            relevant_episodes = await episodic_memory.retrieve_relevant_episodes(
+                request.user_id, request.message, request.session_id, query_embedding=query_embedding
+            )
         
-        # Add session summary if available
-        if session_summary:
-            context_parts.append("Session Summary: " + session_summary['text'])
+        # Earlier messages from any session that resemble this one (CHAT_MESSAGE_SEARCH_K, 0 disables)
+        related_messages = []
+        if message_search.chat_k and query_embedding:
+            with span("chat.message_search"):
+                related_messages = await message_search.search(
+                    request.user_id, request.message, message_search.chat_k, query_embedding=query_embedding,
+                    exclude_ids=[msg["_id"] for msg in recent_messages]
+                )
         
-        # Add recent conversation (limit to last 5 messages)
-        if recent_messages:
-            context_parts.append("Recent Conversation:")
-            for msg in recent_messages[-5:]:  # Last 5 messages only
-                context_parts.append(msg['role'] + ": " + msg['content'])
-        
-        # Add relevant episodic facts
-        if relevant_episodes:
-            facts = [ep["fact"] for ep in relevant_episodes]
-            context_parts.append("Relevant Facts: " + "; ".join(facts))
-        
-        # Compose full prompt
-        context = "\n\n".join(context_parts)
+        # 5. Compose prompt for LLM
+        with span("chat.compose_prompt"):
+            messages_for_llm, context = compose_chat_messages(
+                request.message, recent_messages, session_summary, lifetime_summary,
+                relevant_episodes, related_messages
+            )
         
         # 6. Call Ollama for response
-        messages_for_llm = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Context: {context}\n\nUser: {request.message}\n\nAssistant:"}
-        ]
-        
-        print(f"DEBUG: Calling Ollama with {len(messages_for_llm)} messages")
-        assistant_reply = await ollama_client.chat_completion(messages_for_llm)
-        print(f"DEBUG: Ollama response length: {len(assistant_reply) if assistant_reply else 0}")
-        print(f"DEBUG: Ollama response preview: {assistant_reply[:100] if assistant_reply else 'None'}...")
+        logger.debug("Calling Ollama", extra={"message_count": len(messages_for_llm), "prompt_chars": len(context)})
+        with span("chat.generate"):
+            assistant_reply = await ollama_client.chat_completion(messages_for_llm)
+        logger.debug("Ollama response", extra={"reply_chars": len(assistant_reply) if assistant_reply else 0})
         
         # 7. Save assistant response
-        assistant_message = {
-            "user_id": request.user_id,
-            "session_id": request.session_id,
-            "role": "assistant",
-            "content": assistant_reply,
-            "created_at": datetime.utcnow()
-        }
-        await db.messages.insert_one(assistant_message)
+        with span("chat.save_assistant_message"):
+            assistant_message = await short_term_memory.add_message(
+                request.user_id, request.session_id, "assistant", assistant_reply
+            )
         
-        # 8. Extract and store episodes from user message
-        await episodic_memory.extract_and_store_episodes(
-            request.user_id, request.session_id, request.message
-        )
+        # Both messages become searchable once the background embedder stores their vectors
+        message_search.enqueue(user_message, query_embedding)
+        message_search.enqueue(assistant_message)
+        
+        # 8. Extract and store episodes from user message (facts are embedded before they are stored)
+        if ollama_client.available("extract") and ollama_client.available("embed"):
+            with span("chat.extract_episodes"):
+                await episodic_memory.extract_and_store_episodes(
+                    request.user_id, request.session_id, request.message
+                )
+        else:
+            degraded.append("episode_extraction")
         
-        # 9. Check if we should generate session summary
-        if await long_term_memory.should_generate_session_summary(request.user_id, request.session_id):
-            await long_term_memory.generate_session_summary(request.user_id, request.session_id)
+        # 9. Check if we should generate session summary; a skipped one waits for the next interval
+        if ollama_client.available("summarize"):
+            with span("chat.session_summary"):
+                if await long_term_memory.should_generate_session_summary(request.user_id, request.session_id):
+                    await long_term_memory.generate_session_summary(request.user_id, request.session_id)
+        else:
+            degraded.append("session_summary")
         
-        # 10. Occasionally generate lifetime summary (every 5 sessions)
-        user_message_count = await short_term_memory.get_user_message_count(request.user_id, request.session_id)
-        if user_message_count % 25 == 0:  # Every 25 user messages
-            await long_term_memory.generate_lifetime_summary(request.user_id)
+        # 10. Lifetime summaries are regenerated off-peak by the profile scheduler
         
         # Prepare response
         memory_used = {
@@ -154,6 +271,8 @@ async def chat(request: ChatRequest):
             "long_term_summary": lifetime_summary["text"] if lifetime_summary else None,
             "episodic_facts": [ep["fact"] for ep in relevant_episodes]
         }
+        if degraded:
+            memory_used["degraded"] = degraded
         
         return ChatResponse(
             reply=assistant_reply,
@@ -161,21 +280,71 @@ async def chat(request: ChatRequest):
         )
         
     except Exception as e:
-        import traceback
-        print("=== FULL ERROR TRACEBACK ===")
-        traceback.print_exc()
-        print("=== ERROR DETAILS ===")
-        print(f"Error type: {type(e)}")
-        print(f"Error message: {str(e)}")
-        print("=== END ERROR ===")
+        logger.exception("Error in chat endpoint", extra={"user_id": request.user_id, "session_id": request.session_id})
         raise HTTPException(status_code=500, detail=f"Internal server error: {type(e).__name__}: {str(e)}")
 
+@app.post("/api/chat/batch")
+async def chat_batch(request: ChatBatchRequest):
+    """Run many chat turns at once, streaming an NDJSON result line per turn as it completes"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    if len(request.items) > batch_chat.max_items:
+        raise HTTPException(status_code=413, detail=f"at most {batch_chat.max_items} items per batch")
+
+    async def lines():
+        async with aclosing(batch_chat.run(request.items, request.concurrency, CHAT_DEADLINE_S)) as results:
+            async for result in results:
+                yield json.dumps(jsonable_encoder(result, custom_encoder={ObjectId: str})) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.websocket("/ws/chat/{user_id}")
+async def chat_socket(websocket: WebSocket, user_id: str, session_id: str = "default"):
+    """Chat over a WebSocket with the session's memory loaded once and kept resident while it is open"""
+    await websocket.accept()
+    if session_states.full:
+        await websocket.close(code=1013, reason="Too many open chat sessions")
+        return
+    await cold_archive.ensure_hot(user_id, session_id)
+    state = await session_states.open(user_id, session_id)
+    try:
+        await websocket.send_json({"type": "ready", "session_id": session_id, "state_bytes": state.resident_bytes})
+        while True:
+            try:
+                payload = json.loads(await websocket.receive_text())
+            except ValueError:
+                payload = None
+            message = payload.get("message") if isinstance(payload, dict) else None
+            if not isinstance(message, str) or not message.strip():
+                await websocket.send_json({"type": "error", "detail": "expected {\"message\": \"...\"}"})
+                continue
+            try:
+                # Closing the turn early (e.g. on disconnect) also ends the Ollama stream behind it
+                with deadline_scope(CHAT_DEADLINE_S):
+                    async with aclosing(state.chat(message)) as events:
+                        async for event in events:
+                            await websocket.send_json(jsonable_encoder(event))
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logger.exception("Error in chat socket", extra={"user_id": user_id, "session_id": session_id})
+                await websocket.send_json({"type": "error", "detail": f"{type(e).__name__}: {str(e)}"})
+            session_states.measure(state)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session_states.release(state)
+
 @app.get("/api/memory/{user_id}", response_model=MemoryResponse)
 async def get_memory(user_id: str, session_id: str = "default"):
     """Get memory state for a user"""
     try:
+        await cold_archive.ensure_hot(user_id, session_id)
+
         # Get recent messages
         recent_messages = await short_term_memory.get_recent_messages(user_id, session_id, limit=16)
+        for msg in recent_messages:
+            msg["_id"] = str(msg["_id"])
         
         # Get summaries
         session_summary = await long_term_memory.get_latest_summary(user_id, "session", session_id)
@@ -195,9 +364,66 @@ async def get_memory(user_id: str, session_id: str = "default"):
         )
         
     except Exception as e:
-        print("Error in memory endpoint:", str(e))
+        logger.exception("Error in memory endpoint", extra={"user_id": user_id})
         raise HTTPException(status_code=500, detail="Internal server error: " + str(e))
 
+def page_response(page: Dict[str, Any]) -> PageResponse:
+    """Make a storage page JSON-safe: string ObjectIds, no embedding vectors"""
+    items = [
+        jsonable_encoder({k: v for k, v in item.items() if k != "embedding"}, custom_encoder={ObjectId: str})
+        for item in page["items"]
+    ]
+    return PageResponse(items=items, next_cursor=page["next_cursor"])
+
+@app.get("/api/memory/{user_id}/messages", response_model=PageResponse)
+async def get_message_history(user_id: str, session_id: str = "default",
+                              limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    """Page back through a session's messages, newest first"""
+    await cold_archive.ensure_hot(user_id, session_id)
+    try:
+        return page_response(await short_term_memory.get_message_page(user_id, session_id, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/memory/{user_id}/episodes", response_model=PageResponse)
+async def get_episode_history(user_id: str, session_id: str = "default",
+                              limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE), cursor: Optional[str] = None):
+    """Page back through a session's episodes, newest first"""
+    await cold_archive.ensure_hot(user_id, session_id)
+    try:
+        return page_response(await episodic_memory.get_episode_page(user_id, session_id, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/memory/{user_id}/summaries", response_model=PageResponse)
+async def get_summary_history(user_id: str, limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+                              cursor: Optional[str] = None):
+    """Page back through a user's session summaries, newest first"""
+    try:
+        return page_response(await long_term_memory.get_session_summary_page(user_id, limit, cursor))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/search/{user_id}", response_model=SearchResponse)
+async def search_messages(user_id: str, q: str = Query(..., min_length=1),
+                          k: int = Query(10, ge=1, le=message_search.max_k), session_id: Optional[str] = None,
+                          since: Optional[datetime] = None, until: Optional[datetime] = None):
+    """Semantic search over a user's message history, optionally within a session and time range"""
+    # Naive UTC, like stored timestamps
+    since, until = (t.astimezone(timezone.utc).replace(tzinfo=None) if t and t.tzinfo else t for t in (since, until))
+    results = await message_search.search(user_id, q, k, session_id, since, until)
+    return SearchResponse(user_id=user_id, query=q, results=[
+        {
+            "message_id": str(msg["_id"]),
+            "session_id": msg["session_id"],
+            "role": msg["role"],
+            "content": msg["content"],
+            "created_at": msg["created_at"],
+            "score": msg["score"]
+        }
+        for msg in results
+    ])
+
 @app.get("/api/aggregate/{user_id}", response_model=AggregateResponse)
 async def get_aggregate(user_id: str):
     """Get aggregated data for a user"""
@@ -227,9 +453,41 @@ async def get_aggregate(user_id: str):
         )
         
     except Exception as e:
-        print("Error in aggregate endpoint:", str(e))
+        logger.exception("Error in aggregate endpoint", extra={"user_id": user_id})
         raise HTTPException(status_code=500, detail="Internal server error: " + str(e))
 
+@app.post("/api/ingest")
+async def ingest(request: Request, extract: bool = False, summarize: bool = True, embed: bool = True,
+                 wait: bool = False):
+    """Bulk-import NDJSON messages streamed in the request body"""
+    ingestor = BulkIngestor(extract=extract, summarize=summarize, embed=embed)
+    try:
+        stats = await ingestor.ingest(iter_lines(request.stream()))
+    except Exception as e:
+        logger.exception("Error in ingest endpoint")
+        raise HTTPException(status_code=500, detail="Internal server error: " + str(e))
+
+    # Extraction, embedding and summaries can take far longer than the writes; by default they finish in the background
+    if wait:
+        stats = await ingestor.complete()
+    elif extract or summarize or ingestor.embed:
+        complete_in_background(ingestor)
+        stats["background"] = True
+    return stats
+
+@app.get("/api/export/{user_id}")
+async def export(user_id: str, embeddings: str = "omit", gzip: bool = False):
+    """Stream a user's messages, summaries and episodes as NDJSON"""
+    if embeddings not in EMBEDDING_MODES:
+        raise HTTPException(status_code=400, detail=f"embeddings must be one of {', '.join(EMBEDDING_MODES)}")
+
+    filename = f"{user_id}.ndjson" + (".gz" if gzip else "")
+    return StreamingResponse(
+        export_ndjson(user_id, embeddings, compress=gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("FASTAPI_PORT", "8000"))
@@ -0,0 +1,150 @@
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from contextlib import aclosing
+import asyncio
+import logging
+import os
+import time
+from app.models import ChatRequest
+from app.storage import get_storage
+from app.memory.short_term import short_term_memory
+from app.memory.episodic import episodic_memory
+from app.memory.session_state import SessionState, session_states
+from app.services.ollama_client import ollama_client
+from app.services.cold_archive import cold_archive
+from app.services.resilience import deadline_scope
+from app.services.metrics import span, registry
+
+logger = logging.getLogger(__name__)
+
+batch_items = registry.counter("chat_batch_items_total", "Chat turns run through /api/chat/batch, by outcome")
+batch_item_duration = registry.histogram("chat_batch_item_seconds", "Time from a batch's start to each of its turns completing")
+
+Key = Tuple[str, str]
+
+class BatchChat:
+    """Runs many chat turns in one request, for evaluation and replay jobs.
+
+    Every message is embedded in one call. The memory of every session involved is read up front:
+    summaries and episodes with one `$in` query each, and recent windows and counts concurrently. Each
+    session then runs as a resident `SessionState`, as over the WebSocket, taking its turns in
+    submission order. Turns of different sessions run concurrently, at most `concurrency` at a
+    time, and results are yielded as they finish.
+    """
+
+    def __init__(self):
+        self.concurrency = int(os.getenv("CHAT_BATCH_CONCURRENCY", "4"))
+        self.max_items = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "1000"))
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Query embeddings for every message, in one call; empty vectors when the embed breaker is open"""
+        if not ollama_client.available("embed"):
+            return [[] for _ in texts]
+        with span("chat_batch.embed"):
+            embeddings = await ollama_client.generate_embeddings(texts)
+        return embeddings if len(embeddings) == len(texts) else [[] for _ in texts]
+
+    async def prefetch(self, sessions: List[Key]) -> Dict[Key, SessionState]:
+        """Load the memory of every session, returning their started states"""
+        storage = get_storage()
+        with span("chat_batch.prefetch"):
+            await asyncio.gather(*(cold_archive.ensure_hot(user_id, session_id) for user_id, session_id in sessions))
+            summaries, episodes = await asyncio.gather(
+                storage.get_latest_summaries(sessions), storage.find_session_episodes(sessions)
+            )
+            windows = await asyncio.gather(*(
+                short_term_memory.get_recent_messages(user_id, session_id) for user_id, session_id in sessions
+            ))
+            counts = await asyncio.gather(*(
+                short_term_memory.get_user_message_count(user_id, session_id) for user_id, session_id in sessions
+            ))
+
+        lifetime = {s["user_id"]: s for s in summaries if s["scope"] == "user"}
+        by_session = {(s["user_id"], s["session_id"]): s for s in summaries if s["scope"] == "session"}
+        session_episodes: Dict[Key, List[Dict[str, Any]]] = {}
+        for episode in episodic_memory.with_active_embeddings(episodes):
+            session_episodes.setdefault((episode["user_id"], episode["session_id"]), []).append(episode)
+
+        states = {}
+        loaded_at = time.monotonic()
+        for key, window, count in zip(sessions, windows, counts):
+            state = SessionState(*key)
+            state.recent_messages.extend(window)
+            state.session_summary = by_session.get(key)
+            state.lifetime_summary = lifetime.get(key[0])
+            state.summaries_loaded_at = loaded_at
+            state.episodes = session_episodes.get(key, [])
+            state.user_message_count = count
+            state.start()
+            states[key] = state
+        return states
+
+    async def turn(self, index: int, item: ChatRequest, state: SessionState, query_embedding: List[float],
+                   deadline: Optional[float]) -> Dict[str, Any]:
+        """Run one item's turn; failures are reported in the result rather than raised"""
+        result = {"type": "result", "index": index, "user_id": item.user_id, "session_id": item.session_id}
+        try:
+            done = None
+            with deadline_scope(deadline):
+                async with aclosing(state.chat(item.message, query_embedding)) as events:
+                    async for event in events:
+                        if event["type"] == "done":
+                            done = event
+            result.update(reply=done["reply"], memory_used=done["memory_used"])
+            batch_items.inc(outcome="ok")
+        except Exception as e:
+            logger.exception("Error in batch chat item", extra={"user_id": item.user_id, "session_id": item.session_id})
+            result["error"] = f"{type(e).__name__}: {str(e)}"
+            batch_items.inc(outcome="error")
+        return result
+
+    async def run(self, items: List[ChatRequest], concurrency: Optional[int] = None,
+                  deadline: Optional[float] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield a `result` per item as it completes, then a `summary`; `deadline` bounds each turn"""
+        start = time.perf_counter()
+        sessions: Dict[Key, List[int]] = {}
+        for index, item in enumerate(items):
+            sessions.setdefault((item.user_id, item.session_id), []).append(index)
+
+        # The embedding call runs while memory is read
+        embedding_task = asyncio.create_task(self.embed([item.message for item in items]))
+        try:
+            states = await self.prefetch(list(sessions))
+        except BaseException:
+            embedding_task.cancel()
+            raise
+        embeddings = await embedding_task
+
+        limit = asyncio.Semaphore(max(1, min(concurrency or self.concurrency, self.concurrency)))
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def run_session(key: Key, indexes: List[int]):
+            for index in indexes:
+                async with limit:
+                    results.put_nowait(await self.turn(index, items[index], states[key], embeddings[index], deadline))
+
+        tasks = [asyncio.create_task(run_session(key, indexes)) for key, indexes in sessions.items()]
+        writers = []
+        try:
+            failed = 0
+            for _ in items:
+                result = await results.get()
+                batch_item_duration.observe(time.perf_counter() - start)
+                failed += "error" in result
+                yield result
+            # Finish the queued message and episode writes, so the batch's effects are readable when it ends
+            writers = [session_states.finish(state) for state in states.values()]
+            await asyncio.gather(*(writer for writer in writers if writer is not None))
+            yield {
+                "type": "summary", "items": len(items), "sessions": len(sessions), "failed": failed,
+                "elapsed_s": round(time.perf_counter() - start, 3)
+            }
+        finally:
+            # On an early exit (e.g. the client went away) remaining turns stop; queued writes still finish
+            for task in tasks:
+                task.cancel()
+            if not writers:
+                for state in states.values():
+                    session_states.finish(state)
+
+# Global instance
+batch_chat = BatchChat()
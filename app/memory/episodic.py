@@ -1,37 +1,136 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
-from app.database import get_database
+import asyncio
+from app.storage import get_storage
+from app.services.metrics import timed, span, registry
 from app.services.ollama_client import ollama_client
-from app.services.embeddings import find_top_similar_episodes
+from app.services.embeddings import find_top_similar_episodes, find_most_similar_episode
+from app.services.retention import retention_policy
+from app.services.embedding_store import embedding_store
+from app.services.lexical_index import lexical_index
+from app.services.pagination import fetch_page
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
+retrievals = registry.counter("episodic_retrievals_total", "Episodic retrievals, by where candidates came from")
+
 class EpisodicMemory:
     def __init__(self):
         self.top_k = int(os.getenv("EPISODIC_TOP_K", "5"))
+        # New facts at least this similar to an existing episode are merged into it
+        self.dedup_threshold = float(os.getenv("EPISODE_DEDUP_THRESHOLD", "0.92"))
+        self.merge_importance_boost = float(os.getenv("EPISODE_MERGE_IMPORTANCE_BOOST", "0.05"))
+        # Per-user episode cap (0 disables); writes trigger eviction once it is exceeded by the slack fraction
+        self.capacity = int(os.getenv("EPISODE_CAPACITY_PER_USER", "500"))
+        self.capacity_slack = float(os.getenv("EPISODE_CAPACITY_SLACK", "0.1"))
+        self.eviction_mode = os.getenv("EPISODE_EVICTION_MODE", "archive")  # archive or delete
+        # similarity: cosine only; blended: cosine mixed with the retention score
+        self.ranking = os.getenv("EPISODIC_RANKING", "similarity")
+        self.similarity_weight = float(os.getenv("EPISODIC_SIMILARITY_WEIGHT", "0.7"))
+        # Episodes stored before embed_model was recorded were embedded with this model
+        self.legacy_embed_model = os.getenv("EMBED_LEGACY_MODEL", "nomic-embed-text")
+        # With the shared embedding store, blended ranking re-ranks this many nearest neighbours per result
+        self.store_candidate_factor = int(os.getenv("EMBEDDING_STORE_CANDIDATE_FACTOR", "4"))
+        # all: vector-score every episode; lexical: only a BM25 shortlist plus the best-retained episodes
+        self.candidate_mode = os.getenv("EPISODIC_CANDIDATES", "all")
+        self.lexical_shortlist = int(os.getenv("LEXICAL_SHORTLIST", "50"))
+        self.lexical_recent = int(os.getenv("LEXICAL_RECENT_IMPORTANT", "10"))
+        # Past this, retrieval stops waiting for the query embedding (0 waits as long as the client does)
+        self.query_embed_timeout = float(os.getenv("EPISODIC_EMBED_TIMEOUT_S", "10"))
+    
+    def embedding_model_of(self, episode: Dict[str, Any]) -> str:
+        """Model tag that produced an episode's vector"""
+        return episode.get("embed_model") or self.legacy_embed_model
     
+    def with_active_embeddings(self, episodes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keep only episodes whose vectors are comparable with new query embeddings"""
+        active = ollama_client.embedding_model_tag
+        return [ep for ep in episodes if self.embedding_model_of(ep) == active]
+    
+    async def nearest_episodes(self, user_id: str, query_embedding: List[float], k: int,
+                               session_id: str = None) -> List[Dict[str, Any]]:
+        """Fetch a user's k nearest episodes through the shared embedding store, nearest first"""
+        hits = embedding_store.search(user_id, query_embedding, k, session_id)
+        return await self.episodes_in_order(user_id, [eid for eid, _ in hits], session_id)
+    
+    async def episodes_in_order(self, user_id: str, episode_ids: List[Any], session_id: str = None) -> List[Dict[str, Any]]:
+        """Fetch episodes by id in the given order, dropping any that are gone or not the user's"""
+        if not episode_ids:
+            return []
+        episodes = {ep["_id"]: ep for ep in await get_storage().get_episodes_by_ids(episode_ids)}
+        # Candidate sources key episodes by id alone (the shared store by hashed user ids), so confirm ownership
+        return [
+            episodes[eid] for eid in episode_ids
+            if eid in episodes and episodes[eid]["user_id"] == user_id
+            and (not session_id or episodes[eid]["session_id"] == session_id)
+        ]
+    
+    async def query_embedding(self, query_message: str) -> List[float]:
+        """Embed a query, giving up after EPISODIC_EMBED_TIMEOUT_S"""
+        try:
+            if self.query_embed_timeout > 0:
+                return await asyncio.wait_for(ollama_client.generate_embedding(query_message), self.query_embed_timeout)
+            return await ollama_client.generate_embedding(query_message)
+        except asyncio.TimeoutError:
+            logger.warning("Query embedding timed out", extra={"timeout_s": self.query_embed_timeout})
+            return []
+    
+    @timed("episodic.extract_and_store_episodes")
     async def extract_and_store_episodes(self, user_id: str, session_id: str, message: str) -> List[Dict[str, Any]]:
         """Extract episodes from user message and store them"""
         # Extract episodes using LLM
         episodes_data = await ollama_client.extract_episodes(message)
         
-        if not episodes_data:
+        return await self.store_episodes(user_id, session_id, episodes_data)
+    
+    @timed("episodic.store_episodes")
+    async def store_episodes(self, user_id: str, session_id: str, episodes_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Embed extracted facts in one batch and store them, merging restatements into existing episodes"""
+        facts = []
+        for episode_data in episodes_data or []:
+            try:
+                fact = str(episode_data.get("fact", "")).strip()
+                importance = float(episode_data.get("importance", 0.5))
+            except (AttributeError, TypeError, ValueError):
+                continue
+            if fact:
+                facts.append((fact, importance))
+        
+        if not facts:
             return []
         
-        db = await get_database()
+        # Generate embeddings for all facts in one call
+        embeddings = await ollama_client.generate_embeddings([fact for fact, _ in facts])
+        
+        storage = get_storage()
         stored_episodes = []
+        inserted_episodes = []
+        existing_episodes = None
+        # The store finds each fact's nearest neighbour without loading every episode of the user
+        use_store = embedding_store.ready
         
-        for episode_data in episodes_data:
+        for (fact, importance), embedding in zip(facts, embeddings):
             try:
-                fact = episode_data.get("fact", "").strip()
-                importance = float(episode_data.get("importance", 0.5))
-                
-                if not fact:
+                if not embedding:
                     continue
                 
-                # Generate embedding for the fact
-                embedding = await ollama_client.generate_embedding(fact)
+                # Merge restatements of a known fact instead of inserting a duplicate
+                if existing_episodes is None:
+                    with span("episodic.fetch_existing"):
+                        existing_episodes = [] if use_store else self.with_active_embeddings(await storage.find_episodes(user_id))
                 
-                if not embedding:
+                with span("episodic.dedup"):
+                    # Facts inserted earlier in this call may not have reached the store yet
+                    candidates = existing_episodes
+                    if use_store:
+                        candidates = existing_episodes + await self.nearest_episodes(user_id, embedding, 1)
+                    match, similarity = find_most_similar_episode(embedding, candidates)
+                
+                if match is not None and similarity >= self.dedup_threshold:
+                    await self.merge_into_episode(match, importance)
+                    stored_episodes.append(match)
                     continue
                 
                 # Store episode in database
@@ -41,68 +140,188 @@ class EpisodicMemory:
                     "fact": fact,
                     "importance": importance,
                     "embedding": embedding,
+                    "embed_model": ollama_client.embedding_model_tag,
+                    "mention_count": 1,
                     "created_at": datetime.utcnow()
                 }
                 
-                result = await db.episodes.insert_one(episode_doc)
-                episode_doc["_id"] = result.inserted_id
+                await storage.insert_episode(episode_doc)
+                existing_episodes.append(episode_doc)
+                inserted_episodes.append(episode_doc)
                 stored_episodes.append(episode_doc)
                 
             except Exception as e:
-                print("Error storing episode:", str(e))
+                logger.error("Error storing episode", extra={"user_id": user_id, "error": str(e)})
                 continue
         
+        await embedding_store.add(inserted_episodes)
+        # Merged episodes are included so their importance and mention count are refreshed too
+        lexical_index.add(stored_episodes)
+        
+        # Keep the per-user scan bounded without waiting for the background job
+        known = embedding_store.count(user_id) if use_store else len(existing_episodes or [])
+        if self.capacity and known > self.capacity * (1 + self.capacity_slack):
+            await self.enforce_capacity(user_id)
+        
         return stored_episodes
     
-    async def retrieve_relevant_episodes(self, user_id: str, query_message: str, session_id: str = None) -> List[Dict[str, Any]]:
-        """Retrieve relevant episodes based on query message"""
-        # Generate embedding for query
-        query_embedding = await ollama_client.generate_embedding(query_message)
+    @timed("episodic.merge_into_episode")
+    async def merge_into_episode(self, episode: Dict[str, Any], importance: float, mentions: int = 1,
+                                 seen_at: datetime = None) -> Dict[str, Any]:
+        """Fold a restated fact into an existing episode: bump importance, recency and mention count"""
+        fields = {
+            "importance": min(1.0, max(float(episode.get("importance", 0.0)), importance) + self.merge_importance_boost),
+            "mention_count": int(episode.get("mention_count", 1)) + mentions,
+            "last_seen_at": max(seen_at or datetime.utcnow(), episode.get("last_seen_at") or episode["created_at"])
+        }
+        await get_storage().update_episode(episode["_id"], fields)
+        episode.update(fields)
+        return episode
+    
+    @timed("episodic.compact_duplicates")
+    async def compact_duplicates(self, user_id: str, dry_run: bool = False) -> int:
+        """Consolidate a user's existing near-duplicate episodes; returns how many were merged away"""
+        storage = get_storage()
+        # Vectors from different embedding models aren't comparable
+        episodes = self.with_active_embeddings(await storage.find_episodes(user_id))
+        episodes.sort(key=lambda ep: ep["created_at"])
         
-        if not query_embedding:
-            return []
+        # Greedy single pass: the oldest episode of each cluster survives
+        kept: List[Dict[str, Any]] = []
+        merged_ids = []
+        for episode in episodes:
+            match, similarity = find_most_similar_episode(episode.get("embedding") or [], kept)
+            if match is None or similarity < self.dedup_threshold:
+                kept.append(episode)
+                continue
+            
+            merged_ids.append(episode["_id"])
+            if not dry_run:
+                await self.merge_into_episode(
+                    match,
+                    float(episode.get("importance", 0.0)),
+                    mentions=int(episode.get("mention_count", 1)),
+                    seen_at=episode.get("last_seen_at") or episode["created_at"]
+                )
         
-        db = await get_database()
+        if merged_ids and not dry_run:
+            await storage.delete_episodes(merged_ids)
+            await embedding_store.remove(merged_ids)
+            lexical_index.remove(user_id, merged_ids)
         
-        # Build query filter
-        query_filter = {"user_id": user_id}
-        if session_id:
-            query_filter["session_id"] = session_id
+        return len(merged_ids)
+    
+    @timed("episodic.enforce_capacity")
+    async def enforce_capacity(self, user_id: str, capacity: int = None) -> int:
+        """Evict or archive a user's lowest-retention episodes down to capacity; returns how many were removed"""
+        capacity = self.capacity if capacity is None else capacity
+        if not capacity:
+            return 0
         
-        # Get all episodes for user (or session)
-        cursor = db.episodes.find(query_filter)
-        episodes = await cursor.to_list(length=None)
+        storage = get_storage()
+        episodes = await storage.find_episodes(user_id)
+        excess = len(episodes) - capacity
+        if excess <= 0:
+            return 0
+        
+        now = datetime.utcnow()
+        episodes.sort(key=lambda ep: retention_policy.score(ep, now))
+        victims = [ep["_id"] for ep in episodes[:excess]]
+        
+        if self.eviction_mode == "delete":
+            removed = await storage.delete_episodes(victims)
+        else:
+            removed = await storage.archive_episodes(victims)
+        await embedding_store.remove(victims)
+        lexical_index.remove(user_id, victims)
+        
+        logger.info("Evicted episodes", extra={"user_id": user_id, "removed": removed, "mode": self.eviction_mode})
+        return removed
+    
+    @timed("episodic.retrieve_relevant_episodes")
+    async def retrieve_relevant_episodes(self, user_id: str, query_message: str, session_id: str = None,
+                                         query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Retrieve relevant episodes based on query message; pass `query_embedding` if the caller already has it"""
+        # Generate embedding for query; the lexical shortlist is built while it is in flight
+        embedding_task = None
+        if query_embedding is None:
+            embedding_task = asyncio.create_task(self.query_embedding(query_message))
+        lexical = None
+        if self.candidate_mode == "lexical":
+            try:
+                with span("episodic.lexical"):
+                    lexical = await lexical_index.candidates(
+                        user_id, query_message, self.lexical_shortlist, self.lexical_recent, session_id
+                    )
+            except Exception:
+                if embedding_task is not None:
+                    embedding_task.cancel()
+                raise
+        if embedding_task is not None:
+            query_embedding = await embedding_task
+        
+        if not query_embedding:
+            if lexical is None:
+                return []
+            # Degraded mode: the embedding backend is slow or down, so answer from lexical scores alone
+            _, hits = lexical
+            relevant_episodes = await self.episodes_in_order(user_id, [eid for eid, _ in hits[:self.top_k]], session_id)
+            retrievals.inc(source="lexical_only")
+            if relevant_episodes:
+                await get_storage().touch_episodes([ep["_id"] for ep in relevant_episodes], datetime.utcnow())
+            return relevant_episodes
+        
+        # Nearest neighbours from the shared store, the lexical shortlist, or all episodes for user (or session)
+        with span("episodic.fetch_candidates"):
+            if embedding_store.ready:
+                k = self.top_k * (self.store_candidate_factor if self.ranking == "blended" else 1)
+                episodes = await self.nearest_episodes(user_id, query_embedding, k, session_id)
+                retrievals.inc(source="embedding_store")
+            elif lexical is not None:
+                ids, _ = lexical
+                episodes = self.with_active_embeddings(await self.episodes_in_order(user_id, ids, session_id))
+                retrievals.inc(source="lexical_shortlist")
+            else:
+                episodes = self.with_active_embeddings(await get_storage().find_episodes(user_id, session_id))
+                retrievals.inc(source="full_scan")
         
         if not episodes:
             return []
         
         # Find top similar episodes
-        relevant_episodes = find_top_similar_episodes(query_embedding, episodes, self.top_k)
+        with span("episodic.score"):
+            if self.ranking == "blended":
+                relevant_episodes = retention_policy.rank_blended(
+                    query_embedding, episodes, self.top_k, self.similarity_weight
+                )
+            else:
+                relevant_episodes = find_top_similar_episodes(query_embedding, episodes, self.top_k)
+        
+        # Retrievals feed the access-frequency part of the retention score
+        if relevant_episodes:
+            await get_storage().touch_episodes([ep["_id"] for ep in relevant_episodes], datetime.utcnow())
         
         return relevant_episodes
     
+    @timed("episodic.get_recent_episodes")
     async def get_recent_episodes(self, user_id: str, session_id: str = "default", limit: int = 20) -> List[Dict[str, Any]]:
         """Get recent episodes for a user/session"""
-        db = await get_database()
-        
-        cursor = db.episodes.find(
-            {"user_id": user_id, "session_id": session_id}
-        ).sort("created_at", -1).limit(limit)
-        
-        episodes = await cursor.to_list(length=limit)
-        
-        return episodes
+        return await get_storage().get_recent_episodes(user_id, session_id, limit)
+    
+    @timed("episodic.get_episode_page")
+    async def get_episode_page(self, user_id: str, session_id: str = "default", limit: int = 50,
+                               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of a session's episodes, newest first, continuing from `cursor`"""
+        return await fetch_page(
+            "episodes",
+            lambda n, before: get_storage().get_recent_episodes(user_id, session_id, n, before=before),
+            limit, cursor
+        )
     
+    @timed("episodic.get_episode_count")
     async def get_episode_count(self, user_id: str, session_id: str = "default") -> int:
         """Get episode count for a user/session"""
-        db = await get_database()
-        
-        count = await db.episodes.count_documents({
-            "user_id": user_id,
-            "session_id": session_id
-        })
-        
-        return count
+        return await get_storage().count_episodes(user_id, session_id)
 
 # Global instance
 episodic_memory = EpisodicMemory()
@@ -1,40 +1,67 @@
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from app.database import get_database
-from app.services.ollama_client import ollama_client
+from app.storage import get_storage
+from app.services.metrics import timed
+from app.services.pagination import fetch_page
+from app.services.summary_cache import summary_cache
+from app.services.ollama_client import ollama_client, FALLBACK_REPLY
 from app.memory.short_term import short_term_memory
 import os
 
+class SummaryGenerationError(Exception):
+    """Raised when the LLM produced no usable summary (Ollama failed or returned nothing)"""
+
 class LongTermMemory:
     def __init__(self):
         self.summarize_every = int(os.getenv("SUMMARIZE_EVERY_USER_MSGS", "5"))
+        # incremental: fold only messages past the stored watermark into the previous summary
+        # full: re-summarize the last `full_window` messages from scratch
+        self.summary_mode = os.getenv("SUMMARY_MODE", "incremental")
+        self.full_window = int(os.getenv("SUMMARY_FULL_WINDOW", "30"))
+        self.max_new_messages = int(os.getenv("SUMMARY_MAX_NEW_MESSAGES", "60"))
     
+    @timed("long_term.get_latest_summary")
     async def get_latest_summary(self, user_id: str, scope: str, session_id: str = None) -> Optional[Dict[str, Any]]:
-        """Get latest summary for user (session or lifetime)"""
-        db = await get_database()
-        
-        query_filter = {"user_id": user_id, "scope": scope}
-        if session_id and scope == "session":
-            query_filter["session_id"] = session_id
-        elif scope == "user":
-            query_filter["session_id"] = None
-        
-        summary = await db.summaries.find_one(
-            query_filter,
-            sort=[("created_at", -1)]
+        """Get latest summary for user (session or lifetime), from the summary cache when possible"""
+        return await summary_cache.get(
+            user_id, scope, session_id,
+            lambda: get_storage().get_latest_summary(user_id, scope, session_id)
         )
-        
-        return summary
     
+    async def prefetch_summaries(self, user_id: str, sessions: int = 5):
+        """Fill the summary cache with the user's lifetime summary and their latest sessions' summaries"""
+        await self.get_latest_summary(user_id, "user")
+        for summary in await get_storage().get_session_summaries(user_id, sessions):
+            async def loaded(summary=summary):
+                return summary
+            await summary_cache.get(user_id, "session", summary["session_id"], loaded)
+    
+    @timed("long_term.should_generate_session_summary")
     async def should_generate_session_summary(self, user_id: str, session_id: str) -> bool:
         """Check if we should generate a session summary"""
         user_message_count = await short_term_memory.get_user_message_count(user_id, session_id)
         return user_message_count > 0 and user_message_count % self.summarize_every == 0
     
+    @timed("long_term.generate_session_summary")
     async def generate_session_summary(self, user_id: str, session_id: str) -> Optional[Dict[str, Any]]:
         """Generate and store session summary"""
-        # Get recent messages for summarization (last 20-30 messages)
-        recent_messages = await short_term_memory.get_recent_messages(user_id, session_id, limit=30)
+        previous_summary = None
+        if self.summary_mode == "incremental":
+            previous_summary = await self.get_latest_summary(user_id, "session", session_id)
+            # Summaries written before watermarks existed can't be extended safely
+            if previous_summary and previous_summary.get("watermark_at") is None:
+                previous_summary = None
+        
+        if previous_summary:
+            # Only the messages the previous summary hasn't seen yet
+            recent_messages = await get_storage().get_messages_after(
+                user_id, session_id,
+                (previous_summary["watermark_at"], previous_summary["watermark_id"]),
+                self.max_new_messages
+            )
+        else:
+            # Get recent messages for summarization (last 20-30 messages)
+            recent_messages = await short_term_memory.get_recent_messages(user_id, session_id, limit=self.full_window)
         
         if not recent_messages:
             return None
@@ -48,39 +75,45 @@ class LongTermMemory:
             })
         
         # Generate summary
-        summary_text = await ollama_client.generate_session_summary(messages_for_llm)
+        summary_text = await ollama_client.generate_session_summary(
+            messages_for_llm,
+            previous_summary=previous_summary["text"] if previous_summary else None
+        )
         
-        if not summary_text.strip():
+        # Don't let a failed generation replace the summary or advance the watermark
+        if not summary_text.strip() or summary_text == FALLBACK_REPLY:
             return None
         
         # Store summary
-        db = await get_database()
         summary_doc = {
             "user_id": user_id,
             "session_id": session_id,
             "scope": "session",
             "text": summary_text,
+            # Newest message covered by this summary
+            "watermark_at": recent_messages[-1]["created_at"],
+            "watermark_id": recent_messages[-1]["_id"],
             "created_at": datetime.utcnow()
         }
         
         # Upsert (update if exists, insert if not)
-        result = await db.summaries.update_one(
-            {"user_id": user_id, "session_id": session_id, "scope": "session"},
-            {"$set": summary_doc},
-            upsert=True
-        )
+        await get_storage().upsert_summary(summary_doc)
+        summary_cache.invalidate(user_id, "session", session_id)
+        
+        # The lifetime profile is rebuilt from session summaries off the request path
+        await get_storage().mark_profile_dirty(user_id, summary_doc["created_at"])
         
         return summary_doc
     
+    @timed("long_term.generate_lifetime_summary")
     async def generate_lifetime_summary(self, user_id: str) -> Optional[Dict[str, Any]]:
-        """Generate and store lifetime summary from session summaries"""
+        """Generate and store lifetime summary from session summaries.
+
+        Returns None when the user has no session summaries; raises SummaryGenerationError when
+        generation fails, so callers can retry instead of treating the profile as up to date.
+        """
         # Get all session summaries for user
-        db = await get_database()
-        cursor = db.summaries.find(
-            {"user_id": user_id, "scope": "session"}
-        ).sort("created_at", -1).limit(10)  # Last 10 session summaries
-        
-        session_summaries = await cursor.to_list(length=10)
+        session_summaries = await get_storage().get_session_summaries(user_id, limit=10)  # Last 10 session summaries
         
         if not session_summaries:
             return None
@@ -91,8 +124,8 @@ class LongTermMemory:
         # Generate lifetime summary
         lifetime_text = await ollama_client.generate_lifetime_summary(summary_texts)
         
-        if not lifetime_text.strip():
-            return None
+        if not lifetime_text.strip() or lifetime_text == FALLBACK_REPLY:
+            raise SummaryGenerationError(f"no lifetime summary generated for {user_id}")
         
         # Store lifetime summary
         lifetime_doc = {
@@ -104,24 +137,16 @@ class LongTermMemory:
         }
         
         # Upsert lifetime summary
-        result = await db.summaries.update_one(
-            {"user_id": user_id, "scope": "user"},
-            {"$set": lifetime_doc},
-            upsert=True
-        )
+        await get_storage().upsert_summary(lifetime_doc)
+        summary_cache.invalidate(user_id, "user")
         
         return lifetime_doc
     
+    @timed("long_term.get_all_summaries")
     async def get_all_summaries(self, user_id: str) -> Dict[str, List[Dict[str, Any]]]:
         """Get all summaries for a user"""
-        db = await get_database()
-        
         # Get session summaries
-        session_cursor = db.summaries.find(
-            {"user_id": user_id, "scope": "session"}
-        ).sort("created_at", -1)
-        
-        session_summaries = await session_cursor.to_list(length=None)
+        session_summaries = await get_storage().get_session_summaries(user_id)
         
         # Get lifetime summary
         lifetime_summary = await self.get_latest_summary(user_id, "user")
@@ -131,46 +156,19 @@ class LongTermMemory:
             "lifetime": lifetime_summary
         }
     
+    @timed("long_term.get_session_summary_page")
+    async def get_session_summary_page(self, user_id: str, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of a user's session summaries, newest first, continuing from `cursor`"""
+        return await fetch_page(
+            "summaries",
+            lambda n, before: get_storage().get_session_summaries(user_id, n, before=before),
+            limit, cursor
+        )
+    
+    @timed("long_term.get_daily_message_counts")
     async def get_daily_message_counts(self, user_id: str, days: int = 30) -> List[Dict[str, Any]]:
         """Get daily message counts for a user"""
-        db = await get_database()
-        
-        # MongoDB aggregation pipeline for daily counts
-        pipeline = [
-            {"$match": {"user_id": user_id}},
-            {
-                "$group": {
-                    "_id": {
-                        "year": {"$year": "$created_at"},
-                        "month": {"$month": "$created_at"},
-                        "day": {"$dayOfMonth": "$created_at"}
-                    },
-                    "count": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}
-            },
-            {"$limit": days}
-        ]
-        
-        cursor = db.messages.aggregate(pipeline)
-        results = await cursor.to_list(length=days)
-        
-        # Format results
-        daily_counts = []
-        for result in results:
-            date_obj = result["_id"]
-            year = date_obj['year']
-            month = date_obj['month']
-            day = date_obj['day']
-            date_str = f"{year}-{month:02d}-{day:02d}"
-            daily_counts.append({
-                "date": date_str,
-                "count": result["count"]
-            })
-        
-        return daily_counts
+        return await get_storage().get_daily_message_counts(user_id, days)
 
 # Global instance
 long_term_memory = LongTermMemory()
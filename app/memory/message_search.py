@@ -0,0 +1,137 @@
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import asyncio
+import logging
+import os
+import numpy as np
+from app.storage import get_storage
+from app.services.metrics import timed, span, registry
+from app.services.ollama_client import ollama_client, OllamaClient
+
+logger = logging.getLogger(__name__)
+
+message_embeddings = registry.counter(
+    "message_embeddings_total", "Message embeddings by outcome (embedded, reused, failed, dropped)"
+)
+
+class MessageSearch:
+    """Embeds stored messages in the background and answers top-k similarity search over them"""
+
+    def __init__(self):
+        self.enabled = os.getenv("MESSAGE_EMBEDDINGS_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.batch_size = int(os.getenv("MESSAGE_EMBED_BATCH", "32"))
+        # How long the embedder waits for a batch to fill before embedding what it has
+        self.linger = float(os.getenv("MESSAGE_EMBED_LINGER_MS", "200")) / 1000
+        # Messages arriving while the queue is full are left unembedded rather than slowing the chat
+        self.queue_size = int(os.getenv("MESSAGE_EMBED_QUEUE_SIZE", "10000"))
+        self.max_k = int(os.getenv("SEARCH_MAX_K", "50"))
+        # Related past messages added to the chat prompt (0 disables)
+        self.chat_k = int(os.getenv("CHAT_MESSAGE_SEARCH_K", "0"))
+        self._queue: Optional[asyncio.Queue] = None
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+        return self._queue
+
+    def enqueue(self, message: Dict[str, Any], embedding: Optional[List[float]] = None):
+        """Schedule a stored message for embedding; pass `embedding` if its text was already embedded"""
+        if not self.enabled or not message.get("content"):
+            return
+        try:
+            self.queue.put_nowait((message, embedding))
+        except asyncio.QueueFull:
+            message_embeddings.inc(outcome="dropped")
+
+    async def _next_batch(self) -> List[Tuple[Dict[str, Any], Optional[List[float]]]]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    @timed("message_search.embed_batch")
+    async def embed_batch(self, batch: List[Tuple[Dict[str, Any], Optional[List[float]]]],
+                          client: Optional[OllamaClient] = None) -> int:
+        """Embed (where needed) and store a batch of messages; returns how many were stored.
+
+        `client` overrides the embedding model, as the backfill job does for a model cutover.
+        """
+        client = client or ollama_client
+        pending = [message for message, embedding in batch if not embedding]
+        vectors = iter(await client.generate_embeddings([m["content"] for m in pending]) if pending else [])
+
+        records = []
+        for message, embedding in batch:
+            reused = bool(embedding)
+            embedding = embedding or next(vectors, None)
+            if not embedding:
+                message_embeddings.inc(outcome="failed")
+                continue
+            message_embeddings.inc(outcome="reused" if reused else "embedded")
+            records.append({
+                "_id": message["_id"],
+                "user_id": message["user_id"],
+                "session_id": message["session_id"],
+                "created_at": message["created_at"],
+                "embed_model": client.embedding_model_tag,
+                "embedding": embedding
+            })
+        await get_storage().upsert_message_embeddings(records)
+        return len(records)
+
+    async def run_forever(self):
+        """Drain the embedding queue in batches, off the request path"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.embed_batch(batch)
+            except Exception as e:
+                message_embeddings.inc(len(batch), outcome="failed")
+                logger.error("Message embedding batch failed", extra={"messages": len(batch), "error": str(e)})
+
+    @timed("message_search.search")
+    async def search(self, user_id: str, query: str, k: int = 10, session_id: Optional[str] = None,
+                     since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     query_embedding: Optional[List[float]] = None,
+                     exclude_ids: Optional[List[Any]] = None) -> List[Dict[str, Any]]:
+        """Top-k messages most similar to `query`, each with a `score`; reuses `query_embedding` if given"""
+        if query_embedding is None:
+            query_embedding = await ollama_client.generate_embedding(query)
+        if not query_embedding:
+            return []
+
+        with span("message_search.fetch_vectors"):
+            rows = await get_storage().find_message_embeddings(
+                user_id, ollama_client.embedding_model_tag, session_id, since, until
+            )
+        excluded = set(exclude_ids or [])
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        rows = [row for row in rows if len(row["vector"]) == 4 * len(query_vector) and row["_id"] not in excluded]
+        if not rows:
+            return []
+
+        with span("message_search.score"):
+            matrix = np.frombuffer(b"".join(row["vector"] for row in rows), dtype="<f4").reshape(len(rows), -1)
+            norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vector)
+            norms[norms == 0] = np.inf
+            scores = matrix @ query_vector / norms
+            k = min(k, len(rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top], kind="stable")]
+
+        messages = {m["_id"]: m for m in await get_storage().get_messages_by_ids([rows[i]["_id"] for i in top])}
+        return [
+            dict(messages[rows[i]["_id"]], score=float(scores[i]))
+            for i in top if rows[i]["_id"] in messages
+        ]
+
+# Global instance
+message_search = MessageSearch()
@@ -0,0 +1,302 @@
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator, Deque, Set
+from collections import deque
+from datetime import datetime
+import asyncio
+import logging
+import os
+import time
+from bson import ObjectId
+from app.storage import get_storage
+from app.memory.short_term import short_term_memory
+from app.memory.long_term import long_term_memory
+from app.memory.episodic import episodic_memory
+from app.memory.message_search import message_search
+from app.services.ollama_client import ollama_client
+from app.services.embeddings import find_top_similar_episodes
+from app.services.retention import retention_policy
+from app.services.prompt import compose_chat_messages
+from app.services.metrics import span, registry
+
+logger = logging.getLogger(__name__)
+
+sockets_open = registry.gauge("chat_websockets_open", "WebSocket chat sessions currently open")
+resident_bytes = registry.gauge("chat_websocket_state_bytes", "Approximate memory held by resident session state")
+state_size = registry.histogram(
+    "chat_websocket_state_size_bytes", "Approximate resident state per socket, observed after each turn",
+    buckets=(1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6, 1e7, 5e7)
+)
+session_writes = registry.counter("chat_websocket_writes_total", "Deferred session writes by kind and outcome")
+
+# Rough per-object overheads of the resident dicts, for the memory estimate
+MESSAGE_OVERHEAD = 400
+EPISODE_OVERHEAD = 600
+# A Python float in a list: the float object plus the list's pointer to it
+FLOAT_BYTES = 32
+
+class SessionState:
+    """One session's memory, loaded when a WebSocket connects and kept current while it is open.
+
+    Messages, episodes and summaries are applied to the resident copy first; the writes behind them
+    run in order on a per-session queue, so a turn never waits on storage or on extraction and
+    summarization. Summaries are re-read every SESSION_STATE_REFRESH_S to pick up profiles written
+    by the scheduler or other workers.
+    """
+
+    def __init__(self, user_id: str, session_id: str):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.recent_messages: Deque[Dict[str, Any]] = deque(maxlen=short_term_memory.window_size)
+        self.session_summary: Optional[Dict[str, Any]] = None
+        self.lifetime_summary: Optional[Dict[str, Any]] = None
+        self.episodes: List[Dict[str, Any]] = []
+        self.user_message_count = 0
+        self.refresh_interval = float(os.getenv("SESSION_STATE_REFRESH_S", "300"))
+        self.summaries_loaded_at = 0.0
+        self.resident_bytes = 0
+        self._writes: asyncio.Queue = asyncio.Queue()
+        self._writer: Optional[asyncio.Task] = None
+
+    async def load(self):
+        """Read the session's memory from storage and start the write queue"""
+        with span("session_state.load"):
+            self.recent_messages.extend(await short_term_memory.get_recent_messages(self.user_id, self.session_id))
+            await self.refresh_summaries()
+            self.episodes = episodic_memory.with_active_embeddings(
+                await get_storage().find_episodes(self.user_id, self.session_id)
+            )
+            self.user_message_count = await short_term_memory.get_user_message_count(self.user_id, self.session_id)
+        self.start()
+
+    def start(self):
+        """Start the write queue; `load` calls this, callers that fill the state themselves call it after"""
+        self._writer = asyncio.create_task(self._drain())
+
+    async def refresh_summaries(self):
+        self.session_summary = await long_term_memory.get_latest_summary(self.user_id, "session", self.session_id)
+        self.lifetime_summary = await long_term_memory.get_latest_summary(self.user_id, "user")
+        self.summaries_loaded_at = time.monotonic()
+
+    def size_bytes(self) -> int:
+        """Approximate memory held by this state: text, vectors and per-object overhead"""
+        size = sum(MESSAGE_OVERHEAD + len(msg["content"]) for msg in self.recent_messages)
+        size += sum(
+            EPISODE_OVERHEAD + len(ep.get("fact", "")) + FLOAT_BYTES * len(ep.get("embedding") or [])
+            for ep in self.episodes
+        )
+        for summary in (self.session_summary, self.lifetime_summary):
+            if summary:
+                size += MESSAGE_OVERHEAD + len(summary["text"])
+        return size
+
+    def defer(self, kind: str, write: Callable[[], Awaitable[Any]]):
+        """Queue a write to run after the ones before it"""
+        self._writes.put_nowait((kind, write))
+
+    async def _drain(self):
+        while True:
+            item = await self._writes.get()
+            if item is None:
+                return
+            kind, write = item
+            try:
+                await write()
+                session_writes.inc(kind=kind, outcome="ok")
+            except Exception as e:
+                session_writes.inc(kind=kind, outcome="error")
+                logger.error("Deferred session write failed",
+                             extra={"user_id": self.user_id, "session_id": self.session_id, "kind": kind, "error": str(e)})
+
+    def close(self) -> Optional[asyncio.Task]:
+        """Stop taking writes; the returned task finishes the ones already queued"""
+        self._writes.put_nowait(None)
+        return self._writer
+
+    def add_message(self, role: str, content: str, embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """Append a message to the resident history and queue its insert"""
+        message = {
+            "_id": ObjectId(),
+            "user_id": self.user_id,
+            "session_id": self.session_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.utcnow()
+        }
+        self.recent_messages.append(message)
+
+        async def write():
+            await get_storage().insert_message(message)
+            message_search.enqueue(message, embedding)
+        self.defer("message", write)
+        return message
+
+    def apply_episodes(self, stored: List[Dict[str, Any]]):
+        """Fold newly stored or merged episodes into the resident set"""
+        positions = {ep["_id"]: i for i, ep in enumerate(self.episodes)}
+        for episode in stored:
+            if episode.get("_id") in positions:
+                self.episodes[positions[episode["_id"]]] = episode
+            elif episode.get("session_id") == self.session_id:
+                self.episodes.append(episode)
+
+    async def retrieve(self, message: str, query_embedding: List[float]) -> List[Dict[str, Any]]:
+        """Rank the resident episodes against the query, as /api/chat ranks the stored ones"""
+        if not query_embedding:
+            # Without a vector only the lexical index can help, and it lives outside this state
+            return await episodic_memory.retrieve_relevant_episodes(
+                self.user_id, message, self.session_id, query_embedding=[]
+            )
+        with span("session_state.score"):
+            if episodic_memory.ranking == "blended":
+                relevant = retention_policy.rank_blended(
+                    query_embedding, self.episodes, episodic_memory.top_k, episodic_memory.similarity_weight
+                )
+            else:
+                relevant = find_top_similar_episodes(query_embedding, self.episodes, episodic_memory.top_k)
+        if relevant:
+            now = datetime.utcnow()
+            for episode in relevant:
+                episode["last_accessed_at"] = now
+                episode["access_count"] = int(episode.get("access_count", 0)) + 1
+            ids = [ep["_id"] for ep in relevant]
+            self.defer("touch", lambda: get_storage().touch_episodes(ids, now))
+        return relevant
+
+    async def chat(self, text: str, query_embedding: Optional[List[float]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Run one chat turn, yielding `token` events as the reply streams and a final `done` event.
+
+        Pass `query_embedding` if the message was already embedded (an empty list if that failed).
+        """
+        degraded = []
+        if time.monotonic() - self.summaries_loaded_at > self.refresh_interval:
+            await self.refresh_summaries()
+
+        if query_embedding is None:
+            query_embedding = []
+            if ollama_client.available("embed"):
+                with span("session_state.query_embedding"):
+                    query_embedding = await episodic_memory.query_embedding(text)
+            else:
+                degraded.append("embedding_retrieval")
+        elif not query_embedding:
+            degraded.append("embedding_retrieval")
+        # Like /api/chat, the prompt's recent conversation ends with this message
+        self.add_message("user", text, query_embedding)
+        self.user_message_count += 1
+        short_term_count = len(self.recent_messages)
+
+        relevant_episodes = await self.retrieve(text, query_embedding)
+        related_messages = []
+        if message_search.chat_k and query_embedding:
+            with span("session_state.message_search"):
+                related_messages = await message_search.search(
+                    self.user_id, text, message_search.chat_k, query_embedding=query_embedding,
+                    exclude_ids=[msg["_id"] for msg in self.recent_messages]
+                )
+
+        messages_for_llm, _ = compose_chat_messages(
+            text, list(self.recent_messages), self.session_summary, self.lifetime_summary,
+            relevant_episodes, related_messages
+        )
+        parts = []
+        with span("session_state.generate"):
+            async for token in ollama_client.stream_chat_completion(messages_for_llm):
+                parts.append(token)
+                yield {"type": "token", "text": token}
+        reply = "".join(parts)
+        self.add_message("assistant", reply)
+
+        # Extraction and summaries run on the write queue; their results land in the resident state
+        if ollama_client.available("extract") and ollama_client.available("embed"):
+            async def extract():
+                self.apply_episodes(
+                    await episodic_memory.extract_and_store_episodes(self.user_id, self.session_id, text)
+                )
+            self.defer("extract", extract)
+        else:
+            degraded.append("episode_extraction")
+
+        if self.user_message_count % long_term_memory.summarize_every == 0:
+            if ollama_client.available("summarize"):
+                async def summarize():
+                    summary = await long_term_memory.generate_session_summary(self.user_id, self.session_id)
+                    if summary:
+                        self.session_summary = summary
+                self.defer("summary", summarize)
+            else:
+                degraded.append("session_summary")
+
+        memory_used = {
+            "short_term_count": short_term_count,
+            "long_term_summary": self.lifetime_summary["text"] if self.lifetime_summary else None,
+            "episodic_facts": [ep["fact"] for ep in relevant_episodes]
+        }
+        if degraded:
+            memory_used["degraded"] = degraded
+        yield {"type": "done", "reply": reply, "memory_used": memory_used}
+
+class SessionStates:
+    """Tracks the sessions held open by WebSockets in this worker, the memory they hold, and the writes
+    still queued by closed states"""
+
+    def __init__(self):
+        # Further sockets are refused so resident state can't grow without bound
+        self.max_sockets = int(os.getenv("WS_MAX_SESSIONS", "1000"))
+        self.open_states: Set[SessionState] = set()
+        # Writers still flushing queued writes for sockets that have closed
+        self.flushing: Set[asyncio.Task] = set()
+
+    @property
+    def full(self) -> bool:
+        return len(self.open_states) >= self.max_sockets
+
+    async def open(self, user_id: str, session_id: str) -> SessionState:
+        state = SessionState(user_id, session_id)
+        await state.load()
+        self.open_states.add(state)
+        sockets_open.inc()
+        self.measure(state)
+        return state
+
+    def measure(self, state: SessionState):
+        """Refresh a state's size in the gauges after it changed"""
+        size = state.size_bytes()
+        resident_bytes.inc(size - state.resident_bytes)
+        state.resident_bytes = size
+        state_size.observe(size)
+
+    def release(self, state: SessionState):
+        """Drop a closed socket's state once its queued writes are done"""
+        if state not in self.open_states:
+            return
+        self.open_states.discard(state)
+        sockets_open.dec()
+        resident_bytes.dec(state.resident_bytes)
+        state.resident_bytes = 0
+        self.finish(state)
+
+    def finish(self, state: SessionState) -> Optional[asyncio.Task]:
+        """Close a state; its queued writes finish in the background, and `flush` waits for them on shutdown"""
+        writer = state.close()
+        if writer is not None and not writer.done():
+            self.flushing.add(writer)
+            writer.add_done_callback(self.flushing.discard)
+        return writer
+
+    async def flush(self, timeout: float = 10.0):
+        """On shutdown: close every state and wait for queued writes to finish"""
+        for state in list(self.open_states):
+            self.release(state)
+        if self.flushing:
+            await asyncio.wait(list(self.flushing), timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        sizes = [state.resident_bytes for state in self.open_states]
+        return {
+            "open": len(sizes),
+            "state_bytes": sum(sizes),
+            "largest_state_bytes": max(sizes, default=0),
+            "flushing": len(self.flushing)
+        }
+
+# Global instance
+session_states = SessionStates()
@@ -1,52 +1,58 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
-from app.database import get_database
+from app.storage import get_storage
+from app.services.metrics import timed
+from app.services.pagination import fetch_page
 import os
 
 class ShortTermMemory:
     def __init__(self):
         self.window_size = int(os.getenv("SHORT_TERM_N", "10"))
-    
+
+    @timed("short_term.add_message")
+    async def add_message(self, user_id: str, session_id: str, role: str, content: str) -> Dict[str, Any]:
+        """Store a message in the session history"""
+        message = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "role": role,
+            "content": content,
+            "created_at": datetime.utcnow()
+        }
+        return await get_storage().insert_message(message)
+
+    @timed("short_term.get_recent_messages")
     async def get_recent_messages(self, user_id: str, session_id: str = "default", limit: int = None) -> List[Dict[str, Any]]:
         """Get recent messages for short-term memory"""
-        db = await get_database()
-        
         if limit is None:
             limit = self.window_size
-        
-        cursor = db.messages.find(
-            {"user_id": user_id, "session_id": session_id}
-        ).sort("created_at", -1).limit(limit)
-        
-        messages = await cursor.to_list(length=limit)
-        
+
+        messages = await get_storage().get_recent_messages(user_id, session_id, limit)
+
         # Reverse to get chronological order (oldest first)
         messages.reverse()
-        
+
         return messages
-    
+
+    @timed("short_term.get_message_page")
+    async def get_message_page(self, user_id: str, session_id: str = "default", limit: int = 50,
+                               cursor: Optional[str] = None) -> Dict[str, Any]:
+        """Get one page of session history, newest first, continuing from `cursor`"""
+        return await fetch_page(
+            "messages",
+            lambda n, before: get_storage().get_recent_messages(user_id, session_id, n, before=before),
+            limit, cursor
+        )
+
+    @timed("short_term.get_message_count")
     async def get_message_count(self, user_id: str, session_id: str = "default") -> int:
         """Get total message count for a session"""
-        db = await get_database()
-        
-        count = await db.messages.count_documents({
-            "user_id": user_id, 
-            "session_id": session_id
-        })
-        
-        return count
-    
+        return await get_storage().count_messages(user_id, session_id)
+
+    @timed("short_term.get_user_message_count")
     async def get_user_message_count(self, user_id: str, session_id: str = "default") -> int:
         """Get count of user messages (not assistant) in a session"""
-        db = await get_database()
-        
-        count = await db.messages.count_documents({
-            "user_id": user_id, 
-            "session_id": session_id,
-            "role": "user"
-        })
-        
-        return count
+        return await get_storage().count_messages(user_id, session_id, role="user")
 
 # Global instance
 short_term_memory = ShortTermMemory()
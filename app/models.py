@@ -17,6 +17,11 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = "default"
     message: str
 
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest]
+    # Turns run at once; capped at CHAT_BATCH_CONCURRENCY
+    concurrency: Optional[int] = Field(None, ge=1)
+
 class MemoryRequest(BaseModel):
     user_id: str
     session_id: Optional[str] = "default"
@@ -34,6 +39,23 @@ class MemoryResponse(BaseModel):
     lifetime_summary: Optional[str]
     recent_episodes: List[str]
 
+class PageResponse(BaseModel):
+    items: List[dict]
+    next_cursor: Optional[str] = None
+
+class SearchHit(BaseModel):
+    message_id: str
+    session_id: str
+    role: str
+    content: str
+    created_at: datetime
+    score: float
+
+class SearchResponse(BaseModel):
+    user_id: str
+    query: str
+    results: List[SearchHit]
+
 class DailyCount(BaseModel):
     date: str
     count: int
@@ -65,6 +87,8 @@ class Summary(BaseModel):
     session_id: Optional[str] = None
     scope: Scope
     text: str
+    watermark_at: Optional[datetime] = None
+    watermark_id: Optional[str] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class Episode(BaseModel):
@@ -73,6 +97,8 @@ class Episode(BaseModel):
     fact: str
     importance: float = Field(ge=0.0, le=1.0)
     embedding: List[float]
+    mention_count: int = 1
+    last_seen_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class EpisodeExtraction(BaseModel):
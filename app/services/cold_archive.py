@@ -0,0 +1,450 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
+from bson import ObjectId, json_util
+from app.storage import get_storage
+from app.services.ollama_client import ollama_client
+from app.services.embedding_store import embedding_store
+from app.services.lexical_index import lexical_index
+from app.services.metrics import registry, span
+
+logger = logging.getLogger(__name__)
+
+archive_operations = registry.counter("cold_archive_sessions_total", "Sessions moved to or from the cold archive, by op and outcome")
+rehydrate_duration = registry.histogram("cold_archive_rehydrate_seconds", "Time to bring an archived session back into storage")
+
+FORMAT_VERSION = 1
+EPOCH = datetime(1970, 1, 1)
+# While archive runs keep changing the manifest, the cached key set is reloaded at most this often;
+# in between, lookups query the manifest directly
+MANIFEST_RELOAD_INTERVAL_S = 1.0
+
+# Column kinds, each stored as one or two flat arrays:
+#   id   ObjectIds as rows of 12 bytes
+#   time naive UTC datetimes as int64 microseconds since the epoch
+#   text UTF-8 bytes of every row back to back, plus int64 end offsets
+#   vec  float32 values of every row back to back, plus int64 end offsets
+# A field goes into a column only if every record has it with the column's type; anything else is
+# kept per record in the `extra` text column as extended JSON.
+MESSAGE_COLUMNS = {"_id": "id", "created_at": "time", "role": "text", "content": "text"}
+EPISODE_COLUMNS = {"_id": "id", "created_at": "time", "fact": "text", "embedding": "vec"}
+VECTOR_COLUMNS = {"_id": "id", "created_at": "time", "vector": "vec"}
+# Stored once in the file header rather than per record
+SESSION_FIELDS = ("user_id", "session_id")
+
+def _fits(kind: str, value: Any) -> bool:
+    if kind == "id":
+        return isinstance(value, ObjectId)
+    if kind == "time":
+        return isinstance(value, datetime) and value.tzinfo is None
+    if kind == "text":
+        return isinstance(value, str)
+    return isinstance(value, (list, bytes)) and len(value) > 0
+
+def _packed(chunks: List[bytes]) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.cumsum([len(chunk) for chunk in chunks], dtype=np.int64)
+    return np.frombuffer(b"".join(chunks), dtype=np.uint8), offsets
+
+def _unpacked(data: np.ndarray, offsets: np.ndarray) -> List[bytes]:
+    raw = data.tobytes()
+    starts = np.concatenate(([0], offsets[:-1]))
+    return [raw[start:end] for start, end in zip(starts.tolist(), offsets.tolist())]
+
+def _encode_table(name: str, records: List[Dict[str, Any]], columns: Dict[str, str]) -> Dict[str, np.ndarray]:
+    """Split records into typed column arrays named `<name>.<field>`"""
+    arrays: Dict[str, np.ndarray] = {}
+    kinds = {
+        field: kind for field, kind in columns.items()
+        if records and all(_fits(kind, record.get(field)) for record in records)
+    }
+    for field, kind in kinds.items():
+        values = [record[field] for record in records]
+        key = f"{name}.{field}"
+        if kind == "id":
+            arrays[key] = np.frombuffer(b"".join(value.binary for value in values), dtype=np.uint8).reshape(-1, 12)
+        elif kind == "time":
+            arrays[key] = np.array([(value - EPOCH) // timedelta(microseconds=1) for value in values], dtype=np.int64)
+        elif kind == "text":
+            arrays[key], arrays[key + ".offsets"] = _packed([value.encode() for value in values])
+        else:
+            arrays[key], arrays[key + ".offsets"] = _packed([
+                value if isinstance(value, bytes) else np.asarray(value, dtype="<f4").tobytes() for value in values
+            ])
+    skip = set(kinds) | set(SESSION_FIELDS)
+    extra = [json_util.dumps({k: v for k, v in record.items() if k not in skip}).encode() for record in records]
+    arrays[f"{name}.extra"], arrays[f"{name}.extra.offsets"] = _packed(extra)
+    arrays[f"{name}.schema"] = np.frombuffer(json.dumps(kinds).encode(), dtype=np.uint8)
+    return arrays
+
+def _decode_table(name: str, arrays, header: Dict[str, Any], vectors_as_bytes: bool = False) -> List[Dict[str, Any]]:
+    kinds = json.loads(arrays[f"{name}.schema"].tobytes())
+    records = [
+        dict(json_util.loads(extra), **{field: header[field] for field in SESSION_FIELDS})
+        for extra in _unpacked(arrays[f"{name}.extra"], arrays[f"{name}.extra.offsets"])
+    ]
+    for field, kind in kinds.items():
+        key = f"{name}.{field}"
+        if kind == "id":
+            values = [ObjectId(row.tobytes()) for row in arrays[key]]
+        elif kind == "time":
+            values = [EPOCH + timedelta(microseconds=value) for value in arrays[key].tolist()]
+        elif kind == "text":
+            values = [value.decode() for value in _unpacked(arrays[key], arrays[key + ".offsets"])]
+        elif vectors_as_bytes:
+            values = _unpacked(arrays[key], arrays[key + ".offsets"])
+        else:
+            values = [np.frombuffer(value, dtype="<f4").tolist() for value in _unpacked(arrays[key], arrays[key + ".offsets"])]
+        for record, value in zip(records, values):
+            record[field] = value
+    return records
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+def _session_key(user_id: str, session_id: str) -> int:
+    digest = hashlib.blake2b(f"{user_id}\0{session_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+class ColdArchive:
+    """Moves idle sessions out of storage into compressed per-session files, and back on demand.
+
+    A session's messages, episodes and message vectors go into one `.npz` file under ARCHIVE_DIR,
+    one compressed array per column (see `_encode_table`). A SQLite manifest (`manifest.db`)
+    indexes the files by (user_id, session_id). Resuming or exporting an archived session
+    rehydrates it: the records are re-inserted with their original ids, and then the file and its
+    manifest row are removed. Summaries stay in storage, so listings and profiles are unaffected.
+    ARCHIVE_DIR must be shared by every worker that can serve the session's user. A manifest row
+    stays claimed while its archive run deletes the hot records, so a resume in another worker
+    waits for the run instead of restoring (and dropping) the file halfway through.
+
+    Every chat turn asks whether its session is archived. Each worker answers from a sorted array of
+    hashed (user_id, session_id) keys, reloaded when the manifest or its WAL changes on disk (any
+    worker's archive or rehydrate writes to it), so the usual check is two stat calls.
+    """
+
+    def __init__(self):
+        self.directory = os.getenv("ARCHIVE_DIR", "archive")
+        self.manifest_path = os.path.join(self.directory, "manifest.db")
+        # A claim older than this is taken to be from a crashed process and may be taken over
+        self.claim_timeout = float(os.getenv("ARCHIVE_CLAIM_TIMEOUT_S", "300"))
+        # Per-session locks, with the number of tasks holding or waiting on each
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._lock_users: Dict[Tuple[str, str], int] = {}
+        self._schema_ready = False
+        self._archived_keys = np.empty(0, dtype=np.uint64)
+        # Manifest file state the keys were loaded at; None forces a reload
+        self._archived_stamp: Optional[tuple] = None
+        self._last_reload = 0.0
+        self._reload_lock = asyncio.Lock()
+
+    # Manifest
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self.manifest_path, timeout=30, isolation_level=None)
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id TEXT NOT NULL, session_id TEXT NOT NULL, path TEXT NOT NULL, "
+                "messages INTEGER NOT NULL, episodes INTEGER NOT NULL, bytes INTEGER NOT NULL, "
+                "last_at TEXT NOT NULL, archived_at TEXT NOT NULL, "
+                "state TEXT NOT NULL DEFAULT 'archived', claimed_at REAL, "
+                "PRIMARY KEY (user_id, session_id))"
+            )
+            self._schema_ready = True
+        return conn
+
+    async def _manifest(self, sql: str, params: tuple = ()) -> Tuple[List[tuple], int]:
+        """Run one statement against the manifest; returns (rows, rowcount)"""
+        def run():
+            conn = self._connect()
+            try:
+                cursor = conn.execute(sql, params)
+                return cursor.fetchall(), cursor.rowcount
+            finally:
+                conn.close()
+        return await asyncio.to_thread(run)
+
+    def _manifest_stamp(self) -> Optional[tuple]:
+        """Modification time and size of the manifest and its WAL; None without a manifest"""
+        stamp = []
+        for path in (self.manifest_path, self.manifest_path + "-wal"):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                if path == self.manifest_path:
+                    return None
+                stamp.append(None)
+                continue
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    async def _reload_keys(self, stamp: tuple) -> bool:
+        """Reload the cached keys unless another reload is running or one ran too recently"""
+        if self._reload_lock.locked() or time.monotonic() - self._last_reload < MANIFEST_RELOAD_INTERVAL_S:
+            return False
+        async with self._reload_lock:
+            self._last_reload = time.monotonic()
+            rows, _ = await self._manifest("SELECT user_id, session_id FROM sessions")
+            # A write after the stamp was taken changes the files again, so the next check reloads
+            keys = np.fromiter((_session_key(user_id, session_id) for user_id, session_id in rows),
+                               dtype=np.uint64, count=len(rows))
+            self._archived_keys = np.sort(keys)
+            self._archived_stamp = stamp
+        return True
+
+    async def _in_manifest(self, user_id: str, session_id: str) -> bool:
+        rows, _ = await self._manifest(
+            "SELECT 1 FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id)
+        )
+        return bool(rows)
+
+    async def is_archived(self, user_id: str, session_id: str) -> bool:
+        stamp = self._manifest_stamp()
+        if stamp is None:
+            return False
+        if stamp != self._archived_stamp and not await self._reload_keys(stamp):
+            return await self._in_manifest(user_id, session_id)
+        keys = self._archived_keys
+        key = np.uint64(_session_key(user_id, session_id))
+        index = int(np.searchsorted(keys, key))
+        # A hash collision only costs a rehydration attempt that finds nothing to claim
+        return index < len(keys) and keys[index] == key
+
+    async def archived_sessions(self, user_id: str) -> List[str]:
+        if not os.path.exists(self.manifest_path):
+            return []
+        rows, _ = await self._manifest("SELECT session_id FROM sessions WHERE user_id = ?", (user_id,))
+        return [row[0] for row in rows]
+
+    async def stats(self) -> Dict[str, Any]:
+        if not os.path.exists(self.manifest_path):
+            return {"sessions": 0, "messages": 0, "episodes": 0, "bytes": 0}
+        rows, _ = await self._manifest(
+            "SELECT COUNT(*), COALESCE(SUM(messages), 0), COALESCE(SUM(episodes), 0), COALESCE(SUM(bytes), 0) FROM sessions"
+        )
+        return dict(zip(("sessions", "messages", "episodes", "bytes"), rows[0]))
+
+    # Files
+
+    def _path(self, user_id: str, session_id: str) -> str:
+        # Unique per archive run, so two runs racing on a session never overwrite each other's file
+        user = _digest(user_id)
+        return os.path.join(self.directory, user[:2], user, f"{_digest(session_id)}.{ObjectId()}.npz")
+
+    def _write(self, path: str, arrays: Dict[str, np.ndarray]) -> int:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(buffer.getvalue())
+
+    def _read(self, path: str) -> Dict[str, List[Dict[str, Any]]]:
+        with np.load(path) as arrays:
+            header = json.loads(arrays["header"].tobytes())
+            return {
+                "messages": _decode_table("messages", arrays, header),
+                "episodes": _decode_table("episodes", arrays, header),
+                "vectors": _decode_table("vectors", arrays, header, vectors_as_bytes=True),
+                "embed_model": header["embed_model"],
+            }
+
+    # Archiving
+
+    async def _read_session(self, user_id: str, session_id: str, batch_size: int = 1000) -> List[Dict[str, Any]]:
+        storage = get_storage()
+        messages: List[Dict[str, Any]] = []
+        after = None
+        while True:
+            batch = await storage.get_messages_after(user_id, session_id, after, batch_size)
+            messages.extend(batch)
+            if len(batch) < batch_size:
+                return messages
+            after = (batch[-1]["created_at"], batch[-1]["_id"])
+
+    async def archive_session(self, user_id: str, session_id: str, idle_before: datetime) -> Optional[Dict[str, int]]:
+        """Move one session to the archive if it is still idle; returns what was moved, or None"""
+        async with self._session_lock(user_id, session_id):
+            # A session archived before and partly written to since is merged back first
+            await self._rehydrate(user_id, session_id)
+            storage = get_storage()
+            with span("cold_archive.read"):
+                messages = await self._read_session(user_id, session_id)
+                if not messages or messages[-1]["created_at"] >= idle_before:
+                    return None
+                episodes = await storage.find_episodes(user_id, session_id)
+                embed_model = ollama_client.embedding_model_tag
+                vectors = await storage.find_message_embeddings(user_id, embed_model, session_id)
+
+            path = self._path(user_id, session_id)
+            header = {"version": FORMAT_VERSION, "user_id": user_id, "session_id": session_id, "embed_model": embed_model}
+            arrays = {"header": np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)}
+            arrays.update(_encode_table("messages", messages, MESSAGE_COLUMNS))
+            arrays.update(_encode_table("episodes", episodes, EPISODE_COLUMNS))
+            arrays.update(_encode_table("vectors", vectors, VECTOR_COLUMNS))
+            with span("cold_archive.write"):
+                size = await asyncio.to_thread(self._write, path, arrays)
+
+            # The manifest row goes in before anything is deleted, so a resume from now on rehydrates.
+            # It starts out claimed ('archiving'), so no process can rehydrate and drop the file while
+            # the records are still being deleted; a resume meanwhile waits in _claim. If this process
+            # dies before releasing it, the claim times out and the next resume restores the session.
+            claimed_at = time.time()
+            _, inserted = await self._manifest(
+                "INSERT INTO sessions (user_id, session_id, path, messages, episodes, bytes, last_at, archived_at, "
+                "state, claimed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'archiving', ?) ON CONFLICT DO NOTHING",
+                (user_id, session_id, os.path.relpath(path, self.directory), len(messages), len(episodes), size,
+                 messages[-1]["created_at"].isoformat(), datetime.utcnow().isoformat(), claimed_at)
+            )
+            if not inserted:
+                # Another process archived it in the meantime
+                os.remove(path)
+                archive_operations.inc(op="archive", outcome="raced")
+                return None
+            self._archived_stamp = None
+            newest = await storage.get_recent_messages(user_id, session_id, 1)
+            if newest and newest[0]["_id"] != messages[-1]["_id"]:
+                # Written to while being archived: leave it hot
+                await self._forget(user_id, session_id, path)
+                archive_operations.inc(op="archive", outcome="raced")
+                return None
+
+            try:
+                with span("cold_archive.delete"):
+                    # Only the archived records are deleted; anything written meanwhile stays hot
+                    # and is merged with the archive when the session is next resumed
+                    await storage.delete_messages([message["_id"] for message in messages])
+                    episode_ids = [episode["_id"] for episode in episodes]
+                    await storage.delete_episodes(episode_ids)
+                    await embedding_store.remove(episode_ids)
+                    lexical_index.remove(user_id, episode_ids)
+            finally:
+                # Claimable from here on, even after a failed delete: rehydrating restores whatever went
+                await self._manifest(
+                    "UPDATE sessions SET state = 'archived', claimed_at = NULL "
+                    "WHERE user_id = ? AND session_id = ? AND state = 'archiving' AND claimed_at = ?",
+                    (user_id, session_id, claimed_at)
+                )
+            archive_operations.inc(op="archive", outcome="ok")
+            return {"messages": len(messages), "episodes": len(episodes), "bytes": size}
+
+    async def _forget(self, user_id: str, session_id: str, path: str):
+        await self._manifest("DELETE FROM sessions WHERE user_id = ? AND session_id = ?", (user_id, session_id))
+        self._archived_stamp = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Rehydration
+
+    @asynccontextmanager
+    async def _session_lock(self, user_id: str, session_id: str) -> AsyncIterator[None]:
+        """Serialize archive and rehydrate per session in this process; the lock is dropped once unused"""
+        key = (user_id, session_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._lock_users[key] = self._lock_users.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[key] -= 1
+            if not self._lock_users[key]:
+                del self._lock_users[key]
+                del self._locks[key]
+
+    async def ensure_hot(self, user_id: str, session_id: str):
+        """Bring a session back into storage if it was archived; a cheap no-op otherwise"""
+        if not await self.is_archived(user_id, session_id):
+            return
+        async with self._session_lock(user_id, session_id):
+            await self._rehydrate(user_id, session_id)
+
+    async def ensure_user_hot(self, user_id: str):
+        """Rehydrate every archived session of a user, e.g. before an export"""
+        for session_id in await self.archived_sessions(user_id):
+            await self.ensure_hot(user_id, session_id)
+
+    async def _claim(self, user_id: str, session_id: str) -> Optional[str]:
+        """Mark the session as being rehydrated by this process; returns its file, or None if there is nothing
+        to claim. Waits while another process holds the claim."""
+        while True:
+            now = time.time()
+            rows, _ = await self._manifest(
+                "UPDATE sessions SET state = 'rehydrating', claimed_at = ? "
+                "WHERE user_id = ? AND session_id = ? AND (state = 'archived' OR claimed_at < ?) RETURNING path",
+                (now, user_id, session_id, now - self.claim_timeout)
+            )
+            if rows:
+                return os.path.join(self.directory, rows[0][0])
+            if not await self._in_manifest(user_id, session_id):
+                return None
+            await asyncio.sleep(0.1)
+
+    async def _rehydrate(self, user_id: str, session_id: str):
+        if not os.path.exists(self.manifest_path):
+            return
+        path = await self._claim(user_id, session_id)
+        if path is None:
+            return
+        start = time.perf_counter()
+        try:
+            archived = await asyncio.to_thread(self._read, path)
+            await self._restore(archived)
+        except Exception:
+            await self._manifest(
+                "UPDATE sessions SET state = 'archived', claimed_at = NULL WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            )
+            archive_operations.inc(op="rehydrate", outcome="error")
+            raise
+        await self._forget(user_id, session_id, path)
+        rehydrate_duration.observe(time.perf_counter() - start)
+        archive_operations.inc(op="rehydrate", outcome="ok")
+        logger.info("Rehydrated archived session", extra={
+            "user_id": user_id, "session_id": session_id,
+            "messages": len(archived["messages"]), "episodes": len(archived["episodes"])
+        })
+
+    async def _restore(self, archived: Dict[str, Any]):
+        """Re-insert archived records that aren't in storage; safe to repeat after a partial restore"""
+        storage = get_storage()
+        messages = archived["messages"]
+        present = {m["_id"] for m in await storage.get_messages_by_ids([m["_id"] for m in messages])}
+        missing = [message for message in messages if message["_id"] not in present]
+        if missing:
+            await storage.insert_messages(missing)
+
+        present = {e["_id"] for e in await storage.get_episodes_by_ids([e["_id"] for e in archived["episodes"]])}
+        restored = []
+        for episode in archived["episodes"]:
+            if episode["_id"] not in present:
+                restored.append(await storage.insert_episode(episode))
+        await embedding_store.add(restored)
+        lexical_index.add(restored)
+
+        if archived["vectors"] and archived["embed_model"] == ollama_client.embedding_model_tag:
+            await storage.upsert_message_embeddings([
+                {
+                    "_id": record["_id"], "user_id": record["user_id"], "session_id": record["session_id"],
+                    "created_at": record["created_at"], "embed_model": archived["embed_model"],
+                    "embedding": np.frombuffer(record["vector"], dtype="<f4").tolist()
+                }
+                for record in archived["vectors"]
+            ])
+
+# Global instance
+cold_archive = ColdArchive()
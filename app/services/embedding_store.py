@@ -0,0 +1,440 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from bson import ObjectId
+from app.storage import get_storage
+from app.services.ollama_client import ollama_client
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+store_operations = registry.counter("embedding_store_operations_total", "Shared embedding store operations, by op and role")
+
+# File layout (little-endian): a 64-byte header, then one column per field, each `capacity` rows long:
+#   users u8 | sessions u8 | ids 12 bytes | alive u1 | (pad to 8) | vectors f4 x dim
+# Columns keep the per-query user mask a contiguous scan rather than a stride through the vectors.
+MAGIC = b"EMBSTOR1"
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("dim", "<u4"),
+    ("retired", "<u4"),     # set on a file once a rewrite has replaced it; readers reopen the path
+    ("capacity", "<u8"),
+    ("count", "<u8"),       # rows published; readers never look past it
+    ("live", "<u8"),        # rows not tombstoned
+    ("generation", "<u8"),  # bumped on every write, so readers can tell something changed
+    ("model", "<u8"),       # hash of the embedding model tag the vectors came from
+])
+
+def _hash(value: Optional[str]) -> int:
+    return int.from_bytes(hashlib.blake2b((value or "").encode(), digest_size=8).digest(), "little")
+
+def _default_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "llm-memory-embeddings")
+
+class _Mapping:
+    """A memory-mapped store file, viewed as numpy columns without copying"""
+
+    def __init__(self, path: str, writable: bool = False):
+        with open(path, "r+b" if writable else "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.header = np.frombuffer(self.mm, HEADER_DTYPE, count=1)
+        if self.header["magic"][0] != MAGIC:
+            raise ValueError(f"{path} is not an embedding store")
+        self.dim = int(self.header["dim"][0])
+        self.capacity = int(self.header["capacity"][0])
+
+        offset = HEADER_SIZE
+        self.users = np.frombuffer(self.mm, "<u8", self.capacity, offset)
+        offset += 8 * self.capacity
+        self.sessions = np.frombuffer(self.mm, "<u8", self.capacity, offset)
+        offset += 8 * self.capacity
+        self.ids = np.frombuffer(self.mm, np.uint8, 12 * self.capacity, offset).reshape(self.capacity, 12)
+        offset += 12 * self.capacity
+        self.alive = np.frombuffer(self.mm, np.uint8, self.capacity, offset)
+        offset += self.capacity + (-(offset + self.capacity) % 8)
+        self.vectors = np.frombuffer(self.mm, "<f4", self.dim * self.capacity, offset).reshape(self.capacity, self.dim)
+
+    @staticmethod
+    def file_size(dim: int, capacity: int) -> int:
+        size = HEADER_SIZE + (8 + 8 + 12 + 1) * capacity
+        return size + (-size % 8) + 4 * dim * capacity
+
+    @classmethod
+    def create(cls, path: str, dim: int, capacity: int, model: int) -> "_Mapping":
+        with open(path, "wb") as f:
+            f.truncate(cls.file_size(dim, capacity))
+            header = np.zeros(1, HEADER_DTYPE)
+            header["magic"], header["dim"], header["capacity"], header["model"] = MAGIC, dim, capacity, model
+            f.write(header.tobytes())
+        return cls(path, writable=True)
+
+    def get(self, field: str) -> int:
+        return int(self.header[field][0])
+
+class SharedEmbeddingStore:
+    """Episode vectors in one shared-memory file that every worker process maps read-only.
+
+    One process (whichever holds the lock file) is the writer: it builds the file from storage and
+    applies adds and removals. The other workers forward their writes to it over a Unix socket and
+    see them through the header's row count and generation. Storage stays the source of truth;
+    the store only answers "which episode ids are nearest", and callers fetch those documents.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("EMBEDDING_STORE", "off").lower() == "shared"
+        self.path = os.getenv("EMBEDDING_STORE_PATH") or _default_path()
+        self.socket_path = self.path + ".sock"
+        self.lock_path = self.path + ".lock"
+        self.initial_capacity = int(os.getenv("EMBEDDING_STORE_CAPACITY", "65536"))
+        self.rebuild_interval = float(os.getenv("EMBEDDING_STORE_REBUILD_S", "3600"))
+        # Rewrite the file once this fraction of its rows are tombstones
+        self.max_dead_fraction = float(os.getenv("EMBEDDING_STORE_MAX_DEAD_FRACTION", "0.3"))
+
+        self.is_writer = False
+        self._map: Optional[_Mapping] = None
+        self._lock_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._tasks: List[asyncio.Task] = []
+        self._writer_conn: Optional[asyncio.StreamWriter] = None
+
+        # Writer-only state
+        self._rows: Dict[bytes, int] = {}
+        self._rebuilding = False
+        self._deferred: List[Dict[str, Any]] = []
+
+    # Lifecycle
+
+    async def start(self):
+        """Join the store: become the writer if nobody else is, otherwise map the writer's file"""
+        if not self.enabled:
+            return
+        if not await self._try_become_writer():
+            self._tasks.append(asyncio.create_task(self._watch_writer()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
+        if self._lock_file is not None:
+            # Release the lock so another worker can take over as writer
+            self._lock_file.close()
+            self._lock_file = None
+        self.is_writer = False
+
+    async def _try_become_writer(self) -> bool:
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        self.is_writer = True
+        self._adopt_file()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._handle_client, path=self.socket_path)
+        self._tasks.append(asyncio.create_task(self._rebuild_periodically()))
+        logger.info("Embedding store writer started", extra={"path": self.path, "pid": os.getpid()})
+        return True
+
+    def _adopt_file(self):
+        """Reopen the previous writer's file writable, so the first rebuild can retire it for the
+        readers still mapping it, and index its rows so adds before then aren't duplicated"""
+        self._map = None
+        self._rows = {}
+        try:
+            self._map = _Mapping(self.path, writable=True)
+        except (FileNotFoundError, ValueError):
+            return
+        self._rows = {r["id"]: r["row"] for r in self._live_records()}
+
+    async def _watch_writer(self):
+        # Take over if the writer process goes away
+        while not self.is_writer:
+            await asyncio.sleep(5)
+            if await self._try_become_writer():
+                return
+
+    async def _rebuild_periodically(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error("Embedding store rebuild failed", extra={"error": str(e)})
+            if self.rebuild_interval <= 0:
+                return
+            await asyncio.sleep(self.rebuild_interval)
+
+    # Reading (every worker)
+
+    def _mapping(self) -> Optional[_Mapping]:
+        mapping = self._map
+        if mapping is not None and not mapping.get("retired"):
+            return mapping
+        try:
+            self._map = _Mapping(self.path)
+        except (FileNotFoundError, ValueError):
+            self._map = None
+        return self._map
+
+    @property
+    def ready(self) -> bool:
+        """Whether searches can be answered from the store for the active embedding model"""
+        if not self.enabled:
+            return False
+        mapping = self._mapping()
+        return mapping is not None and mapping.get("model") == _hash(ollama_client.embedding_model_tag)
+
+    def _candidates(self, mapping: _Mapping, user_id: str, session_id: Optional[str]) -> np.ndarray:
+        count = mapping.get("count")
+        mask = mapping.users[:count] == _hash(user_id)
+        mask &= mapping.alive[:count] == 1
+        if session_id:
+            mask &= mapping.sessions[:count] == _hash(session_id)
+        return np.flatnonzero(mask)
+
+    def search(self, user_id: str, query_embedding: List[float], k: int,
+               session_id: Optional[str] = None) -> List[Tuple[ObjectId, float]]:
+        """Top-k (episode id, cosine similarity) for a user, or one of their sessions"""
+        mapping = self._mapping()
+        if mapping is None or not query_embedding or len(query_embedding) != mapping.dim:
+            return []
+        rows = self._candidates(mapping, user_id, session_id)
+        if not len(rows):
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        vectors = mapping.vectors[rows]
+        norms = np.linalg.norm(vectors, axis=1) * np.linalg.norm(query)
+        norms[norms == 0] = np.inf
+        scores = vectors @ query / norms
+
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [(ObjectId(mapping.ids[rows[i]].tobytes()), float(scores[i])) for i in top]
+
+    def count(self, user_id: str) -> int:
+        """Live vectors stored for a user"""
+        mapping = self._mapping()
+        return len(self._candidates(mapping, user_id, None)) if mapping is not None else 0
+
+    # Writing (forwarded to the writer)
+
+    async def add(self, episodes: List[Dict[str, Any]]):
+        """Publish newly stored episodes' vectors"""
+        records = [
+            {"_id": str(ep["_id"]), "user_id": ep["user_id"], "session_id": ep.get("session_id"),
+             "embed_model": ep.get("embed_model"), "embedding": ep["embedding"]}
+            for ep in episodes if ep.get("embedding")
+        ]
+        if records:
+            await self._submit({"op": "add", "episodes": records})
+
+    async def remove(self, episode_ids: List[Any]):
+        """Drop deleted or archived episodes"""
+        if episode_ids:
+            await self._submit({"op": "remove", "ids": [str(eid) for eid in episode_ids]})
+
+    async def request_rebuild(self):
+        """Ask the writer to rebuild from storage, e.g. after an offline job changed vectors"""
+        await self._submit({"op": "rebuild"})
+
+    async def _submit(self, op: Dict[str, Any]):
+        if self.is_writer:
+            await self._apply(op)
+            return
+        # Offline jobs never call start(), but can still notify a running writer; with no writer
+        # running, the next one's start-up rebuild picks the change up from storage
+        if not os.path.exists(self.socket_path):
+            return
+        try:
+            if self._writer_conn is None or self._writer_conn.is_closing():
+                _, self._writer_conn = await asyncio.open_unix_connection(self.socket_path)
+            self._writer_conn.write(json.dumps(op).encode() + b"\n")
+            await self._writer_conn.drain()
+            store_operations.inc(op=op["op"], role="forwarded")
+        except OSError as e:
+            # The periodic rebuild picks up anything lost here
+            self._writer_conn = None
+            logger.warning("Could not reach embedding store writer", extra={"op": op["op"], "error": str(e)})
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    await self._apply(json.loads(line))
+                except Exception as e:
+                    logger.error("Embedding store operation failed", extra={"error": str(e)})
+        finally:
+            writer.close()
+
+    async def _apply(self, op: Dict[str, Any]):
+        if op["op"] == "rebuild":
+            await self.rebuild()
+        elif self._rebuilding:
+            # Replayed onto the new file once the rebuild has switched over
+            self._deferred.append(op)
+        elif op["op"] == "add":
+            self._append(op["episodes"])
+        elif op["op"] == "remove":
+            self._tombstone(op["ids"])
+        store_operations.inc(op=op["op"], role="writer")
+
+    def _append(self, episodes: List[Dict[str, Any]]):
+        active = ollama_client.embedding_model_tag
+        episodes = [
+            ep for ep in episodes
+            if (ep.get("embed_model") or active) == active and ObjectId(ep["_id"]).binary not in self._rows
+        ]
+        if not episodes:
+            return
+        mapping = self._map
+        if mapping is None:
+            mapping = self._write_file(episodes, dim=len(episodes[0]["embedding"]))
+            return
+        episodes = [ep for ep in episodes if len(ep["embedding"]) == mapping.dim]
+        count = mapping.get("count")
+        if count + len(episodes) > mapping.capacity:
+            # Grow by rewriting; live rows are copied across and the old file is retired
+            self._rewrite(extra=episodes)
+            return
+
+        for offset, ep in enumerate(episodes):
+            row = count + offset
+            episode_id = ObjectId(ep["_id"]).binary
+            mapping.users[row] = _hash(ep["user_id"])
+            mapping.sessions[row] = _hash(ep.get("session_id"))
+            mapping.ids[row] = np.frombuffer(episode_id, np.uint8)
+            mapping.vectors[row] = np.asarray(ep["embedding"], dtype=np.float32)
+            mapping.alive[row] = 1
+            self._rows[episode_id] = row
+        # Rows are written before the count that publishes them
+        mapping.header["count"] = count + len(episodes)
+        mapping.header["live"] = mapping.get("live") + len(episodes)
+        mapping.header["generation"] = mapping.get("generation") + 1
+
+    def _tombstone(self, episode_ids: List[str]):
+        mapping = self._map
+        if mapping is None:
+            return
+        removed = 0
+        for episode_id in episode_ids:
+            row = self._rows.pop(ObjectId(episode_id).binary, None)
+            if row is not None:
+                mapping.alive[row] = 0
+                removed += 1
+        if not removed:
+            return
+        mapping.header["live"] = mapping.get("live") - removed
+        mapping.header["generation"] = mapping.get("generation") + 1
+        count = mapping.get("count")
+        if count and 1 - mapping.get("live") / count > self.max_dead_fraction:
+            self._rewrite()
+
+    def _live_records(self) -> List[Dict[str, Any]]:
+        mapping = self._map
+        if mapping is None:
+            return []
+        rows = np.flatnonzero(mapping.alive[:mapping.get("count")] == 1)
+        return [
+            {"row": int(row), "id": mapping.ids[row].tobytes(), "user": int(mapping.users[row]),
+             "session": int(mapping.sessions[row])}
+            for row in rows
+        ]
+
+    def _rewrite(self, extra: List[Dict[str, Any]] = ()):
+        """Copy live rows (plus `extra`) into a new file with room to grow, then retire the old one"""
+        mapping = self._map
+        live = self._live_records()
+        vectors = mapping.vectors[[r["row"] for r in live]] if live else np.zeros((0, mapping.dim), np.float32)
+        episodes = [
+            {"id": r["id"], "user": r["user"], "session": r["session"], "vector": vectors[i]}
+            for i, r in enumerate(live)
+        ]
+        episodes += [
+            {"id": ObjectId(ep["_id"]).binary, "user": _hash(ep["user_id"]), "session": _hash(ep.get("session_id")),
+             "vector": np.asarray(ep["embedding"], dtype=np.float32)}
+            for ep in extra if len(ep["embedding"]) == mapping.dim
+        ]
+        self._write_rows(episodes, mapping.dim)
+
+    def _write_file(self, episodes: List[Dict[str, Any]], dim: int) -> _Mapping:
+        rows = [
+            {"id": ObjectId(ep["_id"]).binary, "user": _hash(ep["user_id"]), "session": _hash(ep.get("session_id")),
+             "vector": np.asarray(ep["embedding"], dtype=np.float32)}
+            for ep in episodes if len(ep["embedding"]) == dim
+        ]
+        return self._write_rows(rows, dim)
+
+    def _write_rows(self, rows: List[Dict[str, Any]], dim: int) -> _Mapping:
+        capacity = max(self.initial_capacity, 2 * len(rows))
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        mapping = _Mapping.create(tmp_path, dim, capacity, _hash(ollama_client.embedding_model_tag))
+        n = len(rows)
+        if n:
+            mapping.users[:n] = [r["user"] for r in rows]
+            mapping.sessions[:n] = [r["session"] for r in rows]
+            mapping.ids[:n] = np.frombuffer(b"".join(r["id"] for r in rows), np.uint8).reshape(n, 12)
+            mapping.vectors[:n] = np.stack([r["vector"] for r in rows])
+            mapping.alive[:n] = 1
+        mapping.header["count"] = n
+        mapping.header["live"] = n
+        mapping.header["generation"] = 1
+
+        os.replace(tmp_path, self.path)
+        old = self._map
+        self._map = mapping
+        self._rows = {r["id"]: i for i, r in enumerate(rows)}
+        if old is not None:
+            old.header["retired"] = 1
+        return mapping
+
+    async def rebuild(self):
+        """Rebuild the store from storage (writer only); writes arriving meanwhile are replayed afterwards"""
+        if not self.is_writer or self._rebuilding:
+            return
+        self._rebuilding = True
+        try:
+            active = ollama_client.embedding_model_tag
+            legacy = os.getenv("EMBED_LEGACY_MODEL", "nomic-embed-text")
+            rows, dim = [], None
+            async for episode in get_storage().iter_episodes():
+                embedding = episode.get("embedding")
+                if not embedding or (episode.get("embed_model") or legacy) != active:
+                    continue
+                dim = dim or len(embedding)
+                if len(embedding) != dim:
+                    continue
+                rows.append({"id": episode["_id"].binary, "user": _hash(episode["user_id"]),
+                             "session": _hash(episode.get("session_id")),
+                             "vector": np.asarray(embedding, dtype=np.float32)})
+            dim = dim or (self._map.dim if self._map is not None else None)
+            if dim is not None:
+                self._write_rows(rows, dim)
+            logger.info("Embedding store rebuilt", extra={"vectors": len(rows), "path": self.path})
+        finally:
+            self._rebuilding = False
+            deferred, self._deferred = self._deferred, []
+        for op in deferred:
+            await self._apply(op)
+
+# Global instance
+embedding_store = SharedEmbeddingStore()
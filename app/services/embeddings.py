@@ -1,5 +1,5 @@
 import numpy as np
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
     """Calculate cosine similarity between two vectors"""
@@ -39,3 +39,36 @@ def find_top_similar_episodes(
     # Sort by similarity (descending) and return top-k
     similarities.sort(key=lambda x: x[1], reverse=True)
     return [episode for episode, _ in similarities[:top_k]]
+
+def similarity_scores(query_embedding: List[float], episodes: List[dict]) -> np.ndarray:
+    """Cosine similarity of every episode to the query; NaN where an episode has no comparable vector"""
+    scores = np.full(len(episodes), np.nan)
+    rows = [
+        i for i, episode in enumerate(episodes)
+        if episode.get('embedding') and len(episode['embedding']) == len(query_embedding)
+    ]
+    if not query_embedding or not rows:
+        return scores
+
+    query = np.asarray(query_embedding, dtype=np.float64)
+    matrix = np.asarray([episodes[i]['embedding'] for i in rows], dtype=np.float64)
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = np.inf
+    scores[rows] = matrix @ query / norms
+    return scores
+
+def find_most_similar_episode(
+    query_embedding: List[float],
+    episodes: List[dict]
+) -> Tuple[Optional[dict], float]:
+    """Find the single episode most similar to query embedding, scoring all candidates in one matrix product"""
+    if not query_embedding or not episodes:
+        return None, 0.0
+
+    similarities = similarity_scores(query_embedding, episodes)
+    if np.all(np.isnan(similarities)):
+        return None, 0.0
+
+    best = int(np.nanargmax(similarities))
+    return episodes[best], float(similarities[best])
@@ -0,0 +1,43 @@
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from app.storage import get_storage
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+lease_changes = registry.counter("job_lease_changes_total", "Background job leases gained or lost by this process")
+
+# Identifies this process as a lease holder
+HOLDER = f"{socket.gethostname()}:{os.getpid()}"
+
+class JobLease:
+    """A storage-backed lease, so a background job started in every worker runs in one process at a time.
+
+    The holder renews the lease on each tick; it lapses `ttl` after the last renewal, and then
+    another worker takes over. Workers on different hosts share it through storage.
+    """
+
+    def __init__(self, name: str, ttl_seconds: float):
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.held = False
+
+    async def hold(self) -> bool:
+        """Take or renew the lease; False (and the job should skip its tick) while another process holds it"""
+        now = datetime.utcnow()
+        try:
+            held = await get_storage().acquire_lease(self.name, HOLDER, now + self.ttl, now)
+        except Exception as e:
+            logger.error("Could not acquire job lease", extra={"job": self.name, "error": str(e)})
+            held = False
+        if held != self.held:
+            lease_changes.inc(job=self.name, change="gained" if held else "lost")
+            logger.info("Job lease " + ("gained" if held else "lost"), extra={"job": self.name, "holder": HOLDER})
+            self.held = held
+        return held
+
+def lease_grace() -> float:
+    """Seconds a lease outlives its job's interval, covering ticks that run long"""
+    return float(os.getenv("JOB_LEASE_GRACE_S", "600"))
@@ -0,0 +1,169 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple
+from app.storage import get_storage
+from app.services.retention import retention_policy
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Words that match nearly every fact and would only add noise to the shortlist
+STOPWORDS = frozenset("""
+a an and are as at be but by do does did for from had has have i in is it its me my of on or our so
+that the their them they this to was we were what when where which who why will with you your
+""".split())
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall((text or "").lower()) if token not in STOPWORDS]
+
+# Fields kept per episode: enough to filter by session and compute a retention score, never the vector
+META_FIELDS = ("session_id", "importance", "created_at", "last_seen_at", "mention_count", "access_count")
+
+class _UserIndex:
+    """BM25 postings and light metadata for one user's episodes"""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[Any, int]] = {}
+        self.lengths: Dict[Any, int] = {}
+        self.terms: Dict[Any, List[str]] = {}
+        self.meta: Dict[Any, Dict[str, Any]] = {}
+        self.total_length = 0
+        self.loaded_at = time.monotonic()
+
+    def add(self, episode: Dict[str, Any]):
+        episode_id = episode["_id"]
+        if episode_id in self.lengths:
+            self.meta[episode_id].update({field: episode[field] for field in META_FIELDS if field in episode})
+            return
+        tokens = tokenize(episode.get("fact", ""))
+        for token in tokens:
+            postings = self.postings.setdefault(token, {})
+            postings[episode_id] = postings.get(episode_id, 0) + 1
+        self.lengths[episode_id] = len(tokens)
+        self.terms[episode_id] = list(set(tokens))
+        self.meta[episode_id] = {field: episode[field] for field in META_FIELDS if field in episode}
+        self.total_length += len(tokens)
+
+    def remove(self, episode_id: Any):
+        length = self.lengths.pop(episode_id, None)
+        if length is None:
+            return
+        self.meta.pop(episode_id, None)
+        self.total_length -= length
+        for token in self.terms.pop(episode_id):
+            postings = self.postings[token]
+            postings.pop(episode_id, None)
+            if not postings:
+                del self.postings[token]
+
+    def in_session(self, episode_id: Any, session_id: Optional[str]) -> bool:
+        return not session_id or self.meta[episode_id].get("session_id") == session_id
+
+class LexicalIndex:
+    """In-process BM25 index over episode facts, used to shortlist candidates before vector scoring.
+
+    Each worker indexes the users it serves, loading a user from storage on first use and again once
+    the entry is older than LEXICAL_INDEX_TTL_S, which picks up episodes other workers stored.
+    Episodes stored or removed through this process are applied immediately.
+    """
+
+    def __init__(self):
+        self.k1 = float(os.getenv("LEXICAL_BM25_K1", "1.2"))
+        self.b = float(os.getenv("LEXICAL_BM25_B", "0.75"))
+        self.ttl = float(os.getenv("LEXICAL_INDEX_TTL_S", "300"))
+        self.max_users = int(os.getenv("LEXICAL_INDEX_MAX_USERS", "1000"))
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._loading: Dict[str, asyncio.Task] = {}
+
+    async def _load(self, user_id: str) -> _UserIndex:
+        index = _UserIndex()
+        for episode in await get_storage().find_episodes(user_id):
+            index.add(episode)
+        self._users[user_id] = index
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        return index
+
+    async def user_index(self, user_id: str) -> _UserIndex:
+        """The user's index, loading it from storage if absent or stale"""
+        index = self._users.get(user_id)
+        if index is not None and time.monotonic() - index.loaded_at < self.ttl:
+            self._users.move_to_end(user_id)
+            return index
+        # Concurrent requests for the same user share one load
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._load(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return await task
+
+    def add(self, episodes: List[Dict[str, Any]]):
+        """Index newly stored episodes of users already in memory; others are indexed on first load"""
+        for episode in episodes:
+            index = self._users.get(episode["user_id"])
+            if index is not None:
+                index.add(episode)
+
+    def remove(self, user_id: str, episode_ids: List[Any]):
+        index = self._users.get(user_id)
+        if index is not None:
+            for episode_id in episode_ids:
+                index.remove(episode_id)
+
+    def score(self, index: _UserIndex, query: str, session_id: Optional[str] = None) -> Dict[Any, float]:
+        """BM25 score of every episode sharing a term with the query"""
+        n = len(index.lengths)
+        if not n:
+            return {}
+        average_length = index.total_length / n or 1.0
+        scores: Dict[Any, float] = {}
+        for term in set(tokenize(query)):
+            postings = index.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for episode_id, tf in postings.items():
+                if not index.in_session(episode_id, session_id):
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * index.lengths[episode_id] / average_length)
+                scores[episode_id] = scores.get(episode_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    async def candidates(self, user_id: str, query: str, shortlist: int, recent: int,
+                         session_id: Optional[str] = None) -> Tuple[List[Any], List[Tuple[Any, float]]]:
+        """Episode ids worth vector-scoring, and the lexical hits ranked by BM25.
+
+        The ids are the lexical shortlist plus the `recent` episodes with the best retention score,
+        so facts phrased differently from the query still have a way in. Users with no more
+        episodes than the shortlist get all of them.
+        """
+        index = await self.user_index(user_id)
+        hits = sorted(self.score(index, query, session_id).items(), key=lambda item: item[1], reverse=True)
+        in_scope = [eid for eid in index.lengths if index.in_session(eid, session_id)]
+        if len(in_scope) <= shortlist:
+            return in_scope, hits
+
+        ids = [eid for eid, _ in hits[:shortlist]]
+        if recent:
+            now = datetime.utcnow()
+            chosen = set(ids)
+            by_retention = sorted(
+                (eid for eid in in_scope if eid not in chosen),
+                key=lambda eid: retention_policy.score(_scorable(index.meta[eid], now), now),
+                reverse=True
+            )
+            ids += by_retention[:recent]
+        return ids, hits
+
+def _scorable(meta: Dict[str, Any], now: datetime) -> Dict[str, Any]:
+    # Episodes written without a timestamp still need one for the recency term
+    return meta if meta.get("created_at") else dict(meta, created_at=now)
+
+# Global instance
+lexical_index = LexicalIndex()
@@ -1,70 +1,261 @@
 import httpx
 import json
+import logging
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator
 from dotenv import load_dotenv
+from app.services.metrics import timed, registry
+from app.services.resilience import CircuitBreaker, call_with_resilience, counts_as_failure, remaining_time
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Returned in place of a reply when generation fails
+FALLBACK_REPLY = "I apologize, but I'm having trouble processing your request right now."
+
+prompt_tokens = registry.counter("ollama_prompt_tokens_total", "Prompt tokens evaluated by Ollama")
+completion_tokens = registry.counter("ollama_completion_tokens_total", "Tokens generated by Ollama")
+
+# Each operation has its own circuit breaker, so e.g. a stalled embedding model doesn't block chat replies
+OPERATIONS = ("chat", "embed", "extract", "summarize")
+
 class OllamaClient:
     def __init__(self):
         self.base_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
         self.chat_model = os.getenv("CHAT_MODEL", "phi3:mini")
         self.embed_model = os.getenv("EMBED_MODEL", "nomic-embed-text")
+        # Bump when the same model name starts producing incomparable vectors (e.g. re-pulled weights)
+        self.embed_model_version = os.getenv("EMBED_MODEL_VERSION", "")
+        # How long Ollama keeps models loaded after a request (e.g. "30m", "-1" for forever); empty uses Ollama's default
+        self.keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "")
+        self.warm_up_timeout = float(os.getenv("OLLAMA_WARMUP_TIMEOUT_S", "120"))
+        # Total time per call, shared by its attempts and further capped by the request deadline
+        self.timeout = float(os.getenv("OLLAMA_TIMEOUT_S", "30"))
+        self.embed_timeout = float(os.getenv("OLLAMA_EMBED_TIMEOUT_S", "30"))
+        self.max_attempts = int(os.getenv("OLLAMA_MAX_ATTEMPTS", "2"))
+        # Start a second attempt if the first hasn't answered by then (0 only retries after failures);
+        # cheap for embeddings, a doubled GPU load for generation, hence off there by default
+        self.hedge_after = {
+            "embed": float(os.getenv("OLLAMA_EMBED_HEDGE_AFTER_S", "2")),
+            "generate": float(os.getenv("OLLAMA_GENERATE_HEDGE_AFTER_S", "0")),
+        }
+        self.breakers = {
+            operation: CircuitBreaker(
+                f"ollama.{operation}",
+                failure_threshold=int(os.getenv("OLLAMA_BREAKER_FAILURES", "5")),
+                reset_timeout=float(os.getenv("OLLAMA_BREAKER_RESET_S", "30"))
+            )
+            for operation in OPERATIONS
+        }
     
-    async def chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> str:
-        """Generate chat completion using Ollama"""
-        try:
-            # Convert messages to a single prompt for Ollama's completion endpoint
-            prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
+    @property
+    def embedding_model_tag(self) -> str:
+        """Identifies the vector space of embeddings this client produces; stored on each episode"""
+        if self.embed_model_version:
+            return f"{self.embed_model}@{self.embed_model_version}"
+        return self.embed_model
+    
+    def _payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        if self.keep_alive:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+    
+    async def _call(self, operation: str, attempt: Callable[[float], Awaitable[Any]]) -> Any:
+        """Run `attempt(timeout_s)` behind the operation's breaker, with hedging, retry and the request deadline"""
+        embed = operation == "embed"
+        return await call_with_resilience(
+            self.breakers[operation], attempt,
+            timeout=self.embed_timeout if embed else self.timeout,
+            hedge_after=self.hedge_after["embed" if embed else "generate"],
+            max_attempts=self.max_attempts
+        )
+    
+    def available(self, operation: str) -> bool:
+        """False while the operation's breaker is open, so callers can skip work instead of failing fast"""
+        return not self.breakers[operation].is_open
+    
+    def breaker_status(self) -> Dict[str, Dict[str, Any]]:
+        return {operation: breaker.status() for operation, breaker in self.breakers.items()}
+    
+    @timed("ollama.warm_up")
+    async def warm_up(self) -> Dict[str, bool]:
+        """Load the chat and embedding models so the first request doesn't pay for a cold load"""
+        results = {}
+        async with httpx.AsyncClient(timeout=self.warm_up_timeout) as client:
+            # A generate request without a prompt only loads the model
+            warm_ups = [
+                (self.chat_model, "/api/generate", {"model": self.chat_model}),
+                (self.embed_model, "/api/embed", {"model": self.embed_model, "input": "warm-up"}),
+            ]
+            for model, path, payload in warm_ups:
+                try:
+                    response = await client.post(f"{self.base_url}{path}", json=self._payload(payload))
+                    if response.status_code == 404 and path == "/api/embed":
+                        response = await client.post(
+                            f"{self.base_url}/api/embeddings",
+                            json=self._payload({"model": model, "prompt": "warm-up"})
+                        )
+                    response.raise_for_status()
+                    results[model] = True
+                except Exception as e:
+                    logger.warning("Model warm-up failed", extra={"model": model, "error": str(e)})
+                    results[model] = False
+        return results
+    
+    @timed("ollama.chat_completion")
+    async def chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.7,
+                              operation: str = "chat") -> str:
+        """Generate chat completion using Ollama; `operation` picks the circuit breaker"""
+        # Convert messages to a single prompt for Ollama's completion endpoint
+        prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        
+        async def attempt(timeout: float) -> Dict[str, Any]:
+            async with httpx.AsyncClient(timeout=timeout) as client:
                 response = await client.post(
                     f"{self.base_url}/api/generate",
-                    json={
+                    json=self._payload({
                         "model": self.chat_model,
                         "prompt": prompt,
                         "stream": False,
                         "options": {
                             "temperature": temperature
                         }
-                    }
+                    })
                 )
                 response.raise_for_status()
-                result = response.json()
-                content = result.get("response", "")
-                
-                # Handle empty responses
-                if not content or not content.strip():
-                    print("Empty response from Ollama chat completion")
-                    return "I apologize, but I'm having trouble processing your request right now."
-                
-                return content
+                return response.json()
+        
+        try:
+            result = await self._call(operation, attempt)
+            content = result.get("response", "")
+            prompt_tokens.inc(result.get("prompt_eval_count", 0), model=self.chat_model)
+            completion_tokens.inc(result.get("eval_count", 0), model=self.chat_model)
+            
+            # Handle empty responses
+            if not content or not content.strip():
+                logger.warning("Empty response from Ollama chat completion", extra={"model": self.chat_model})
+                return FALLBACK_REPLY
+            
+            return content
         except Exception as e:
-            print("Error in chat completion:", str(e))
-            return "I apologize, but I'm having trouble processing your request right now."
+            logger.error("Error in chat completion", extra={"model": self.chat_model, "operation": operation, "error": str(e)})
+            return FALLBACK_REPLY
     
+    async def stream_chat_completion(self, messages: List[Dict[str, str]], temperature: float = 0.7) -> AsyncIterator[str]:
+        """Yield a chat completion's text as Ollama generates it; yields FALLBACK_REPLY if nothing was generated.
+        
+        A stream can't be hedged or retried once tokens have gone out, so only the breaker and the
+        request deadline apply; the timeout bounds each wait for the next chunk.
+        """
+        prompt = "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        breaker = self.breakers["chat"]
+        timeout = self.timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        
+        produced = False
+        if timeout > 0 and breaker.allow():
+            outcome = None
+            try:
+                async with httpx.AsyncClient(timeout=timeout) as client:
+                    async with client.stream(
+                        "POST",
+                        f"{self.base_url}/api/generate",
+                        json=self._payload({
+                            "model": self.chat_model,
+                            "prompt": prompt,
+                            "stream": True,
+                            "options": {
+                                "temperature": temperature
+                            }
+                        })
+                    ) as response:
+                        response.raise_for_status()
+                        async for line in response.aiter_lines():
+                            if not line.strip():
+                                continue
+                            chunk = json.loads(line)
+                            if chunk.get("response"):
+                                produced = True
+                                yield chunk["response"]
+                            if chunk.get("done"):
+                                prompt_tokens.inc(chunk.get("prompt_eval_count", 0), model=self.chat_model)
+                                completion_tokens.inc(chunk.get("eval_count", 0), model=self.chat_model)
+                                break
+                outcome = "success"
+            except Exception as e:
+                outcome = "failure" if counts_as_failure(e) else None
+                logger.error("Error in streamed chat completion", extra={"model": self.chat_model, "error": str(e)})
+            finally:
+                # Also reached when the consumer stops early, e.g. the client disconnected
+                if outcome == "success":
+                    breaker.record_success()
+                elif outcome == "failure":
+                    breaker.record_failure()
+                else:
+                    breaker.release()
+        
+        if not produced:
+            yield FALLBACK_REPLY
+    
+    @timed("ollama.generate_embedding")
     async def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding for text using Ollama"""
-        try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
+        async def attempt(timeout: float) -> List[float]:
+            async with httpx.AsyncClient(timeout=timeout) as client:
                 response = await client.post(
                     f"{self.base_url}/api/embeddings",
-                    json={
+                    json=self._payload({
                         "model": self.embed_model,
                         "prompt": text
-                    }
+                    })
                 )
                 response.raise_for_status()
-                result = response.json()
-                return result["embedding"]
+                return response.json()["embedding"]
+        
+        try:
+            return await self._call("embed", attempt)
         except Exception as e:
-            print("Error generating embedding:", str(e))
+            logger.error("Error generating embedding", extra={"model": self.embed_model, "error": str(e)})
             return []
     
-    async def extract_episodes(self, message: str) -> List[Dict[str, Any]]:
+    @timed("ollama.generate_embeddings")
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for many texts in one call; falls back to one call per text on older Ollama"""
+        if not texts:
+            return []
+        
+        async def attempt(timeout: float) -> Optional[List[List[float]]]:
+            async with httpx.AsyncClient(timeout=timeout) as client:
+                response = await client.post(
+                    f"{self.base_url}/api/embed",
+                    json=self._payload({
+                        "model": self.embed_model,
+                        "input": texts
+                    })
+                )
+                # Older Ollama has no batch endpoint
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+                return response.json()["embeddings"]
+        
+        try:
+            embeddings = await self._call("embed", attempt)
+            if embeddings is not None and len(embeddings) == len(texts):
+                return embeddings
+        except Exception as e:
+            logger.error("Error generating batch embeddings", extra={"model": self.embed_model, "error": str(e)})
+            return [[] for _ in texts]
+        
+        return [await self.generate_embedding(text) for text in texts]
+    
+    @timed("ollama.extract_episodes")
+    async def extract_episodes(self, message: str, max_facts: int = 3) -> List[Dict[str, Any]]:
         """Extract important facts from user message"""
-        prompt = f"""Extract up to 3 important facts from this message that would be useful to remember for future conversations. 
+        prompt = f"""Extract up to {max_facts} important facts from this message that would be useful to remember for future conversations. 
         Return only a JSON array of objects with 'fact' and 'importance' fields. 
         Importance should be a number between 0.0 and 1.0.
         
@@ -77,33 +268,45 @@ class OllamaClient:
             {"role": "user", "content": prompt}
         ]
         
+        response = ""
         try:
-            response = await self.chat_completion(messages, temperature=0.3)
+            response = await self.chat_completion(messages, temperature=0.3, operation="extract")
             
             # Handle empty or invalid responses
             if not response or not response.strip():
-                print("Empty response from Ollama for episode extraction")
+                logger.warning("Empty response from Ollama for episode extraction")
                 return []
             
             # Try to parse JSON response
             episodes = json.loads(response)
             if isinstance(episodes, list):
-                return episodes[:3]  # Limit to 3 episodes
+                return episodes[:max_facts]
             return []
         except (json.JSONDecodeError, Exception) as e:
-            print("Error extracting episodes:", str(e))
-            print(f"Response was: '{response}'")
+            logger.warning("Error extracting episodes", extra={"error": str(e), "response": response})
             return []
     
-    async def generate_session_summary(self, messages: List[Dict[str, str]]) -> str:
-        """Generate session summary from recent messages"""
+    @timed("ollama.generate_session_summary")
+    async def generate_session_summary(self, messages: List[Dict[str, str]], previous_summary: str = None) -> str:
+        """Generate session summary from recent messages, folding them into previous_summary when given"""
         if not messages:
             return ""
         
         # Format messages for summarization
         conversation = "\n".join([msg['role'] + ": " + msg['content'] for msg in messages])
         
-        prompt = f"""Summarize this conversation in 3-5 concise bullet points focusing on key topics, decisions, and important information:
+        if previous_summary:
+            prompt = f"""Update this conversation summary with the new messages below. Keep it to 3-5 concise bullet points focusing on key topics, decisions, and important information; keep earlier points that still matter:
+        
+        Previous summary:
+        {previous_summary}
+        
+        New messages:
+        {conversation}
+        
+        Updated summary:"""
+        else:
+            prompt = f"""Summarize this conversation in 3-5 concise bullet points focusing on key topics, decisions, and important information:
         
         {conversation}
         
@@ -114,8 +317,9 @@ class OllamaClient:
             {"role": "user", "content": prompt}
         ]
         
-        return await self.chat_completion(messages_for_llm, temperature=0.3)
+        return await self.chat_completion(messages_for_llm, temperature=0.3, operation="summarize")
     
+    @timed("ollama.generate_lifetime_summary")
     async def generate_lifetime_summary(self, session_summaries: List[str]) -> str:
         """Generate lifetime summary from session summaries"""
         if not session_summaries:
@@ -134,7 +338,7 @@ class OllamaClient:
             {"role": "user", "content": prompt}
         ]
         
-        return await self.chat_completion(messages_for_llm, temperature=0.3)
+        return await self.chat_completion(messages_for_llm, temperature=0.3, operation="summarize")
 
 # Global instance
 ollama_client = OllamaClient()
@@ -0,0 +1,43 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Dict, Any, Tuple, Optional, Callable, Awaitable, List
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Keyset cursor: the (created_at, _id) of the last item on a page, so each page is an index seek
+# however deep it is, unlike skip/offset paging
+
+def encode_cursor(kind: str, doc: Dict[str, Any]) -> str:
+    """Opaque continuation token pointing just past `doc`"""
+    payload = {"k": kind, "t": doc["created_at"].isoformat(), "i": str(doc["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(kind: str, token: str) -> Tuple[datetime, ObjectId]:
+    """Turn a token back into a (created_at, _id) key; raises ValueError if it is malformed or for another listing"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["k"] != kind:
+            raise ValueError(f"cursor is for {payload['k']}, not {kind}")
+        return datetime.fromisoformat(payload["t"]), ObjectId(payload["i"])
+    except (KeyError, TypeError, InvalidId, json.JSONDecodeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError("invalid cursor") from e
+
+async def fetch_page(
+    kind: str,
+    fetch: Callable[[int, Optional[Tuple[datetime, Any]]], Awaitable[List[Dict[str, Any]]]],
+    limit: int,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """Fetch one newest-first page with `fetch(limit, before)`; returns `{"items", "next_cursor"}`"""
+    before = decode_cursor(kind, cursor) if cursor else None
+    # One extra row tells us whether another page exists without a count query
+    items = await fetch(limit + 1, before)
+    has_more = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "next_cursor": encode_cursor(kind, items[-1]) if has_more else None
+    }
@@ -0,0 +1,45 @@
+from typing import List, Dict, Any, Optional, Tuple
+
+SYSTEM_PROMPT = "You are a helpful AI assistant. Give brief, helpful responses."
+
+def compose_chat_messages(message: str, recent_messages: List[Dict[str, Any]],
+                          session_summary: Optional[Dict[str, Any]], lifetime_summary: Optional[Dict[str, Any]],
+                          relevant_episodes: List[Dict[str, Any]],
+                          related_messages: List[Dict[str, Any]] = ()) -> Tuple[List[Dict[str, str]], str]:
+    """Build the LLM messages for a chat turn from memory; also returns the context text"""
+    # Build context from memory
+    context_parts = []
+    
+    # Add lifetime summary if available
+    if lifetime_summary:
+        context_parts.append("User Profile: " + lifetime_summary['text'])
+    
+    # Add session summary if available
+    if session_summary:
+        context_parts.append("Session Summary: " + session_summary['text'])
+    
+    # Add recent conversation (limit to last 5 messages)
+    if recent_messages:
+        context_parts.append("Recent Conversation:")
+        for msg in recent_messages[-5:]:  # Last 5 messages only
+            context_parts.append(msg['role'] + ": " + msg['content'])
+    
+    # Add relevant episodic facts
+    if relevant_episodes:
+        facts = [ep["fact"] for ep in relevant_episodes]
+        context_parts.append("Relevant Facts: " + "; ".join(facts))
+    
+    # Add related messages from earlier conversations
+    if related_messages:
+        context_parts.append("Related Past Messages:")
+        for msg in related_messages:
+            context_parts.append(msg['role'] + ": " + msg['content'])
+    
+    # Compose full prompt
+    context = "\n\n".join(context_parts)
+    
+    messages_for_llm = [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"Context: {context}\n\nUser: {message}\n\nAssistant:"}
+    ]
+    return messages_for_llm, context
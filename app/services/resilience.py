@@ -0,0 +1,164 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Set, TypeVar
+import httpx
+from app.services.metrics import registry
+
+T = TypeVar("T")
+
+breaker_transitions = registry.counter("circuit_breaker_transitions_total", "Circuit breaker state changes, by breaker and new state")
+breaker_rejections = registry.counter("circuit_breaker_rejections_total", "Calls refused by an open circuit breaker")
+hedged_attempts = registry.counter("ollama_hedged_attempts_total", "Extra attempts launched by hedging or retry, by operation and reason")
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's deadline leaves no time for a call"""
+
+# Monotonic time by which the current request must be answered; None when it has no deadline
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def set_deadline(seconds: Optional[float]):
+    """Give the current context (and tasks it starts) `seconds` to finish; None or <= 0 clears it"""
+    _deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+
+def remaining_time() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """Run a block under its own deadline (None for no deadline), restoring the outer one after"""
+    token = _deadline.set(time.monotonic() + seconds if seconds and seconds > 0 else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def counts_as_failure(error: BaseException) -> bool:
+    """Whether an error says the dependency is unhealthy, as opposed to a bad request"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return not isinstance(error, (DeadlineExceeded, CircuitOpenError, asyncio.CancelledError))
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; after `reset_timeout` one probe call is let
+    through (half-open) and its outcome closes or re-opens the breaker"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _transition(self, state: str):
+        if state != self.state:
+            self.state = state
+            breaker_transitions.inc(breaker=self.name, state=state)
+
+    @property
+    def is_open(self) -> bool:
+        """Open and not yet due for a probe; callers can skip work that needs this dependency"""
+        return self.state == "open" and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; claims the probe slot when half-open"""
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._transition("half_open")
+        if self.state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        breaker_rejections.inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        self._probing = False
+        self.failures = 0
+        self._transition("closed")
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition("open")
+
+    def release(self):
+        """Give back a half-open probe slot without an outcome (e.g. the caller's deadline ran out)"""
+        self._probing = False
+
+    def status(self) -> Dict[str, Any]:
+        return {"state": "open" if self.is_open else self.state, "consecutive_failures": self.failures}
+
+async def call_with_resilience(breaker: CircuitBreaker, attempt: Callable[[float], Awaitable[T]], timeout: float,
+                               hedge_after: float = 0.0, max_attempts: int = 1) -> T:
+    """Run `attempt(timeout_s)` guarded by `breaker`, within `timeout` and the request deadline.
+
+    With `hedge_after` > 0, another attempt starts if none has finished by then; a failed attempt is
+    retried straight away. At most `max_attempts` run in total and the first success wins. Only
+    failures that the breaker should see (timeouts, connection errors, 5xx) are recorded.
+    """
+    budget = timeout
+    remaining = remaining_time()
+    clamped = remaining is not None and remaining < budget
+    if clamped:
+        budget = remaining
+    if budget <= 0:
+        raise DeadlineExceeded(f"no time left for {breaker.name}")
+    if not breaker.allow():
+        raise CircuitOpenError(f"{breaker.name} circuit is open")
+
+    loop = asyncio.get_running_loop()
+    ends_at = loop.time() + budget
+    pending: Set[asyncio.Task] = set()
+    launched = 0
+    error: Optional[BaseException] = None
+
+    def launch(reason: Optional[str] = None):
+        nonlocal launched
+        launched += 1
+        if reason:
+            hedged_attempts.inc(operation=breaker.name, reason=reason)
+        pending.add(asyncio.create_task(attempt(max(ends_at - loop.time(), 0.001))))
+
+    launch()
+    try:
+        while pending:
+            left = ends_at - loop.time()
+            if left <= 0:
+                break
+            wait = min(hedge_after, left) if hedge_after > 0 and launched < max_attempts else left
+            done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    breaker.record_success()
+                    return task.result()
+                error = task.exception()
+                if not counts_as_failure(error):
+                    # A bad request won't get better by hedging it
+                    breaker.release()
+                    raise error
+            if launched < max_attempts and ends_at - loop.time() > 0:
+                if done and not pending:
+                    launch("retry")
+                elif not done:
+                    launch("hedge")
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if error is None and clamped:
+        # Out of time because the caller's deadline was short, not because the dependency failed
+        breaker.release()
+        raise DeadlineExceeded(f"deadline reached waiting for {breaker.name}")
+    breaker.record_failure()
+    raise error or asyncio.TimeoutError(f"{breaker.name} timed out after {budget:.1f}s")
@@ -0,0 +1,67 @@
+import math
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+import numpy as np
+from app.services.embeddings import similarity_scores
+
+class RetentionPolicy:
+    """Scores how worth keeping an episode is from its importance, age and how often it is used"""
+
+    def __init__(self):
+        self.half_life_days = float(os.getenv("EPISODE_HALF_LIFE_DAYS", "30"))
+        self.importance_weight = float(os.getenv("RETENTION_IMPORTANCE_WEIGHT", "0.5"))
+        self.recency_weight = float(os.getenv("RETENTION_RECENCY_WEIGHT", "0.3"))
+        self.frequency_weight = float(os.getenv("RETENTION_FREQUENCY_WEIGHT", "0.2"))
+
+    def last_used(self, episode: Dict[str, Any]) -> datetime:
+        """Most recent time the episode was created, restated or retrieved"""
+        times = [episode.get("created_at"), episode.get("last_seen_at"), episode.get("last_accessed_at")]
+        return max(t for t in times if t is not None)
+
+    def score(self, episode: Dict[str, Any], now: Optional[datetime] = None) -> float:
+        """Retention score in [0, 1]; higher means keep"""
+        now = now or datetime.utcnow()
+
+        importance = float(episode.get("importance", 0.5))
+
+        age_days = max((now - self.last_used(episode)).total_seconds(), 0.0) / 86400
+        recency = 0.5 ** (age_days / self.half_life_days) if self.half_life_days > 0 else 1.0
+
+        # Mentions and retrievals both count as uses; saturates so a few uses matter most
+        uses = int(episode.get("mention_count", 1)) - 1 + int(episode.get("access_count", 0))
+        frequency = 1.0 - 1.0 / (1.0 + math.log1p(uses))
+
+        total_weight = self.importance_weight + self.recency_weight + self.frequency_weight
+        if total_weight <= 0:
+            return 0.0
+        return (
+            self.importance_weight * importance
+            + self.recency_weight * recency
+            + self.frequency_weight * frequency
+        ) / total_weight
+
+    def rank_blended(
+        self,
+        query_embedding: List[float],
+        episodes: List[dict],
+        top_k: int,
+        similarity_weight: float,
+        now: Optional[datetime] = None
+    ) -> List[dict]:
+        """Rank episodes by a blend of cosine similarity and retention score"""
+        if not query_embedding or not episodes:
+            return []
+
+        now = now or datetime.utcnow()
+        similarities = similarity_scores(query_embedding, episodes)
+        retention = np.array([self.score(episode, now) for episode in episodes])
+        blended = similarity_weight * similarities + (1.0 - similarity_weight) * retention
+
+        # Episodes without a comparable vector are never returned
+        blended[np.isnan(similarities)] = -np.inf
+        order = np.argsort(-blended, kind="stable")[:top_k]
+        return [episodes[i] for i in order if np.isfinite(blended[i])]
+
+# Global instance
+retention_policy = RetentionPolicy()
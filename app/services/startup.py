@@ -0,0 +1,86 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Awaitable, Optional
+from app.storage import get_storage
+from app.services.ollama_client import ollama_client
+from app.services.metrics import span
+
+logger = logging.getLogger(__name__)
+
+class StartupManager:
+    """Warms models and per-user state after boot and tracks whether this worker should get traffic"""
+
+    def __init__(self):
+        self.warm_models = os.getenv("STARTUP_WARM_MODELS", "true").lower() in ("1", "true", "yes")
+        self.prefetch_users = int(os.getenv("STARTUP_PREFETCH_USERS", "0"))
+        self.prefetch_window_h = float(os.getenv("STARTUP_PREFETCH_WINDOW_H", "24"))
+        self.prefetch_concurrency = int(os.getenv("STARTUP_PREFETCH_CONCURRENCY", "4"))
+
+        # Called once per recently active user; per-worker caches register their loaders in main
+        self.prefetchers: List[Callable[[str], Awaitable[Any]]] = []
+
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self.stages: Dict[str, str] = {}
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    def add_prefetcher(self, prefetcher: Callable[[str], Awaitable[Any]]):
+        self.prefetchers.append(prefetcher)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "stages": dict(self.stages),
+            "startup_seconds": round((self.ready_at or time.time()) - self.started_at, 3)
+        }
+
+    async def _stage(self, name: str, enabled: bool, fn: Callable[[], Awaitable[Any]]):
+        if not enabled:
+            self.stages[name] = "skipped"
+            return
+        self.stages[name] = "running"
+        try:
+            with span(f"startup.{name}"):
+                result = await fn()
+            # A warm-up that fails leaves the worker cold, not broken, so it still becomes ready
+            self.stages[name] = "failed" if result is False else "ok"
+        except Exception as e:
+            logger.warning("Startup stage failed", extra={"stage": name, "error": str(e)})
+            self.stages[name] = "failed"
+
+    async def _warm_models(self) -> bool:
+        results = await ollama_client.warm_up()
+        logger.info("Models warmed", extra=results)
+        return all(results.values())
+
+    async def _prefetch(self):
+        since = datetime.utcnow() - timedelta(hours=self.prefetch_window_h)
+        user_ids = await get_storage().get_recent_user_ids(since, self.prefetch_users)
+        semaphore = asyncio.Semaphore(self.prefetch_concurrency)
+
+        async def prefetch_user(user_id: str):
+            async with semaphore:
+                for prefetcher in self.prefetchers:
+                    await prefetcher(user_id)
+
+        await asyncio.gather(*(prefetch_user(user_id) for user_id in user_ids))
+        logger.info("Prefetched recently active users", extra={"users": len(user_ids)})
+
+    async def run(self):
+        """Run the warm-up stages, then mark the worker ready"""
+        self.stages = {"warm_models": "pending", "prefetch": "pending"}
+        await asyncio.gather(
+            self._stage("warm_models", self.warm_models, self._warm_models),
+            self._stage("prefetch", self.prefetch_users > 0, self._prefetch),
+        )
+        self.ready_at = time.time()
+        logger.info("Worker ready", extra={"startup_seconds": round(self.ready_at - self.started_at, 3), **self.stages})
+
+# Global instance
+startup = StartupManager()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple, List, Callable, Awaitable, AsyncIterator
+from app.storage import get_storage
+from app.services.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+summary_cache_requests = registry.counter("summary_cache_requests_total", "Summary cache lookups, by scope and result")
+summary_cache_invalidations = registry.counter("summary_cache_invalidations_total", "Summary cache invalidations, by source")
+
+Key = Tuple[str, str, Optional[str]]
+
+class ChangeStreamStandIn:
+    """In-process stand-in for the summaries change stream, for tests and servers without a replica set.
+
+    Every `watch()` iterator receives each change passed to `publish()`, in order.
+    """
+
+    def __init__(self):
+        self._subscribers: List[asyncio.Queue] = []
+
+    def publish(self, summary: Dict[str, Any]):
+        change = {key: summary.get(key) for key in ("user_id", "scope", "session_id")}
+        for queue in self._subscribers:
+            queue.put_nowait(change)
+
+    async def watch(self) -> AsyncIterator[Dict[str, Any]]:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.remove(queue)
+
+class SummaryCache:
+    """Caches latest summaries per (user_id, scope, session_id), invalidated by version on write.
+
+    Every invalidation stamps the key with a new version; a load that started before the key's last
+    invalidation is returned but not cached, so a slow read can't put a superseded summary back.
+    Writes in this process invalidate directly. Other processes' writes arrive through the storage
+    change feed when SUMMARY_CACHE_INVALIDATION=change_stream; otherwise SUMMARY_CACHE_TTL_S bounds
+    how stale another worker's summary can be.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("SUMMARY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.ttl = float(os.getenv("SUMMARY_CACHE_TTL_S", "60"))
+        self.max_entries = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "10000"))
+        self.invalidation = os.getenv("SUMMARY_CACHE_INVALIDATION", "local")  # local or change_stream
+
+        # key -> (version loaded at, expires at, summary or None)
+        self._entries: "OrderedDict[Key, Tuple[int, float, Optional[Dict[str, Any]]]]" = OrderedDict()
+        self._invalidated: Dict[Key, int] = {}
+        self._version = 0
+        # Versions at or below this were pruned from _invalidated, so loads that old are never cached
+        self._version_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def get(self, user_id: str, scope: str, session_id: Optional[str],
+                  load: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """The cached summary for the key, or `load()`'s result (cached, including None)"""
+        if not self.enabled:
+            return await load()
+
+        key = (user_id, scope, session_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            summary_cache_requests.inc(scope=scope, result="hit")
+            return dict(entry[2]) if entry[2] is not None else None
+
+        self.misses += 1
+        summary_cache_requests.inc(scope=scope, result="miss")
+        version = self._version
+        summary = await load()
+        if max(self._invalidated.get(key, 0), self._version_floor) <= version:
+            self._entries[key] = (version, time.monotonic() + self.ttl, summary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return dict(summary) if summary is not None else None
+
+    def invalidate(self, user_id: str, scope: str, session_id: Optional[str] = None, source: str = "local"):
+        """Drop a key after its summary was written; a session write also drops the user's any-session lookup"""
+        keys = [(user_id, scope, session_id)]
+        if scope == "session" and session_id is not None:
+            keys.append((user_id, scope, None))
+        self._version += 1
+        for key in keys:
+            self._entries.pop(key, None)
+            self._invalidated[key] = self._version
+        if len(self._invalidated) > 2 * self.max_entries:
+            self._invalidated.clear()
+            self._version_floor = self._version
+        summary_cache_invalidations.inc(source=source)
+
+    def clear(self):
+        """Drop everything, e.g. after changes may have been missed"""
+        self._version += 1
+        self._entries.clear()
+        self._invalidated.clear()
+        self._version_floor = self._version
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            "following_changes": self._task is not None and not self._task.done()
+        }
+
+    async def follow(self, changes: AsyncIterator[Dict[str, Any]]):
+        """Apply a change feed's invalidations until it ends"""
+        async for change in changes:
+            if change.get("user_id") is None:
+                self.clear()
+                summary_cache_invalidations.inc(source="change_stream")
+            else:
+                self.invalidate(change["user_id"], change["scope"], change.get("session_id"), source="change_stream")
+
+    async def _follow_storage(self):
+        while True:
+            try:
+                # Anything written while the stream was down is unknown, so start from empty
+                self.clear()
+                await self.follow(get_storage().watch_summaries())
+            except NotImplementedError as e:
+                logger.warning("Summary change stream unavailable; falling back to TTL expiry",
+                               extra={"error": str(e), "ttl_s": self.ttl})
+                return
+            except Exception as e:
+                logger.warning("Summary change stream interrupted", extra={"error": str(e)})
+            await asyncio.sleep(5)
+
+    def start(self):
+        """Follow the storage change feed if configured and supported; otherwise rely on the TTL"""
+        if not self.enabled or self.invalidation != "change_stream":
+            return
+        self._task = asyncio.create_task(self._follow_storage())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+# Global instance
+summary_cache = SummaryCache()
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Optional, List, Tuple
+from app.services.metrics import registry, current_request_timing, request_timing_breakdown
+
+logger = logging.getLogger(__name__)
+
+captured_requests = registry.counter("traffic_capture_requests_total", "Requests written to the traffic capture file, by outcome")
+
+# Requests whose shape is recorded
+CAPTURED_PATHS = ("/api/chat",)
+# Shorter keys would let short, guessable user and session ids be recovered by trying candidates
+MIN_SALT_BYTES = 16
+
+class TrafficCapture:
+    """Appends an anonymized record of each /api/chat request to an NDJSON trace file.
+
+    A record keeps the request's shape, not its content: arrival time, keyed hashes of the user
+    and session ids, the message's length in characters and words, the response status, the
+    latency and the per-stage durations from the request's timing breakdown. Users are sampled
+    as a whole, so a sampled user's sessions are captured in full. Every worker appends to the
+    same file; each record is one O_APPEND write. `benchmarks/replay_traffic.py` re-drives a trace.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("TRAFFIC_CAPTURE", "false").lower() in ("1", "true", "yes")
+        self.path = os.getenv("TRAFFIC_CAPTURE_PATH", "traffic.ndjson")
+        self.sample = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE", "1.0"))
+        # Keys the id hashes; keep it secret and stable, so ids can't be guessed and sessions line up across workers
+        self.salt = os.getenv("TRAFFIC_CAPTURE_SALT", "").encode()[:64]
+        self._fd: Optional[int] = None
+        if self.enabled and len(self.salt) < MIN_SALT_BYTES:
+            logger.error("Traffic capture disabled: TRAFFIC_CAPTURE_SALT is missing or too short",
+                         extra={"salt_bytes": len(self.salt), "min_salt_bytes": MIN_SALT_BYTES})
+            self.enabled = False
+
+    def captures(self, path: str) -> bool:
+        return self.enabled and path in CAPTURED_PATHS
+
+    def anonymize(self, value: str) -> str:
+        return hashlib.blake2b(value.encode(), key=self.salt, digest_size=8).hexdigest()
+
+    def sampled(self, user: str) -> bool:
+        """Whether an (anonymized) user falls in the sample"""
+        return int(user[:8], 16) < self.sample * 0x100000000
+
+    def record(self, arrived_at: float, body: bytes, status: int, latency: float,
+               timings: Optional[List[Tuple[str, float]]]):
+        """Write one request's record; never raises, since capture must not fail the request"""
+        try:
+            try:
+                payload = json.loads(body) if body else {}
+            except ValueError:
+                payload = {}
+            if not isinstance(payload, dict):
+                payload = {}
+            message = payload.get("message") if isinstance(payload.get("message"), str) else ""
+            user = self.anonymize(str(payload.get("user_id", "")))
+            if not self.sampled(user):
+                return
+            record = {
+                "ts": round(arrived_at, 6),
+                "user": user,
+                "session": self.anonymize(str(payload.get("session_id") or "default")),
+                "chars": len(message),
+                "words": len(message.split()),
+                "status": status,
+                "latency_s": round(latency, 6),
+                "stages": {stage: round(total, 6) for stage, total, _ in request_timing_breakdown(timings or [])}
+            }
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            os.write(self._fd, (json.dumps(record) + "\n").encode())
+            captured_requests.inc(outcome="ok")
+        except Exception as e:
+            captured_requests.inc(outcome="error")
+            logger.warning("Traffic capture failed", extra={"error": str(e)})
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+class TrafficCaptureMiddleware:
+    """ASGI middleware feeding `traffic_capture`. It copies the request body as the endpoint reads it,
+    and must sit inside the timing middleware so the request's stage breakdown is in scope."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not traffic_capture.captures(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+
+        body = bytearray()
+        status = 500
+
+        async def tee_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.extend(message.get("body", b""))
+            return message
+
+        async def tee_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        arrived_at = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, tee_receive, tee_send)
+        finally:
+            traffic_capture.record(arrived_at, bytes(body), status, time.perf_counter() - start, current_request_timing())
+
+# Global instance
+traffic_capture = TrafficCapture()
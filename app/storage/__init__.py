@@ -0,0 +1,45 @@
+# Storage backends
+import os
+from typing import Optional
+from app.storage.base import StorageBackend
+
+_storage: Optional[StorageBackend] = None
+
+def create_storage(backend: str = None) -> StorageBackend:
+    """Build the storage backend named by `backend` or STORAGE_BACKEND (mongo, memory or sqlite)"""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "mongo")).lower()
+
+    if backend == "mongo":
+        # MESSAGE_LAYOUT=buckets stores each session's messages in bucket documents
+        if os.getenv("MESSAGE_LAYOUT", "documents").lower() == "buckets":
+            from app.storage.mongo_buckets import BucketedMongoStorage
+            return BucketedMongoStorage()
+        from app.storage.mongo import MongoStorage
+        return MongoStorage()
+    if backend == "memory":
+        from app.storage.memory import MemoryStorage
+        return MemoryStorage()
+    if backend == "sqlite":
+        from app.storage.sqlite import SQLiteStorage
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "memory.db"))
+
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+def get_storage() -> StorageBackend:
+    """Get the process-wide storage backend"""
+    global _storage
+    if _storage is None:
+        _storage = create_storage()
+    return _storage
+
+def set_storage(storage: StorageBackend):
+    """Replace the process-wide storage backend (tests and benchmarks)"""
+    global _storage
+    _storage = storage
+
+async def connect_storage():
+    await get_storage().connect()
+
+async def close_storage():
+    if _storage is not None:
+        await _storage.close()
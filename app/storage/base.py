@@ -0,0 +1,187 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+class StorageBackend(ABC):
+    """Operations the memory modules perform against the messages, summaries and episodes collections.
+
+    Documents are plain dicts shaped like the MongoDB documents, with an ObjectId `_id`.
+    """
+
+    name = "base"
+
+    async def connect(self):
+        """Open connections and prepare the schema"""
+
+    async def close(self):
+        """Release connections"""
+
+    # Messages
+
+    @abstractmethod
+    async def insert_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Store a message and return it with its `_id` set"""
+
+    @abstractmethod
+    async def insert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        """Store many messages in one round trip; returns how many were stored"""
+
+    @abstractmethod
+    async def get_recent_messages(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        """Get the newest `limit` messages of a session, newest first, optionally strictly before a (created_at, _id) key"""
+
+    @abstractmethod
+    async def get_messages_after(self, user_id: str, session_id: str, after: Optional[Tuple[datetime, Any]],
+                                 limit: int) -> List[Dict[str, Any]]:
+        """Get up to `limit` session messages strictly after the (created_at, _id) watermark, oldest first"""
+
+    @abstractmethod
+    async def count_messages(self, user_id: str, session_id: str, role: Optional[str] = None) -> int:
+        """Count messages in a session, optionally only those with `role`"""
+
+    @abstractmethod
+    def iter_messages(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all of a user's messages ordered by session, then oldest first"""
+
+    @abstractmethod
+    async def list_message_user_ids(self) -> List[str]:
+        """Get the ids of all users that have messages"""
+
+    @abstractmethod
+    async def get_recent_user_ids(self, since: datetime, limit: int) -> List[str]:
+        """Get up to `limit` users who had messages stored since `since`, most recent first"""
+
+    @abstractmethod
+    async def get_daily_message_counts(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        """Get per-day message counts as `{"date": "YYYY-MM-DD", "count": n}`, oldest day first"""
+
+    @abstractmethod
+    async def get_messages_by_ids(self, message_ids: List[Any]) -> List[Dict[str, Any]]:
+        """Get messages by `_id`, in no particular order; missing ids are skipped"""
+
+    @abstractmethod
+    async def delete_messages(self, message_ids: List[Any]) -> int:
+        """Delete messages and their vectors by `_id`; returns how many messages were deleted"""
+
+    @abstractmethod
+    async def get_idle_sessions(self, idle_before: datetime, limit: int) -> List[Dict[str, Any]]:
+        """Sessions whose newest message is older than `idle_before`, as `{"user_id", "session_id", "last_at"}`,
+        longest idle first"""
+
+    # Message embeddings
+
+    @abstractmethod
+    async def upsert_message_embeddings(self, records: List[Dict[str, Any]]) -> int:
+        """Store message vectors: `{"_id": message id, user_id, session_id, created_at, embed_model, embedding}`"""
+
+    @abstractmethod
+    async def find_message_embeddings(self, user_id: str, embed_model: str, session_id: Optional[str] = None,
+                                      since: Optional[datetime] = None,
+                                      until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Get a user's message vectors from one model as `{"_id", "session_id", "created_at", "vector"}`,
+        where `vector` is little-endian float32 bytes; `since` is inclusive, `until` exclusive"""
+
+    # Summaries
+
+    @abstractmethod
+    async def get_latest_summary(self, user_id: str, scope: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Get the newest summary for a scope; lifetime summaries have no session"""
+
+    @abstractmethod
+    async def get_latest_summaries(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Lifetime summaries of the users in `sessions` plus the session summaries of exactly those
+        (user_id, session_id) pairs, fetched together; missing ones are skipped"""
+
+    @abstractmethod
+    async def upsert_summary(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        """Insert or replace the summary keyed by (user_id, scope, session_id)"""
+
+    @abstractmethod
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None,
+                                    before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        """Get a user's session summaries, newest first, optionally strictly before a (created_at, _id) key"""
+
+    @abstractmethod
+    def iter_summaries(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream all of a user's summaries, lifetime and session"""
+
+    def watch_summaries(self) -> AsyncIterator[Dict[str, Any]]:
+        """Stream `{"user_id", "scope", "session_id"}` for every summary written by any process.
+
+        `user_id` is None when the change can't be attributed (e.g. a delete). Backends without a
+        change feed raise NotImplementedError.
+        """
+        raise NotImplementedError
+
+    # Episodes
+
+    @abstractmethod
+    async def insert_episode(self, episode: Dict[str, Any]) -> Dict[str, Any]:
+        """Store an episode and return it with its `_id` set"""
+
+    @abstractmethod
+    async def find_episodes(self, user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all episodes of a user, or of one of their sessions"""
+
+    @abstractmethod
+    async def find_session_episodes(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """Get all episodes of several (user_id, session_id) pairs at once"""
+
+    @abstractmethod
+    async def get_episodes_by_ids(self, episode_ids: List[Any]) -> List[Dict[str, Any]]:
+        """Get episodes by `_id`, in no particular order; missing ids are skipped"""
+
+    @abstractmethod
+    async def get_recent_episodes(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        """Get the newest `limit` episodes of a session, newest first, optionally strictly before a (created_at, _id) key"""
+
+    @abstractmethod
+    async def count_episodes(self, user_id: str, session_id: str) -> int:
+        """Count episodes in a session"""
+
+    @abstractmethod
+    def iter_episodes(self, user_id: Optional[str] = None, after_id: Any = None,
+                      batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream episodes in `_id` order, optionally for one user and/or resuming after `after_id`"""
+
+    @abstractmethod
+    async def update_episode(self, episode_id: Any, fields: Dict[str, Any]):
+        """Set `fields` on an existing episode"""
+
+    @abstractmethod
+    async def delete_episodes(self, episode_ids: List[Any]) -> int:
+        """Delete episodes by `_id` and return how many were removed"""
+
+    @abstractmethod
+    async def list_episode_user_ids(self) -> List[str]:
+        """Get the ids of all users that have episodes"""
+
+    @abstractmethod
+    async def touch_episodes(self, episode_ids: List[Any], accessed_at: datetime):
+        """Record a retrieval: increment `access_count` and set `last_accessed_at`"""
+
+    @abstractmethod
+    async def archive_episodes(self, episode_ids: List[Any]) -> int:
+        """Move episodes to the archive (out of retrieval) and return how many were moved"""
+
+    # Profile regeneration queue
+
+    @abstractmethod
+    async def mark_profile_dirty(self, user_id: str, marked_at: datetime):
+        """Flag a user's lifetime summary as stale; keeps the earliest `dirty_since`"""
+
+    @abstractmethod
+    async def get_dirty_profiles(self, limit: int, dirty_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Get up to `limit` `{"user_id", "dirty_since", "marked_at"}` entries, stalest first"""
+
+    @abstractmethod
+    async def clear_profile_dirty(self, user_id: str, marked_at: datetime) -> bool:
+        """Clear the flag unless the user was marked again after `marked_at` (the value read from the queue)"""
+
+    # Job leases
+
+    @abstractmethod
+    async def acquire_lease(self, name: str, holder: str, expires_at: datetime, now: datetime) -> bool:
+        """Take or renew the named lease until `expires_at`; fails while another holder's lease is unexpired"""
@@ -0,0 +1,292 @@
+import bisect
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
+from bson import ObjectId
+from app.storage.base import StorageBackend
+
+def _sort_key(doc: Dict[str, Any]):
+    return (doc["created_at"], doc["_id"])
+
+class MemoryStorage(StorageBackend):
+    """In-process storage for tests, benchmarks and single-box deployments; nothing is persisted"""
+
+    name = "memory"
+
+    def __init__(self):
+        # (user_id, session_id) -> messages ordered by created_at
+        self.messages: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+        # _id -> the same message dicts
+        self.messages_by_id: Dict[ObjectId, Dict[str, Any]] = {}
+        # user_id -> message _id -> {"_id", "session_id", "created_at", "embed_model", "vector"}
+        self.message_embeddings: Dict[str, Dict[ObjectId, Dict[str, Any]]] = defaultdict(dict)
+        # (user_id, scope, session_id) -> summary
+        self.summaries: Dict[Tuple[str, str, Optional[str]], Dict[str, Any]] = {}
+        # user_id -> episodes ordered by created_at
+        self.episodes: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        # _id -> the same episode dicts, for updates and deletes
+        self.episodes_by_id: Dict[ObjectId, Dict[str, Any]] = {}
+        self.episodes_archive: Dict[ObjectId, Dict[str, Any]] = {}
+        # user_id -> {"user_id", "dirty_since", "marked_at"}
+        self.profile_queue: Dict[str, Dict[str, Any]] = {}
+        self.job_leases: Dict[str, Dict[str, Any]] = {}
+
+    # Messages
+
+    async def insert_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        message.setdefault("_id", ObjectId())
+        stored = dict(message)
+        bisect.insort(self.messages[(message["user_id"], message["session_id"])], stored, key=_sort_key)
+        self.messages_by_id[stored["_id"]] = stored
+        return message
+
+    async def insert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        for message in messages:
+            await self.insert_message(message)
+        return len(messages)
+
+    async def get_recent_messages(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        messages = self.messages.get((user_id, session_id), [])
+        end = bisect.bisect_left(messages, tuple(before), key=_sort_key) if before else len(messages)
+        return [dict(m) for m in reversed(messages[max(end - limit, 0):end])] if limit else []
+
+    async def get_messages_after(self, user_id: str, session_id: str, after: Optional[Tuple[datetime, Any]],
+                                 limit: int) -> List[Dict[str, Any]]:
+        messages = self.messages.get((user_id, session_id), [])
+        start = bisect.bisect_right(messages, tuple(after), key=_sort_key) if after else 0
+        return [dict(m) for m in messages[start:start + limit]]
+
+    async def count_messages(self, user_id: str, session_id: str, role: Optional[str] = None) -> int:
+        messages = self.messages.get((user_id, session_id), [])
+        if role is None:
+            return len(messages)
+        return sum(1 for m in messages if m["role"] == role)
+
+    async def iter_messages(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        sessions = sorted(session_id for uid, session_id in self.messages if uid == user_id)
+        for session_id in sessions:
+            for message in list(self.messages[(user_id, session_id)]):
+                yield dict(message)
+
+    async def list_message_user_ids(self) -> List[str]:
+        return sorted({user_id for (user_id, _), messages in self.messages.items() if messages})
+
+    async def get_recent_user_ids(self, since: datetime, limit: int) -> List[str]:
+        bound = ObjectId.from_datetime(since)
+        last_ids: Dict[str, ObjectId] = {}
+        for (user_id, _), messages in self.messages.items():
+            newest = max((m["_id"] for m in messages), default=None)
+            if newest is not None and newest >= bound and (user_id not in last_ids or newest > last_ids[user_id]):
+                last_ids[user_id] = newest
+        return sorted(last_ids, key=last_ids.get, reverse=True)[:limit]
+
+    async def get_daily_message_counts(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        counts: Dict[str, int] = defaultdict(int)
+        for (uid, _), messages in self.messages.items():
+            if uid != user_id:
+                continue
+            for message in messages:
+                counts[message["created_at"].strftime("%Y-%m-%d")] += 1
+        return [{"date": date, "count": counts[date]} for date in sorted(counts)[:days]]
+
+    async def get_messages_by_ids(self, message_ids: List[Any]) -> List[Dict[str, Any]]:
+        return [dict(self.messages_by_id[mid]) for mid in message_ids if mid in self.messages_by_id]
+
+    async def delete_messages(self, message_ids: List[Any]) -> int:
+        deleted = 0
+        for message_id in message_ids:
+            stored = self.messages_by_id.pop(message_id, None)
+            if stored is None:
+                continue
+            session = self.messages[(stored["user_id"], stored["session_id"])]
+            del session[bisect.bisect_left(session, _sort_key(stored), key=_sort_key)]
+            if not session:
+                del self.messages[(stored["user_id"], stored["session_id"])]
+            self.message_embeddings.get(stored["user_id"], {}).pop(message_id, None)
+            deleted += 1
+        return deleted
+
+    async def get_idle_sessions(self, idle_before: datetime, limit: int) -> List[Dict[str, Any]]:
+        sessions = [
+            {"user_id": user_id, "session_id": session_id, "last_at": messages[-1]["created_at"]}
+            for (user_id, session_id), messages in self.messages.items()
+            if messages and messages[-1]["created_at"] < idle_before
+        ]
+        sessions.sort(key=lambda session: session["last_at"])
+        return sessions[:limit]
+
+    # Message embeddings
+
+    async def upsert_message_embeddings(self, records: List[Dict[str, Any]]) -> int:
+        for record in records:
+            self.message_embeddings[record["user_id"]][record["_id"]] = {
+                "_id": record["_id"],
+                "session_id": record["session_id"],
+                "created_at": record["created_at"],
+                "embed_model": record["embed_model"],
+                "vector": np.asarray(record["embedding"], dtype="<f4").tobytes()
+            }
+        return len(records)
+
+    async def find_message_embeddings(self, user_id: str, embed_model: str, session_id: Optional[str] = None,
+                                      since: Optional[datetime] = None,
+                                      until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        return [
+            {k: record[k] for k in ("_id", "session_id", "created_at", "vector")}
+            for record in self.message_embeddings.get(user_id, {}).values()
+            if record["embed_model"] == embed_model
+            and (not session_id or record["session_id"] == session_id)
+            and (not since or record["created_at"] >= since)
+            and (not until or record["created_at"] < until)
+        ]
+
+    # Summaries
+
+    async def get_latest_summary(self, user_id: str, scope: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if scope == "session" and not session_id:
+            candidates = [s for (uid, sc, _), s in self.summaries.items() if uid == user_id and sc == scope]
+            return dict(max(candidates, key=lambda s: s["created_at"])) if candidates else None
+        summary = self.summaries.get((user_id, scope, session_id if scope == "session" else None))
+        return dict(summary) if summary else None
+
+    async def get_latest_summaries(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        keys = {(user_id, "user", None) for user_id, _ in sessions}
+        keys.update((user_id, "session", session_id) for user_id, session_id in sessions)
+        return [dict(self.summaries[key]) for key in keys if key in self.summaries]
+
+    async def upsert_summary(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        key = (summary["user_id"], summary["scope"], summary["session_id"] if summary["scope"] == "session" else None)
+        existing = self.summaries.get(key)
+        stored = dict(existing) if existing else {"_id": ObjectId()}
+        stored.update(summary)
+        self.summaries[key] = stored
+        return summary
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None,
+                                    before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        summaries = [
+            dict(s) for (uid, scope, _), s in self.summaries.items()
+            if uid == user_id and scope == "session" and (not before or _sort_key(s) < tuple(before))
+        ]
+        summaries.sort(key=_sort_key, reverse=True)
+        return summaries[:limit] if limit else summaries
+
+    async def iter_summaries(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        for (uid, _, _), summary in list(self.summaries.items()):
+            if uid == user_id:
+                yield dict(summary)
+
+    # Episodes
+
+    async def insert_episode(self, episode: Dict[str, Any]) -> Dict[str, Any]:
+        episode.setdefault("_id", ObjectId())
+        stored = dict(episode)
+        bisect.insort(self.episodes[episode["user_id"]], stored, key=_sort_key)
+        self.episodes_by_id[stored["_id"]] = stored
+        return episode
+
+    async def find_episodes(self, user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [
+            dict(e) for e in self.episodes.get(user_id, [])
+            if not session_id or e["session_id"] == session_id
+        ]
+
+    async def find_session_episodes(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        wanted = set(sessions)
+        return [
+            dict(e) for user_id in {user_id for user_id, _ in wanted} for e in self.episodes.get(user_id, [])
+            if (user_id, e["session_id"]) in wanted
+        ]
+
+    async def get_episodes_by_ids(self, episode_ids: List[Any]) -> List[Dict[str, Any]]:
+        return [dict(self.episodes_by_id[eid]) for eid in episode_ids if eid in self.episodes_by_id]
+
+    async def get_recent_episodes(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        episodes = self.episodes.get(user_id, [])
+        if before:
+            episodes = episodes[:bisect.bisect_left(episodes, tuple(before), key=_sort_key)]
+        episodes = [e for e in episodes if e["session_id"] == session_id]
+        return [dict(e) for e in reversed(episodes[-limit:])] if limit else []
+
+    async def count_episodes(self, user_id: str, session_id: str) -> int:
+        return sum(1 for e in self.episodes.get(user_id, []) if e["session_id"] == session_id)
+
+    async def iter_episodes(self, user_id: Optional[str] = None, after_id: Any = None,
+                            batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        if user_id:
+            ids = sorted(e["_id"] for e in self.episodes.get(user_id, []))
+        else:
+            ids = sorted(self.episodes_by_id)
+        if after_id is not None:
+            ids = ids[bisect.bisect_right(ids, after_id):]
+        for episode_id in ids:
+            stored = self.episodes_by_id.get(episode_id)
+            if stored is not None:
+                yield dict(stored)
+
+    async def update_episode(self, episode_id: Any, fields: Dict[str, Any]):
+        stored = self.episodes_by_id.get(episode_id)
+        if stored is None:
+            return
+        stored.update(fields)
+        if "created_at" in fields:
+            self.episodes[stored["user_id"]].sort(key=_sort_key)
+
+    async def delete_episodes(self, episode_ids: List[Any]) -> int:
+        removed = [self.episodes_by_id.pop(eid) for eid in episode_ids if eid in self.episodes_by_id]
+        for user_id in {e["user_id"] for e in removed}:
+            removed_ids = {e["_id"] for e in removed if e["user_id"] == user_id}
+            self.episodes[user_id] = [e for e in self.episodes[user_id] if e["_id"] not in removed_ids]
+        return len(removed)
+
+    async def list_episode_user_ids(self) -> List[str]:
+        return [user_id for user_id, episodes in self.episodes.items() if episodes]
+
+    async def touch_episodes(self, episode_ids: List[Any], accessed_at: datetime):
+        for episode_id in episode_ids:
+            stored = self.episodes_by_id.get(episode_id)
+            if stored is not None:
+                stored["access_count"] = stored.get("access_count", 0) + 1
+                stored["last_accessed_at"] = accessed_at
+
+    async def archive_episodes(self, episode_ids: List[Any]) -> int:
+        archived_at = datetime.utcnow()
+        for episode_id in episode_ids:
+            stored = self.episodes_by_id.get(episode_id)
+            if stored is not None:
+                self.episodes_archive[episode_id] = dict(stored, archived_at=archived_at)
+        return await self.delete_episodes([eid for eid in episode_ids if eid in self.episodes_archive])
+
+    # Profile regeneration queue
+
+    async def mark_profile_dirty(self, user_id: str, marked_at: datetime):
+        entry = self.profile_queue.setdefault(user_id, {"user_id": user_id, "dirty_since": marked_at})
+        entry["dirty_since"] = min(entry["dirty_since"], marked_at)
+        entry["marked_at"] = marked_at
+
+    async def get_dirty_profiles(self, limit: int, dirty_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        entries = [
+            dict(e) for e in self.profile_queue.values()
+            if dirty_before is None or e["dirty_since"] < dirty_before
+        ]
+        entries.sort(key=lambda e: e["dirty_since"])
+        return entries[:limit]
+
+    async def clear_profile_dirty(self, user_id: str, marked_at: datetime) -> bool:
+        entry = self.profile_queue.get(user_id)
+        if entry is None or entry["marked_at"] > marked_at:
+            return False
+        del self.profile_queue[user_id]
+        return True
+
+    # Job leases
+
+    async def acquire_lease(self, name: str, holder: str, expires_at: datetime, now: datetime) -> bool:
+        lease = self.job_leases.get(name)
+        if lease is not None and lease["holder"] != holder and lease["expires_at"] > now:
+            return False
+        self.job_leases[name] = {"holder": holder, "expires_at": expires_at}
+        return True
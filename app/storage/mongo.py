@@ -0,0 +1,409 @@
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
+from bson import ObjectId, Binary
+from pymongo import ReplaceOne
+from pymongo.errors import OperationFailure, DuplicateKeyError
+from app.database import get_database, connect_to_mongo, close_mongo_connection
+from app.storage.base import StorageBackend
+
+def _before(query_filter: Dict[str, Any], before: Optional[Tuple[datetime, Any]]) -> Dict[str, Any]:
+    """Restrict a filter to documents strictly before a (created_at, _id) key"""
+    if before:
+        created_at, doc_id = before
+        # The redundant $lte bound lets the planner scan a single index range instead of planning the $or
+        query_filter["created_at"] = {"$lte": created_at}
+        query_filter["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": doc_id}}
+        ]
+    return query_filter
+
+def _daily_counts(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Format {_id: {year, month, day}, count} aggregation results as dated counts"""
+    daily_counts = []
+    for result in results:
+        date_obj = result["_id"]
+        date_str = f"{date_obj['year']}-{date_obj['month']:02d}-{date_obj['day']:02d}"
+        daily_counts.append({"date": date_str, "count": result["count"]})
+    return daily_counts
+
+class MongoStorage(StorageBackend):
+    """MongoDB storage through Motor"""
+
+    name = "mongo"
+
+    async def connect(self):
+        await connect_to_mongo()
+
+    async def close(self):
+        await close_mongo_connection()
+
+    # Messages
+
+    async def insert_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        db = await get_database()
+        result = await db.messages.insert_one(message)
+        message["_id"] = result.inserted_id
+        return message
+
+    async def insert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        if not messages:
+            return 0
+        db = await get_database()
+        result = await db.messages.insert_many(messages, ordered=False)
+        return len(result.inserted_ids)
+
+    async def get_recent_messages(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = _before({"user_id": user_id, "session_id": session_id}, before)
+        cursor = db.messages.find(query_filter).sort([("created_at", -1), ("_id", -1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def get_messages_after(self, user_id: str, session_id: str, after: Optional[Tuple[datetime, Any]],
+                                 limit: int) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = {"user_id": user_id, "session_id": session_id}
+        if after:
+            created_at, message_id = after
+            query_filter["created_at"] = {"$gte": created_at}
+            query_filter["$or"] = [
+                {"created_at": {"$gt": created_at}},
+                {"created_at": created_at, "_id": {"$gt": message_id}}
+            ]
+        cursor = db.messages.find(query_filter).sort([("created_at", 1), ("_id", 1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def count_messages(self, user_id: str, session_id: str, role: Optional[str] = None) -> int:
+        db = await get_database()
+        query_filter = {"user_id": user_id, "session_id": session_id}
+        if role:
+            query_filter["role"] = role
+        return await db.messages.count_documents(query_filter)
+
+    async def iter_messages(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        db = await get_database()
+        # Matches the (user_id, session_id, created_at, _id) index so the sort is not done in memory
+        cursor = db.messages.find({"user_id": user_id}).sort(
+            [("session_id", 1), ("created_at", 1), ("_id", 1)]
+        ).batch_size(batch_size)
+        async for message in cursor:
+            yield message
+
+    async def list_message_user_ids(self) -> List[str]:
+        db = await get_database()
+        return sorted(await db.messages.distinct("user_id"))
+
+    async def get_recent_user_ids(self, since: datetime, limit: int) -> List[str]:
+        db = await get_database()
+        # ObjectIds start with their creation time, so the _id index doubles as an insert-time index
+        pipeline = [
+            {"$match": {"_id": {"$gte": ObjectId.from_datetime(since)}}},
+            {"$group": {"_id": "$user_id", "last_id": {"$max": "$_id"}}},
+            {"$sort": {"last_id": -1}},
+            {"$limit": limit}
+        ]
+        results = await db.messages.aggregate(pipeline).to_list(length=limit)
+        return [result["_id"] for result in results]
+
+    async def get_daily_message_counts(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        db = await get_database()
+
+        # MongoDB aggregation pipeline for daily counts
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {
+                "$group": {
+                    "_id": {
+                        "year": {"$year": "$created_at"},
+                        "month": {"$month": "$created_at"},
+                        "day": {"$dayOfMonth": "$created_at"}
+                    },
+                    "count": {"$sum": 1}
+                }
+            },
+            {
+                "$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}
+            },
+            {"$limit": days}
+        ]
+
+        cursor = db.messages.aggregate(pipeline)
+        return _daily_counts(await cursor.to_list(length=days))
+
+    async def get_messages_by_ids(self, message_ids: List[Any]) -> List[Dict[str, Any]]:
+        if not message_ids:
+            return []
+        db = await get_database()
+        cursor = db.messages.find({"_id": {"$in": list(message_ids)}})
+        return await cursor.to_list(length=None)
+
+    async def delete_messages(self, message_ids: List[Any]) -> int:
+        if not message_ids:
+            return 0
+        db = await get_database()
+        result = await db.messages.delete_many({"_id": {"$in": list(message_ids)}})
+        await db.message_embeddings.delete_many({"_id": {"$in": list(message_ids)}})
+        return result.deleted_count
+
+    async def get_idle_sessions(self, idle_before: datetime, limit: int) -> List[Dict[str, Any]]:
+        db = await get_database()
+        # Sorting like the (user_id, session_id, created_at) index, reversed, lets $first read one key per session
+        pipeline = [
+            {"$sort": {"user_id": -1, "session_id": -1, "created_at": -1}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+                "last_at": {"$first": "$created_at"}
+            }},
+            {"$match": {"last_at": {"$lt": idle_before}}},
+            {"$sort": {"last_at": 1}},
+            {"$limit": limit}
+        ]
+        results = await db.messages.aggregate(pipeline).to_list(length=limit)
+        return [dict(result["_id"], last_at=result["last_at"]) for result in results]
+
+    # Message embeddings
+
+    async def upsert_message_embeddings(self, records: List[Dict[str, Any]]) -> int:
+        if not records:
+            return 0
+        db = await get_database()
+        # Vectors are stored as float32 bytes, about a quarter of the size of a BSON array of doubles
+        operations = [
+            ReplaceOne({"_id": record["_id"]}, {
+                "user_id": record["user_id"],
+                "session_id": record["session_id"],
+                "created_at": record["created_at"],
+                "embed_model": record["embed_model"],
+                "vector": Binary(np.asarray(record["embedding"], dtype="<f4").tobytes())
+            }, upsert=True)
+            for record in records
+        ]
+        result = await db.message_embeddings.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    async def find_message_embeddings(self, user_id: str, embed_model: str, session_id: Optional[str] = None,
+                                      since: Optional[datetime] = None,
+                                      until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter: Dict[str, Any] = {"user_id": user_id}
+        if session_id:
+            query_filter["session_id"] = session_id
+        if since or until:
+            query_filter["created_at"] = {}
+            if since:
+                query_filter["created_at"]["$gte"] = since
+            if until:
+                query_filter["created_at"]["$lt"] = until
+        query_filter["embed_model"] = embed_model
+        cursor = db.message_embeddings.find(query_filter, {"session_id": 1, "created_at": 1, "vector": 1})
+        return await cursor.to_list(length=None)
+
+    # Summaries
+
+    async def get_latest_summary(self, user_id: str, scope: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        db = await get_database()
+
+        query_filter = {"user_id": user_id, "scope": scope}
+        if session_id and scope == "session":
+            query_filter["session_id"] = session_id
+        elif scope == "user":
+            query_filter["session_id"] = None
+
+        return await db.summaries.find_one(query_filter, sort=[("created_at", -1)])
+
+    async def get_latest_summaries(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        if not sessions:
+            return []
+        db = await get_database()
+        user_ids = sorted({user_id for user_id, _ in sessions})
+        session_ids = sorted({session_id for _, session_id in sessions})
+        lifetime = await db.summaries.find(
+            {"user_id": {"$in": user_ids}, "scope": "user", "session_id": None}
+        ).to_list(length=None)
+        # Crossing the two $in lists can over-fetch; keep only the requested pairs
+        wanted = set(sessions)
+        session = await db.summaries.find(
+            {"user_id": {"$in": user_ids}, "scope": "session", "session_id": {"$in": session_ids}}
+        ).to_list(length=None)
+        return lifetime + [s for s in session if (s["user_id"], s["session_id"]) in wanted]
+
+    async def upsert_summary(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        db = await get_database()
+
+        key = {"user_id": summary["user_id"], "scope": summary["scope"]}
+        if summary["scope"] == "session":
+            key["session_id"] = summary["session_id"]
+
+        await db.summaries.update_one(key, {"$set": summary}, upsert=True)
+        return summary
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None,
+                                    before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = _before({"user_id": user_id, "scope": "session"}, before)
+        cursor = db.summaries.find(query_filter).sort([("created_at", -1), ("_id", -1)])
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def iter_summaries(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        db = await get_database()
+        async for summary in db.summaries.find({"user_id": user_id}).batch_size(batch_size):
+            yield summary
+
+    async def watch_summaries(self) -> AsyncIterator[Dict[str, Any]]:
+        db = await get_database()
+        try:
+            async with db.summaries.watch(full_document="updateLookup") as stream:
+                async for change in stream:
+                    summary = change.get("fullDocument") or {}
+                    yield {
+                        "user_id": summary.get("user_id"),
+                        "scope": summary.get("scope"),
+                        "session_id": summary.get("session_id")
+                    }
+        except OperationFailure as e:
+            # Change streams need a replica set or sharded cluster
+            if e.code == 40573:
+                raise NotImplementedError("change streams need a replica set") from e
+            raise
+
+    # Episodes
+
+    async def insert_episode(self, episode: Dict[str, Any]) -> Dict[str, Any]:
+        db = await get_database()
+        result = await db.episodes.insert_one(episode)
+        episode["_id"] = result.inserted_id
+        return episode
+
+    async def find_episodes(self, user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = {"user_id": user_id}
+        if session_id:
+            query_filter["session_id"] = session_id
+        cursor = db.episodes.find(query_filter)
+        return await cursor.to_list(length=None)
+
+    async def find_session_episodes(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        if not sessions:
+            return []
+        db = await get_database()
+        wanted = set(sessions)
+        cursor = db.episodes.find({
+            "user_id": {"$in": sorted({user_id for user_id, _ in wanted})},
+            "session_id": {"$in": sorted({session_id for _, session_id in wanted})}
+        })
+        return [e for e in await cursor.to_list(length=None) if (e["user_id"], e["session_id"]) in wanted]
+
+    async def get_episodes_by_ids(self, episode_ids: List[Any]) -> List[Dict[str, Any]]:
+        if not episode_ids:
+            return []
+        db = await get_database()
+        cursor = db.episodes.find({"_id": {"$in": list(episode_ids)}})
+        return await cursor.to_list(length=None)
+
+    async def get_recent_episodes(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = _before({"user_id": user_id, "session_id": session_id}, before)
+        cursor = db.episodes.find(query_filter).sort([("created_at", -1), ("_id", -1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def count_episodes(self, user_id: str, session_id: str) -> int:
+        db = await get_database()
+        return await db.episodes.count_documents({"user_id": user_id, "session_id": session_id})
+
+    async def iter_episodes(self, user_id: Optional[str] = None, after_id: Any = None,
+                            batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = {}
+        if user_id:
+            query_filter["user_id"] = user_id
+        if after_id is not None:
+            query_filter["_id"] = {"$gt": after_id}
+        cursor = db.episodes.find(query_filter).sort("_id", 1).batch_size(batch_size)
+        async for episode in cursor:
+            yield episode
+
+    async def update_episode(self, episode_id: Any, fields: Dict[str, Any]):
+        db = await get_database()
+        await db.episodes.update_one({"_id": episode_id}, {"$set": fields})
+
+    async def delete_episodes(self, episode_ids: List[Any]) -> int:
+        if not episode_ids:
+            return 0
+        db = await get_database()
+        result = await db.episodes.delete_many({"_id": {"$in": list(episode_ids)}})
+        return result.deleted_count
+
+    async def list_episode_user_ids(self) -> List[str]:
+        db = await get_database()
+        return await db.episodes.distinct("user_id")
+
+    async def touch_episodes(self, episode_ids: List[Any], accessed_at: datetime):
+        if not episode_ids:
+            return
+        db = await get_database()
+        await db.episodes.update_many(
+            {"_id": {"$in": list(episode_ids)}},
+            {"$inc": {"access_count": 1}, "$set": {"last_accessed_at": accessed_at}}
+        )
+
+    async def archive_episodes(self, episode_ids: List[Any]) -> int:
+        if not episode_ids:
+            return 0
+        db = await get_database()
+        episodes = await db.episodes.find({"_id": {"$in": list(episode_ids)}}).to_list(length=None)
+        if not episodes:
+            return 0
+        archived_at = datetime.utcnow()
+        for episode in episodes:
+            episode["archived_at"] = archived_at
+        # Write the archive copy before deleting, so a crash in between leaves a duplicate rather than a
+        # loss; replacing makes the retry overwrite that copy instead of failing on its _id
+        await db.episodes_archive.bulk_write(
+            [ReplaceOne({"_id": episode["_id"]}, episode, upsert=True) for episode in episodes], ordered=False
+        )
+        result = await db.episodes.delete_many({"_id": {"$in": [e["_id"] for e in episodes]}})
+        return result.deleted_count
+
+    # Profile regeneration queue
+
+    async def mark_profile_dirty(self, user_id: str, marked_at: datetime):
+        db = await get_database()
+        await db.profile_queue.update_one(
+            {"user_id": user_id},
+            {"$set": {"marked_at": marked_at}, "$min": {"dirty_since": marked_at}},
+            upsert=True
+        )
+
+    async def get_dirty_profiles(self, limit: int, dirty_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        db = await get_database()
+        query_filter = {}
+        if dirty_before:
+            query_filter["dirty_since"] = {"$lt": dirty_before}
+        cursor = db.profile_queue.find(query_filter).sort("dirty_since", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def clear_profile_dirty(self, user_id: str, marked_at: datetime) -> bool:
+        db = await get_database()
+        result = await db.profile_queue.delete_one({"user_id": user_id, "marked_at": {"$lte": marked_at}})
+        return result.deleted_count == 1
+
+    # Job leases
+
+    async def acquire_lease(self, name: str, holder: str, expires_at: datetime, now: datetime) -> bool:
+        db = await get_database()
+        try:
+            # While another holder's lease is unexpired the filter misses, and the upsert's insert
+            # collides with the existing _id
+            await db.job_leases.update_one(
+                {"_id": name, "$or": [{"holder": holder}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"holder": holder, "expires_at": expires_at}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
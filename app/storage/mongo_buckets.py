@@ -0,0 +1,285 @@
+import os
+from collections import Counter, OrderedDict
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.database import get_database
+from app.storage.mongo import MongoStorage, _daily_counts
+
+# Stored once on the bucket instead of in every message
+BUCKET_FIELDS = ("user_id", "session_id")
+
+def _bucketed(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value for key, value in message.items() if key not in BUCKET_FIELDS}
+
+def _unbucketed(bucket: Dict[str, Any], message: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(message, user_id=bucket["user_id"], session_id=bucket["session_id"])
+
+def _key(message: Dict[str, Any]) -> Tuple[datetime, Any]:
+    return message["created_at"], message["_id"]
+
+class BucketedMongoStorage(MongoStorage):
+    """MongoDB storage that keeps messages in `message_buckets` instead of one document each.
+
+    A bucket holds up to MESSAGE_BUCKET_SIZE messages of one session, appended with $push. Only the
+    newest bucket of a session has room; buckets are numbered by `seq`. Buckets record their
+    message count, per-role counts and first/last timestamps. Counts come from that metadata, and
+    recent-window reads stop after the newest one or two buckets. A message costs one index entry
+    (`messages._id`, for lookups by id) instead of three. Everything but messages is stored as in
+    MongoStorage.
+    """
+
+    def __init__(self):
+        self.bucket_size = int(os.getenv("MESSAGE_BUCKET_SIZE", "100"))
+        # Newest bucket per session seen by this process, so most appends are a single update
+        self._open_buckets: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._max_open_buckets = 10000
+
+    def _remember(self, key: Tuple[str, str], bucket_id: Any):
+        self._open_buckets[key] = bucket_id
+        self._open_buckets.move_to_end(key)
+        while len(self._open_buckets) > self._max_open_buckets:
+            self._open_buckets.popitem(last=False)
+
+    def _batch_size(self, messages: int) -> int:
+        """Buckets to fetch per round trip when about `messages` messages are needed"""
+        return max(messages // self.bucket_size + 2, 2)
+
+    async def _push(self, db, bucket_id: Any, batch: List[Dict[str, Any]]) -> bool:
+        """Append to a bucket if it still has room for the whole batch"""
+        roles = Counter(message["role"] for message in batch)
+        result = await db.message_buckets.update_one(
+            {"_id": bucket_id, "count": {"$lte": self.bucket_size - len(batch)}},
+            {
+                "$push": {"messages": {"$each": batch}},
+                "$inc": dict({"count": len(batch)}, **{f"role_counts.{role}": n for role, n in roles.items()}),
+                "$min": {"first_at": min(message["created_at"] for message in batch)},
+                "$max": {"last_at": max(message["created_at"] for message in batch)}
+            }
+        )
+        return result.modified_count == 1
+
+    async def _append(self, user_id: str, session_id: str, messages: List[Dict[str, Any]]):
+        """Push messages onto the session's newest bucket, opening new buckets as buckets fill"""
+        db = await get_database()
+        key = (user_id, session_id)
+        pending = [_bucketed(message) for message in messages]
+        while pending:
+            # Fast path: the bucket this process appended to last still has room
+            bucket_id = self._open_buckets.get(key)
+            if bucket_id is not None and len(pending) == 1 and await self._push(db, bucket_id, pending):
+                return
+
+            latest = await db.message_buckets.find_one(
+                {"user_id": user_id, "session_id": session_id}, {"seq": 1, "count": 1}, sort=[("seq", -1)]
+            )
+            if latest is not None and latest["count"] < self.bucket_size:
+                batch = pending[:self.bucket_size - latest["count"]]
+                # Fails if another writer got there first; the next pass sees the new count
+                if await self._push(db, latest["_id"], batch):
+                    self._remember(key, latest["_id"])
+                    pending = pending[len(batch):]
+                continue
+
+            batch = pending[:self.bucket_size]
+            bucket = {
+                "user_id": user_id,
+                "session_id": session_id,
+                "seq": latest["seq"] + 1 if latest is not None else 0,
+                "count": len(batch),
+                "role_counts": dict(Counter(message["role"] for message in batch)),
+                "first_at": min(message["created_at"] for message in batch),
+                "last_at": max(message["created_at"] for message in batch),
+                "messages": batch
+            }
+            try:
+                await db.message_buckets.insert_one(bucket)
+            except DuplicateKeyError:
+                # Another writer opened this bucket; append to it on the next pass
+                continue
+            self._remember(key, bucket["_id"])
+            pending = pending[len(batch):]
+
+    # Messages
+
+    async def insert_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        message.setdefault("_id", ObjectId())
+        await self._append(message["user_id"], message["session_id"], [message])
+        return message
+
+    async def insert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        sessions: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for message in messages:
+            message.setdefault("_id", ObjectId())
+            sessions.setdefault((message["user_id"], message["session_id"]), []).append(message)
+        for (user_id, session_id), session_messages in sessions.items():
+            await self._append(user_id, session_id, session_messages)
+        return len(messages)
+
+    async def get_recent_messages(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        if not limit:
+            return []
+        db = await get_database()
+        query_filter: Dict[str, Any] = {"user_id": user_id, "session_id": session_id}
+        if before:
+            query_filter["first_at"] = {"$lte": before[0]}
+        cursor = db.message_buckets.find(query_filter).sort("seq", -1).batch_size(self._batch_size(limit))
+
+        messages: List[Dict[str, Any]] = []
+        async for bucket in cursor:
+            # Older buckets only hold older messages once `limit` newer ones are in hand
+            if len(messages) >= limit and bucket["last_at"] < messages[limit - 1]["created_at"]:
+                break
+            messages.extend(
+                _unbucketed(bucket, message) for message in bucket["messages"]
+                if not before or _key(message) < tuple(before)
+            )
+            messages.sort(key=_key, reverse=True)
+        return messages[:limit]
+
+    async def get_messages_after(self, user_id: str, session_id: str, after: Optional[Tuple[datetime, Any]],
+                                 limit: int) -> List[Dict[str, Any]]:
+        if not limit:
+            return []
+        db = await get_database()
+        query_filter: Dict[str, Any] = {"user_id": user_id, "session_id": session_id}
+        if after:
+            query_filter["last_at"] = {"$gte": after[0]}
+        cursor = db.message_buckets.find(query_filter).sort("seq", 1).batch_size(self._batch_size(limit))
+
+        messages: List[Dict[str, Any]] = []
+        async for bucket in cursor:
+            if len(messages) >= limit and bucket["first_at"] > messages[limit - 1]["created_at"]:
+                break
+            messages.extend(
+                _unbucketed(bucket, message) for message in bucket["messages"]
+                if not after or _key(message) > tuple(after)
+            )
+            messages.sort(key=_key)
+        return messages[:limit]
+
+    async def count_messages(self, user_id: str, session_id: str, role: Optional[str] = None) -> int:
+        db = await get_database()
+        pipeline = [
+            {"$match": {"user_id": user_id, "session_id": session_id}},
+            {"$group": {"_id": None, "count": {"$sum": f"$role_counts.{role}" if role else "$count"}}}
+        ]
+        results = await db.message_buckets.aggregate(pipeline).to_list(length=1)
+        return results[0]["count"] if results else 0
+
+    async def iter_messages(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        db = await get_database()
+        cursor = db.message_buckets.find({"user_id": user_id}).sort(
+            [("session_id", 1), ("seq", 1)]
+        ).batch_size(max(batch_size // self.bucket_size, 1))
+        async for bucket in cursor:
+            for message in sorted(bucket["messages"], key=_key):
+                yield _unbucketed(bucket, message)
+
+    async def list_message_user_ids(self) -> List[str]:
+        db = await get_database()
+        return sorted(await db.message_buckets.distinct("user_id"))
+
+    async def get_recent_user_ids(self, since: datetime, limit: int) -> List[str]:
+        db = await get_database()
+        # Message ObjectIds start with their creation time, so the messages._id index finds recent writes
+        pipeline = [
+            {"$match": {"messages._id": {"$gte": ObjectId.from_datetime(since)}}},
+            {"$group": {"_id": "$user_id", "last_at": {"$max": "$last_at"}}},
+            {"$sort": {"last_at": -1}},
+            {"$limit": limit}
+        ]
+        results = await db.message_buckets.aggregate(pipeline).to_list(length=limit)
+        return [result["_id"] for result in results]
+
+    async def get_daily_message_counts(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        db = await get_database()
+        pipeline = [
+            {"$match": {"user_id": user_id}},
+            {"$unwind": "$messages"},
+            {
+                "$group": {
+                    "_id": {
+                        "year": {"$year": "$messages.created_at"},
+                        "month": {"$month": "$messages.created_at"},
+                        "day": {"$dayOfMonth": "$messages.created_at"}
+                    },
+                    "count": {"$sum": 1}
+                }
+            },
+            {"$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}},
+            {"$limit": days}
+        ]
+        cursor = db.message_buckets.aggregate(pipeline)
+        return _daily_counts(await cursor.to_list(length=days))
+
+    async def get_messages_by_ids(self, message_ids: List[Any]) -> List[Dict[str, Any]]:
+        if not message_ids:
+            return []
+        db = await get_database()
+        ids = list(message_ids)
+        pipeline = [
+            {"$match": {"messages._id": {"$in": ids}}},
+            {"$unwind": "$messages"},
+            {"$match": {"messages._id": {"$in": ids}}},
+            {"$replaceRoot": {"newRoot": {
+                "$mergeObjects": ["$messages", {"user_id": "$user_id", "session_id": "$session_id"}]
+            }}}
+        ]
+        return await db.message_buckets.aggregate(pipeline).to_list(length=None)
+
+    async def delete_messages(self, message_ids: List[Any]) -> int:
+        if not message_ids:
+            return 0
+        db = await get_database()
+        ids = set(message_ids)
+        deleted = 0
+        async for bucket in db.message_buckets.find({"messages._id": {"$in": list(ids)}}):
+            deleted += await self._remove_from_bucket(db, bucket, ids)
+        await db.message_embeddings.delete_many({"_id": {"$in": list(ids)}})
+        return deleted
+
+    async def _remove_from_bucket(self, db, bucket: Dict[str, Any], ids: set) -> int:
+        """Remove `ids` from one bucket and return how many messages were actually removed"""
+        while bucket is not None:
+            kept = [message for message in bucket["messages"] if message["_id"] not in ids]
+            removed = len(bucket["messages"]) - len(kept)
+            if not removed:
+                return 0
+            # Guarded by the old count and newest timestamp, so a concurrent change is never overwritten.
+            # If one got in first nothing changes; the bucket is re-read and the removal retried
+            guard = {"_id": bucket["_id"], "count": bucket["count"], "last_at": bucket["last_at"]}
+            if not kept:
+                result = await db.message_buckets.delete_one(guard)
+                applied = result.deleted_count == 1
+            else:
+                result = await db.message_buckets.update_one(guard, {"$set": {
+                    "messages": kept,
+                    "count": len(kept),
+                    "role_counts": dict(Counter(message["role"] for message in kept)),
+                    "first_at": min(message["created_at"] for message in kept),
+                    "last_at": max(message["created_at"] for message in kept)
+                }})
+                applied = result.modified_count == 1
+            if applied:
+                return removed
+            bucket = await db.message_buckets.find_one({"_id": bucket["_id"]})
+        return 0
+
+    async def get_idle_sessions(self, idle_before: datetime, limit: int) -> List[Dict[str, Any]]:
+        db = await get_database()
+        # The newest bucket of each session, read off the (user_id, session_id, seq) index
+        pipeline = [
+            {"$sort": {"user_id": -1, "session_id": -1, "seq": -1}},
+            {"$group": {
+                "_id": {"user_id": "$user_id", "session_id": "$session_id"},
+                "last_at": {"$first": "$last_at"}
+            }},
+            {"$match": {"last_at": {"$lt": idle_before}}},
+            {"$sort": {"last_at": 1}},
+            {"$limit": limit}
+        ]
+        results = await db.message_buckets.aggregate(pipeline).to_list(length=limit)
+        return [dict(result["_id"], last_at=result["last_at"]) for result in results]
@@ -0,0 +1,607 @@
+import asyncio
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import numpy as np
+from bson import ObjectId, json_util
+from app.storage.base import StorageBackend
+
+# Bump whenever SCHEMA changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_session_recent ON messages (user_id, session_id, created_at, id);
+CREATE INDEX IF NOT EXISTS messages_session_role ON messages (user_id, session_id, role);
+
+CREATE TABLE IF NOT EXISTS message_embeddings (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    embed_model TEXT NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS message_embeddings_session_recent ON message_embeddings (user_id, session_id, created_at);
+CREATE INDEX IF NOT EXISTS message_embeddings_recent ON message_embeddings (user_id, created_at);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    session_key TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL,
+    UNIQUE (user_id, scope, session_key)
+);
+CREATE INDEX IF NOT EXISTS summaries_scope_recent ON summaries (user_id, scope, created_at);
+
+CREATE TABLE IF NOT EXISTS episodes (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    embedding BLOB,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS episodes_session_recent ON episodes (user_id, session_id, created_at);
+
+CREATE TABLE IF NOT EXISTS profile_queue (
+    user_id TEXT PRIMARY KEY,
+    dirty_since TEXT NOT NULL,
+    marked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS profile_queue_stalest ON profile_queue (dirty_since);
+
+CREATE TABLE IF NOT EXISTS job_leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS episodes_archive (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    session_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    embedding BLOB,
+    doc TEXT NOT NULL
+);
+"""
+
+def _ts(value: datetime) -> str:
+    # Millisecond precision, matching what MongoDB stores
+    return value.isoformat(timespec="milliseconds")
+
+def _dump(doc: Dict[str, Any], *skip: str) -> str:
+    return json_util.dumps({k: v for k, v in doc.items() if k not in skip})
+
+def _load(row_id: str, doc: str, embedding: Optional[bytes] = None) -> Dict[str, Any]:
+    result = {"_id": ObjectId(row_id)}
+    result.update(json_util.loads(doc))
+    if embedding is not None:
+        result["embedding"] = np.frombuffer(embedding, dtype=np.float32).tolist()
+    return result
+
+def _pack_embedding(embedding: Optional[List[float]]) -> Optional[bytes]:
+    if not embedding:
+        return None
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+def _before(before: Optional[Tuple[datetime, Any]]) -> Tuple[str, tuple]:
+    """SQL condition and parameters for rows strictly before a (created_at, _id) key"""
+    if not before:
+        return "", ()
+    created_at, row_id = before
+    return " AND (created_at, id) < (?, ?)", (_ts(created_at), str(row_id))
+
+class SQLiteStorage(StorageBackend):
+    """Single-file SQLite storage; queries run on a worker thread so the event loop stays free"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = "memory.db"):
+        self.path = path
+        self.conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    async def connect(self):
+        if self.conn is not None:
+            return
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    async def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    async def _run(self, fn, *args):
+        if self.conn is None:
+            await self.connect()
+
+        def locked():
+            with self._lock:
+                return fn(self.conn, *args)
+        return await asyncio.to_thread(locked)
+
+    async def _query(self, sql: str, params: tuple = ()) -> List[tuple]:
+        return await self._run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def _execute(self, sql: str, params: tuple = ()) -> int:
+        return await self._run(lambda conn: conn.execute(sql, params).rowcount)
+
+    # Messages
+
+    async def insert_message(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        message.setdefault("_id", ObjectId())
+        await self._execute(
+            "INSERT INTO messages (id, user_id, session_id, role, created_at, doc) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(message["_id"]), message["user_id"], message["session_id"], message["role"],
+             _ts(message["created_at"]), _dump(message, "_id"))
+        )
+        return message
+
+    async def insert_messages(self, messages: List[Dict[str, Any]]) -> int:
+        if not messages:
+            return 0
+        rows = []
+        for message in messages:
+            message.setdefault("_id", ObjectId())
+            rows.append((str(message["_id"]), message["user_id"], message["session_id"], message["role"],
+                         _ts(message["created_at"]), _dump(message, "_id")))
+
+        def insert(conn):
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(
+                    "INSERT INTO messages (id, user_id, session_id, role, created_at, doc) VALUES (?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+        await self._run(insert)
+        return len(rows)
+
+    async def get_recent_messages(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        before_sql, before_params = _before(before)
+        rows = await self._query(
+            "SELECT id, doc FROM messages WHERE user_id = ? AND session_id = ?" + before_sql +
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, session_id, *before_params, limit)
+        )
+        return [_load(*row) for row in rows]
+
+    async def get_messages_after(self, user_id: str, session_id: str, after: Optional[Tuple[datetime, Any]],
+                                 limit: int) -> List[Dict[str, Any]]:
+        if after:
+            created_at, message_id = after
+            rows = await self._query(
+                "SELECT id, doc FROM messages WHERE user_id = ? AND session_id = ? AND (created_at, id) > (?, ?) "
+                "ORDER BY created_at, id LIMIT ?",
+                (user_id, session_id, _ts(created_at), str(message_id), limit)
+            )
+        else:
+            rows = await self._query(
+                "SELECT id, doc FROM messages WHERE user_id = ? AND session_id = ? ORDER BY created_at, id LIMIT ?",
+                (user_id, session_id, limit)
+            )
+        return [_load(*row) for row in rows]
+
+    async def count_messages(self, user_id: str, session_id: str, role: Optional[str] = None) -> int:
+        if role:
+            rows = await self._query(
+                "SELECT COUNT(*) FROM messages WHERE user_id = ? AND session_id = ? AND role = ?",
+                (user_id, session_id, role)
+            )
+        else:
+            rows = await self._query(
+                "SELECT COUNT(*) FROM messages WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            )
+        return rows[0][0]
+
+    async def iter_messages(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        # Keyset pages over the (user_id, session_id, created_at, id) index
+        last = ("", "", "")
+        while True:
+            rows = await self._query(
+                "SELECT id, doc, session_id, created_at FROM messages "
+                "WHERE user_id = ? AND (session_id, created_at, id) > (?, ?, ?) "
+                "ORDER BY session_id, created_at, id LIMIT ?",
+                (user_id, last[0], last[1], last[2], batch_size)
+            )
+            for row in rows:
+                yield _load(row[0], row[1])
+            if len(rows) < batch_size:
+                return
+            row_id, _, session_id, created_at = rows[-1]
+            last = (session_id, created_at, row_id)
+
+    async def list_message_user_ids(self) -> List[str]:
+        rows = await self._query("SELECT DISTINCT user_id FROM messages ORDER BY user_id")
+        return [row[0] for row in rows]
+
+    async def get_recent_user_ids(self, since: datetime, limit: int) -> List[str]:
+        # ObjectId hex strings sort by creation time, so the primary key doubles as an insert-time index
+        rows = await self._query(
+            "SELECT user_id, MAX(id) AS last_id FROM messages WHERE id >= ? "
+            "GROUP BY user_id ORDER BY last_id DESC LIMIT ?",
+            (str(ObjectId.from_datetime(since)), limit)
+        )
+        return [user_id for user_id, _ in rows]
+
+    async def get_daily_message_counts(self, user_id: str, days: int) -> List[Dict[str, Any]]:
+        rows = await self._query(
+            "SELECT substr(created_at, 1, 10) AS day, COUNT(*) FROM messages WHERE user_id = ? "
+            "GROUP BY day ORDER BY day LIMIT ?",
+            (user_id, days)
+        )
+        return [{"date": day, "count": count} for day, count in rows]
+
+    async def get_messages_by_ids(self, message_ids: List[Any]) -> List[Dict[str, Any]]:
+        if not message_ids:
+            return []
+        ids = [str(mid) for mid in message_ids]
+        placeholders = ",".join("?" * len(ids))
+        rows = await self._query(f"SELECT id, doc FROM messages WHERE id IN ({placeholders})", tuple(ids))
+        return [_load(*row) for row in rows]
+
+    async def delete_messages(self, message_ids: List[Any]) -> int:
+        if not message_ids:
+            return 0
+        rows = [(str(mid),) for mid in message_ids]
+
+        def delete(conn):
+            conn.execute("BEGIN")
+            try:
+                deleted = conn.executemany("DELETE FROM messages WHERE id = ?", rows).rowcount
+                conn.executemany("DELETE FROM message_embeddings WHERE id = ?", rows)
+                conn.execute("COMMIT")
+                return deleted
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return await self._run(delete)
+
+    async def get_idle_sessions(self, idle_before: datetime, limit: int) -> List[Dict[str, Any]]:
+        rows = await self._query(
+            "SELECT user_id, session_id, MAX(created_at) AS last_at FROM messages GROUP BY user_id, session_id "
+            "HAVING last_at < ? ORDER BY last_at LIMIT ?",
+            (_ts(idle_before), limit)
+        )
+        return [
+            {"user_id": user_id, "session_id": session_id, "last_at": datetime.fromisoformat(last_at)}
+            for user_id, session_id, last_at in rows
+        ]
+
+    # Message embeddings
+
+    async def upsert_message_embeddings(self, records: List[Dict[str, Any]]) -> int:
+        if not records:
+            return 0
+        rows = [
+            (str(record["_id"]), record["user_id"], record["session_id"], _ts(record["created_at"]),
+             record["embed_model"], _pack_embedding(record["embedding"]))
+            for record in records
+        ]
+        return await self._run(lambda conn: conn.executemany(
+            "INSERT OR REPLACE INTO message_embeddings (id, user_id, session_id, created_at, embed_model, vector) "
+            "VALUES (?, ?, ?, ?, ?, ?)", rows
+        ).rowcount)
+
+    async def find_message_embeddings(self, user_id: str, embed_model: str, session_id: Optional[str] = None,
+                                      since: Optional[datetime] = None,
+                                      until: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        sql = "SELECT id, session_id, created_at, vector FROM message_embeddings WHERE user_id = ?"
+        params: List[Any] = [user_id]
+        if session_id:
+            sql += " AND session_id = ?"
+            params.append(session_id)
+        if since:
+            sql += " AND created_at >= ?"
+            params.append(_ts(since))
+        if until:
+            sql += " AND created_at < ?"
+            params.append(_ts(until))
+        sql += " AND embed_model = ?"
+        params.append(embed_model)
+        rows = await self._query(sql, tuple(params))
+        return [
+            {"_id": ObjectId(row_id), "session_id": sid, "created_at": datetime.fromisoformat(created_at), "vector": vector}
+            for row_id, sid, created_at, vector in rows
+        ]
+
+    # Summaries
+
+    async def get_latest_summary(self, user_id: str, scope: str, session_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        if scope == "session" and not session_id:
+            rows = await self._query(
+                "SELECT id, doc FROM summaries WHERE user_id = ? AND scope = ? ORDER BY created_at DESC LIMIT 1",
+                (user_id, scope)
+            )
+        else:
+            session_key = session_id if scope == "session" else ""
+            rows = await self._query(
+                "SELECT id, doc FROM summaries WHERE user_id = ? AND scope = ? AND session_key = ?",
+                (user_id, scope, session_key)
+            )
+        return _load(*rows[0]) if rows else None
+
+    async def get_latest_summaries(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        if not sessions:
+            return []
+        keys = {(user_id, "user", "") for user_id, _ in sessions}
+        keys.update((user_id, "session", session_id) for user_id, session_id in sessions)
+        user_ids = sorted({user_id for user_id, _ in sessions})
+        session_keys = sorted({""} | {session_id for _, session_id in sessions})
+        rows = await self._query(
+            f"SELECT id, doc, user_id, scope, session_key FROM summaries "
+            f"WHERE user_id IN ({','.join('?' * len(user_ids))}) AND session_key IN ({','.join('?' * len(session_keys))})",
+            tuple(user_ids) + tuple(session_keys)
+        )
+        return [_load(row_id, doc) for row_id, doc, *key in rows if tuple(key) in keys]
+
+    async def upsert_summary(self, summary: Dict[str, Any]) -> Dict[str, Any]:
+        session_key = summary["session_id"] if summary["scope"] == "session" else ""
+
+        def upsert(conn):
+            row = conn.execute(
+                "SELECT id, doc FROM summaries WHERE user_id = ? AND scope = ? AND session_key = ?",
+                (summary["user_id"], summary["scope"], session_key)
+            ).fetchone()
+            stored = _load(*row) if row else {"_id": ObjectId()}
+            stored.update(summary)
+            conn.execute(
+                "INSERT OR REPLACE INTO summaries (id, user_id, scope, session_key, created_at, doc) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(stored["_id"]), summary["user_id"], summary["scope"], session_key,
+                 _ts(stored["created_at"]), _dump(stored, "_id"))
+            )
+
+        await self._run(upsert)
+        return summary
+
+    async def get_session_summaries(self, user_id: str, limit: Optional[int] = None,
+                                    before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        before_sql, before_params = _before(before)
+        rows = await self._query(
+            "SELECT id, doc FROM summaries WHERE user_id = ? AND scope = 'session'" + before_sql +
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, *before_params, limit or -1)
+        )
+        return [_load(*row) for row in rows]
+
+    async def iter_summaries(self, user_id: str, batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        last_id = ""
+        while True:
+            rows = await self._query(
+                "SELECT id, doc FROM summaries WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (user_id, last_id, batch_size)
+            )
+            for row in rows:
+                yield _load(*row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    # Episodes
+
+    async def insert_episode(self, episode: Dict[str, Any]) -> Dict[str, Any]:
+        episode.setdefault("_id", ObjectId())
+        await self._execute(
+            "INSERT INTO episodes (id, user_id, session_id, created_at, embedding, doc) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(episode["_id"]), episode["user_id"], episode["session_id"], _ts(episode["created_at"]),
+             _pack_embedding(episode.get("embedding")), _dump(episode, "_id", "embedding"))
+        )
+        return episode
+
+    async def find_episodes(self, user_id: str, session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        if session_id:
+            rows = await self._query(
+                "SELECT id, doc, embedding FROM episodes WHERE user_id = ? AND session_id = ?",
+                (user_id, session_id)
+            )
+        else:
+            rows = await self._query(
+                "SELECT id, doc, embedding FROM episodes WHERE user_id = ?",
+                (user_id,)
+            )
+        return [_load(*row) for row in rows]
+
+    async def find_session_episodes(self, sessions: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        if not sessions:
+            return []
+        wanted = set(sessions)
+        user_ids = sorted({user_id for user_id, _ in wanted})
+        session_ids = sorted({session_id for _, session_id in wanted})
+        rows = await self._query(
+            f"SELECT id, doc, embedding, user_id, session_id FROM episodes "
+            f"WHERE user_id IN ({','.join('?' * len(user_ids))}) AND session_id IN ({','.join('?' * len(session_ids))})",
+            tuple(user_ids) + tuple(session_ids)
+        )
+        return [_load(row_id, doc, embedding) for row_id, doc, embedding, *key in rows if tuple(key) in wanted]
+
+    async def get_episodes_by_ids(self, episode_ids: List[Any]) -> List[Dict[str, Any]]:
+        if not episode_ids:
+            return []
+        ids = [str(eid) for eid in episode_ids]
+        placeholders = ",".join("?" * len(ids))
+        rows = await self._query(f"SELECT id, doc, embedding FROM episodes WHERE id IN ({placeholders})", tuple(ids))
+        return [_load(*row) for row in rows]
+
+    async def get_recent_episodes(self, user_id: str, session_id: str, limit: int,
+                                  before: Optional[Tuple[datetime, Any]] = None) -> List[Dict[str, Any]]:
+        before_sql, before_params = _before(before)
+        rows = await self._query(
+            "SELECT id, doc, embedding FROM episodes WHERE user_id = ? AND session_id = ?" + before_sql +
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (user_id, session_id, *before_params, limit)
+        )
+        return [_load(*row) for row in rows]
+
+    async def count_episodes(self, user_id: str, session_id: str) -> int:
+        rows = await self._query(
+            "SELECT COUNT(*) FROM episodes WHERE user_id = ? AND session_id = ?",
+            (user_id, session_id)
+        )
+        return rows[0][0]
+
+    async def iter_episodes(self, user_id: Optional[str] = None, after_id: Any = None,
+                            batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        # Keyset pages rather than one open cursor, so writers aren't blocked while we stream
+        last_id = str(after_id) if after_id is not None else ""
+        while True:
+            if user_id:
+                rows = await self._query(
+                    "SELECT id, doc, embedding FROM episodes WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user_id, last_id, batch_size)
+                )
+            else:
+                rows = await self._query(
+                    "SELECT id, doc, embedding FROM episodes WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                )
+            for row in rows:
+                yield _load(*row)
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+
+    async def update_episode(self, episode_id: Any, fields: Dict[str, Any]):
+        def update(conn):
+            row = conn.execute(
+                "SELECT id, doc, embedding FROM episodes WHERE id = ?", (str(episode_id),)
+            ).fetchone()
+            if row is None:
+                return
+            episode = _load(*row)
+            episode.update(fields)
+            conn.execute(
+                "UPDATE episodes SET session_id = ?, created_at = ?, embedding = ?, doc = ? WHERE id = ?",
+                (episode["session_id"], _ts(episode["created_at"]), _pack_embedding(episode.get("embedding")),
+                 _dump(episode, "_id", "embedding"), str(episode_id))
+            )
+
+        await self._run(update)
+
+    async def delete_episodes(self, episode_ids: List[Any]) -> int:
+        if not episode_ids:
+            return 0
+        ids = [str(eid) for eid in episode_ids]
+        placeholders = ",".join("?" * len(ids))
+        return await self._execute(f"DELETE FROM episodes WHERE id IN ({placeholders})", tuple(ids))
+
+    async def list_episode_user_ids(self) -> List[str]:
+        rows = await self._query("SELECT DISTINCT user_id FROM episodes")
+        return [row[0] for row in rows]
+
+    async def touch_episodes(self, episode_ids: List[Any], accessed_at: datetime):
+        if not episode_ids:
+            return
+
+        def touch(conn):
+            for episode_id in episode_ids:
+                row = conn.execute("SELECT doc FROM episodes WHERE id = ?", (str(episode_id),)).fetchone()
+                if row is None:
+                    continue
+                doc = json_util.loads(row[0])
+                doc["access_count"] = doc.get("access_count", 0) + 1
+                doc["last_accessed_at"] = accessed_at
+                conn.execute("UPDATE episodes SET doc = ? WHERE id = ?", (json_util.dumps(doc), str(episode_id)))
+
+        await self._run(touch)
+
+    async def archive_episodes(self, episode_ids: List[Any]) -> int:
+        if not episode_ids:
+            return 0
+        ids = [str(eid) for eid in episode_ids]
+        placeholders = ",".join("?" * len(ids))
+        archived_at = datetime.utcnow()
+
+        def archive(conn):
+            rows = conn.execute(
+                f"SELECT id, user_id, session_id, created_at, embedding, doc FROM episodes WHERE id IN ({placeholders})",
+                tuple(ids)
+            ).fetchall()
+            conn.execute("BEGIN")
+            try:
+                for row_id, user_id, session_id, created_at, embedding, doc in rows:
+                    doc = json_util.loads(doc)
+                    doc["archived_at"] = archived_at
+                    conn.execute(
+                        "INSERT OR REPLACE INTO episodes_archive (id, user_id, session_id, created_at, embedding, doc) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (row_id, user_id, session_id, created_at, embedding, json_util.dumps(doc))
+                    )
+                deleted = conn.execute(f"DELETE FROM episodes WHERE id IN ({placeholders})", tuple(ids)).rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return deleted
+
+        return await self._run(archive)
+
+    # Profile regeneration queue
+
+    async def mark_profile_dirty(self, user_id: str, marked_at: datetime):
+        await self._execute(
+            "INSERT INTO profile_queue (user_id, dirty_since, marked_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET dirty_since = min(dirty_since, excluded.dirty_since), "
+            "marked_at = excluded.marked_at",
+            (user_id, _ts(marked_at), _ts(marked_at))
+        )
+
+    async def get_dirty_profiles(self, limit: int, dirty_before: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        if dirty_before:
+            rows = await self._query(
+                "SELECT user_id, dirty_since, marked_at FROM profile_queue WHERE dirty_since < ? "
+                "ORDER BY dirty_since LIMIT ?",
+                (_ts(dirty_before), limit)
+            )
+        else:
+            rows = await self._query(
+                "SELECT user_id, dirty_since, marked_at FROM profile_queue ORDER BY dirty_since LIMIT ?",
+                (limit,)
+            )
+        return [
+            {"user_id": user_id, "dirty_since": datetime.fromisoformat(dirty_since),
+             "marked_at": datetime.fromisoformat(marked_at)}
+            for user_id, dirty_since, marked_at in rows
+        ]
+
+    async def clear_profile_dirty(self, user_id: str, marked_at: datetime) -> bool:
+        deleted = await self._execute(
+            "DELETE FROM profile_queue WHERE user_id = ? AND marked_at <= ?",
+            (user_id, _ts(marked_at))
+        )
+        return deleted == 1
+
+    # Job leases
+
+    async def acquire_lease(self, name: str, holder: str, expires_at: datetime, now: datetime) -> bool:
+        # The conditional upsert changes no row while another holder's lease is unexpired
+        changed = await self._execute(
+            "INSERT INTO job_leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE job_leases.holder = excluded.holder OR job_leases.expires_at <= ?",
+            (name, holder, _ts(expires_at), _ts(now))
+        )
+        return changed == 1
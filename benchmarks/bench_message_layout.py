@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Compare the MongoDB message layouts: one document per message vs session buckets.
+
+Loads the same conversation into each layout in a scratch database (DATABASE_NAME +
+"_layoutbench", dropped afterwards). Reports insert throughput, the collection's data and index
+size, and the latency of the short-term window read and the per-role count that every chat turn
+makes. Needs a running MongoDB.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python benchmarks/bench_message_layout.py \\
+        [--messages 20000] [--sessions 20] [--bucket-size 100]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.database import db, create_indexes
+from app.storage.mongo import MongoStorage
+from app.storage.mongo_buckets import BucketedMongoStorage
+
+async def latencies(fn, repeat: int) -> list:
+    """Milliseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(int(len(samples) * p), len(samples) - 1)]
+
+def conversation(user_id: str, args, start: int, count: int) -> list:
+    base = datetime.utcnow() - timedelta(days=30)
+    return [{
+        "user_id": user_id,
+        "session_id": f"s{i % args.sessions}",
+        "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"message {i} " + "lorem ipsum dolor sit amet " * 6,
+        "created_at": base + timedelta(seconds=i)
+    } for i in range(start, start + count)]
+
+async def bench_layout(name: str, storage, collection: str, args) -> dict:
+    user_id = f"bench_{name}"
+    results = {}
+
+    # Chat turns insert one message at a time; ingest and migration insert in bulk
+    single = conversation(user_id, args, 0, args.single)
+    start = time.perf_counter()
+    for message in single:
+        await storage.insert_message(message)
+    results["insert_message (msg/s)"] = len(single) / (time.perf_counter() - start)
+
+    bulk = conversation(user_id, args, args.single, args.messages - args.single)
+    start = time.perf_counter()
+    for i in range(0, len(bulk), 1000):
+        await storage.insert_messages(bulk[i:i + 1000])
+    results["insert_messages (msg/s)"] = len(bulk) / max(time.perf_counter() - start, 1e-9)
+
+    stats = await db.db.command("collStats", collection)
+    results["documents"] = stats["count"]
+    results["data size (MB)"] = stats["size"] / 2**20
+    results["storage size (MB)"] = stats["storageSize"] / 2**20
+    results["index size (MB)"] = stats["totalIndexSize"] / 2**20
+    results["index entries/message"] = sum(
+        (await db.db.command("validate", collection)).get("keysPerIndex", {}).values()
+    ) / args.messages
+
+    session_id = "s0"
+    recent = await latencies(lambda: storage.get_recent_messages(user_id, session_id, args.window), args.repeat)
+    results["recent window p50 (ms)"] = statistics.median(recent)
+    results["recent window p95 (ms)"] = percentile(recent, 0.95)
+    counts = await latencies(lambda: storage.count_messages(user_id, session_id, role="user"), args.repeat)
+    results["count(role) p50 (ms)"] = statistics.median(counts)
+    results["count(role) p95 (ms)"] = percentile(counts, 0.95)
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="Messages per layout")
+    parser.add_argument("--single", type=int, default=2000, help="How many of them to insert one at a time")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--bucket-size", type=int, default=100)
+    parser.add_argument("--window", type=int, default=10, help="Recent-window size (SHORT_TERM_N)")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+    args.single = min(args.single, args.messages)
+
+    db.client = AsyncIOMotorClient(os.getenv("MONGODB_URI"))
+    db.db = db.client[os.getenv("DATABASE_NAME", "assignment06") + "_layoutbench"]
+    await db.client.drop_database(db.db.name)
+    await create_indexes()
+
+    buckets = BucketedMongoStorage()
+    buckets.bucket_size = args.bucket_size
+    layouts = [("documents", MongoStorage(), "messages"), ("buckets", buckets, "message_buckets")]
+    all_results = {}
+    try:
+        for name, storage, collection in layouts:
+            all_results[name] = await bench_layout(name, storage, collection, args)
+    finally:
+        await db.client.drop_database(db.db.name)
+        db.client.close()
+
+    print(f"{args.messages} messages in {args.sessions} sessions, buckets of {args.bucket_size}\n")
+    print(f"{'metric':<28}" + "".join(f"{name:>14}" for name in all_results))
+    for metric in all_results["documents"]:
+        print(f"{metric:<28}" + "".join(f"{all_results[name][metric]:>14.3f}" for name in all_results))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Compare storage backend latency on the operations the memory modules perform.
+
+Usage:
+    python benchmarks/bench_storage.py --backends memory sqlite mongo --messages 5000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.storage import create_storage
+
+async def timeit(fn, repeat: int) -> float:
+    """Mean milliseconds per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+async def bench_backend(name: str, args) -> dict:
+    if name == "sqlite":
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.db")
+    storage = create_storage(name)
+    await storage.connect()
+
+    user_id = f"bench_{name}_{int(time.time())}"
+    sessions = [f"s{i}" for i in range(args.sessions)]
+    base = datetime.utcnow() - timedelta(days=1)
+    results = {}
+
+    start = time.perf_counter()
+    for i in range(args.messages):
+        await storage.insert_message({
+            "user_id": user_id,
+            "session_id": sessions[i % len(sessions)],
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"message {i} " + "lorem ipsum " * 10,
+            "created_at": base + timedelta(seconds=i)
+        })
+    results["insert_message"] = (time.perf_counter() - start) * 1000 / args.messages
+
+    start = time.perf_counter()
+    for i in range(args.episodes):
+        await storage.insert_episode({
+            "user_id": user_id,
+            "session_id": sessions[i % len(sessions)],
+            "fact": f"fact {i}",
+            "importance": random.random(),
+            "embedding": [random.random() for _ in range(args.dim)],
+            "created_at": base + timedelta(seconds=i)
+        })
+    results["insert_episode"] = (time.perf_counter() - start) * 1000 / max(args.episodes, 1)
+
+    await storage.upsert_summary({
+        "user_id": user_id, "session_id": sessions[0], "scope": "session",
+        "text": "summary", "created_at": datetime.utcnow()
+    })
+
+    results["get_recent_messages"] = await timeit(
+        lambda: storage.get_recent_messages(user_id, sessions[0], 10), args.repeat)
+    results["count_messages(role)"] = await timeit(
+        lambda: storage.count_messages(user_id, sessions[0], role="user"), args.repeat)
+    results["get_latest_summary"] = await timeit(
+        lambda: storage.get_latest_summary(user_id, "session", sessions[0]), args.repeat)
+    results["find_episodes"] = await timeit(
+        lambda: storage.find_episodes(user_id), max(args.repeat // 10, 1))
+
+    await storage.close()
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--episodes", type=int, default=500)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    all_results = {}
+    for name in args.backends:
+        all_results[name] = await bench_backend(name, args)
+
+    operations = list(next(iter(all_results.values())).keys())
+    print(f"{'operation (ms/op)':<24}" + "".join(f"{name:>12}" for name in args.backends))
+    for op in operations:
+        print(f"{op:<24}" + "".join(f"{all_results[name][op]:>12.3f}" for name in args.backends))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""Compare full vs incremental session summarization on a fixed conversation corpus.
+
+Replays the corpus into in-memory storage, summarizing every SUMMARIZE_EVERY_USER_MSGS user
+messages exactly like /api/chat does, once per mode. Reports prompt size and tokens, LLM time,
+and how many of the corpus's key facts survive into the final summary. Needs a running Ollama.
+
+Usage:
+    python benchmarks/bench_summaries.py [--every 5] [--show]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.storage import set_storage, get_storage
+from app.storage.memory import MemoryStorage
+from app.memory.long_term import long_term_memory
+from app.services.ollama_client import ollama_client, prompt_tokens
+
+# (user message, assistant reply); later turns revisit early facts so recall tests retention
+CORPUS = [
+    ("Hi, I'm Priya and I work as a data engineer in Toronto.", "Nice to meet you, Priya! What are you working on?"),
+    ("We're migrating our pipelines from Airflow to Dagster.", "That's a big move. What's driving it?"),
+    ("Mostly better asset lineage and local testing.", "Dagster's asset model is strong for lineage."),
+    ("Our warehouse is Snowflake, and dbt handles transforms.", "Dagster integrates well with dbt."),
+    ("The deadline for the migration is end of March.", "Noted, that gives about a quarter."),
+    ("I'm also training for a half marathon in May.", "Great! How is training going?"),
+    ("I run four days a week, long run on Sundays.", "That's a solid schedule."),
+    ("My knee has been sore after long runs though.", "Consider easing the mileage and seeing a physio."),
+    ("Back to work: we have 140 Airflow DAGs to port.", "Batching them by domain might help."),
+    ("Finance DAGs are the riskiest, they feed month-end reporting.", "Port those last with parallel runs."),
+    ("My manager Tom wants a weekly status email.", "A short template could save you time."),
+    ("I prefer Python over Scala for new jobs.", "Python has the better Dagster support anyway."),
+    ("We decided to keep Snowflake but drop Fivetran for Airbyte.", "That reduces licensing costs."),
+    ("Airbyte runs on our Kubernetes cluster.", "Watch connector resource limits on Kubernetes."),
+    ("The physio said my knee issue is IT band syndrome.", "Foam rolling and hip strength work often help."),
+    ("I'm cutting my long run to 14 km for two weeks.", "Sensible while it recovers."),
+    ("We finished porting the marketing DAGs yesterday.", "Nice milestone. What's next?"),
+    ("Next is the product analytics domain, about 30 DAGs.", "That's a good chunk of the remaining work."),
+    ("Tom approved hiring a contractor for the finance DAGs.", "That should protect the March deadline."),
+    ("Can you remind me what my main risks are?", "Finance DAGs, the March deadline, and your knee."),
+]
+
+# Facts the final summary should still mention
+KEY_FACTS = [
+    "Dagster", "Airflow", "Snowflake", "March", "marathon", "knee", "finance", "Airbyte", "Tom", "contractor",
+]
+
+async def run_mode(mode: str, every: int) -> dict:
+    set_storage(MemoryStorage())
+    long_term_memory.summary_mode = mode
+    long_term_memory.summarize_every = every
+
+    prompt_chars = 0
+    original_chat_completion = ollama_client.chat_completion
+
+    async def counting_chat_completion(messages, temperature=0.7):
+        nonlocal prompt_chars
+        prompt_chars += sum(len(m["content"]) for m in messages)
+        return await original_chat_completion(messages, temperature=temperature)
+
+    ollama_client.chat_completion = counting_chat_completion
+    tokens_before = prompt_tokens.value(model=ollama_client.chat_model)
+    llm_seconds = 0.0
+    runs = 0
+    summary = None
+
+    try:
+        base = datetime.utcnow() - timedelta(hours=1)
+        storage_user, storage_session = "bench_user", f"bench_{mode}"
+        storage = get_storage()
+
+        for i, (user_text, assistant_text) in enumerate(CORPUS):
+            for offset, (role, content) in enumerate([("user", user_text), ("assistant", assistant_text)]):
+                await storage.insert_message({
+                    "user_id": storage_user,
+                    "session_id": storage_session,
+                    "role": role,
+                    "content": content,
+                    "created_at": base + timedelta(seconds=2 * i + offset)
+                })
+            if await long_term_memory.should_generate_session_summary(storage_user, storage_session):
+                start = time.perf_counter()
+                summary = await long_term_memory.generate_session_summary(storage_user, storage_session) or summary
+                llm_seconds += time.perf_counter() - start
+                runs += 1
+    finally:
+        ollama_client.chat_completion = original_chat_completion
+
+    text = summary["text"] if summary else ""
+    recalled = [fact for fact in KEY_FACTS if fact.lower() in text.lower()]
+    return {
+        "runs": runs,
+        "prompt_chars": prompt_chars,
+        "prompt_tokens": int(prompt_tokens.value(model=ollama_client.chat_model) - tokens_before),
+        "llm_seconds": llm_seconds,
+        "fact_recall": len(recalled) / len(KEY_FACTS),
+        "summary": text,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--every", type=int, default=5, help="Summarize every N user messages")
+    parser.add_argument("--show", action="store_true", help="Print the final summaries")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in ("full", "incremental"):
+        results[mode] = await run_mode(mode, args.every)
+
+    print(f"{'metric':<16}{'full':>14}{'incremental':>14}")
+    for metric in ("runs", "prompt_chars", "prompt_tokens", "llm_seconds", "fact_recall"):
+        full, incremental = results["full"][metric], results["incremental"][metric]
+        fmt = "{:>14.2f}" if isinstance(full, float) else "{:>14}"
+        print(f"{metric:<16}" + fmt.format(full) + fmt.format(incremental))
+
+    if args.show:
+        for mode, result in results.items():
+            print(f"\n=== {mode} ===\n{result['summary']}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""A local stand-in for Ollama with deterministic replies and a configurable latency model.
+
+Serves the endpoints the app calls (/api/generate, streamed or not, /api/embed and
+/api/embeddings). Fact extraction prompts get a JSON fact, summary and profile prompts a short
+summary, and anything else a chat reply of --reply-words words. Vectors are derived from a hash
+of the text, so a replay produces the same ones on every run.
+
+A reply takes --prompt-ms per 1,000 prompt characters (prefill) plus --token-ms per word; an
+embedding call takes --embed-ms per input. Latency grows with prompt size, as it does on a real
+model, so a change that bloats prompts shows up in replay.
+
+Usage:
+    python benchmarks/ollama_stand_in.py [--port 11435] [--prompt-ms 20] [--token-ms 15]
+                                         [--embed-ms 5] [--reply-words 40] [--dim 768]
+    OLLAMA_BASE_URL=http://localhost:11435 uvicorn app.main:app
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import re
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+WORDS = ("memory", "session", "summary", "travel", "project", "weekend", "coffee", "deadline", "garden",
+         "music", "sister", "recipe", "budget", "meeting", "book", "running", "city", "plan")
+
+args = argparse.Namespace(prompt_ms=20.0, token_ms=15.0, embed_ms=5.0, reply_words=40, dim=768)
+app = FastAPI(title="Ollama stand-in")
+
+def vector(text: str) -> list:
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    values = np.random.default_rng(seed).standard_normal(args.dim)
+    return (values / np.linalg.norm(values)).round(6).tolist()
+
+def reply_for(prompt: str) -> str:
+    if "fact extraction assistant" in prompt:
+        match = re.search(r'Message: "(.*?)"\s*\n', prompt, re.S)
+        words = (match.group(1) if match else prompt).split()[:8]
+        return json.dumps([{"fact": "User said: " + " ".join(words), "importance": 0.6}])
+    if "summarizer" in prompt or "user profile" in prompt:
+        return "- The user talked about " + ", ".join(WORDS[len(prompt) % len(WORDS):][:3])
+    start = len(prompt) % len(WORDS)
+    return " ".join(WORDS[(start + i) % len(WORDS)] for i in range(args.reply_words))
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt", "")
+    if not prompt:
+        # A warm-up request only loads the model
+        return {"model": body.get("model"), "response": "", "done": True}
+    text = reply_for(prompt)
+    tokens = text.split(" ")
+    await asyncio.sleep(args.prompt_ms * len(prompt) / 1000 / 1000)
+    stats = {"done": True, "prompt_eval_count": len(prompt) // 4, "eval_count": len(tokens)}
+
+    if not body.get("stream", True):
+        await asyncio.sleep(args.token_ms * len(tokens) / 1000)
+        return dict(stats, model=body.get("model"), response=text)
+
+    async def chunks():
+        for i, token in enumerate(tokens):
+            await asyncio.sleep(args.token_ms / 1000)
+            yield json.dumps({"response": token if i == 0 else " " + token, "done": False}) + "\n"
+        yield json.dumps(dict(stats, response="")) + "\n"
+    return StreamingResponse(chunks(), media_type="application/x-ndjson")
+
+@app.post("/api/embed")
+async def embed(request: Request):
+    body = await request.json()
+    texts = body.get("input", [])
+    texts = [texts] if isinstance(texts, str) else texts
+    await asyncio.sleep(args.embed_ms * len(texts) / 1000)
+    return {"model": body.get("model"), "embeddings": [vector(text) for text in texts]}
+
+@app.post("/api/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    await asyncio.sleep(args.embed_ms / 1000)
+    return {"embedding": vector(body.get("prompt", ""))}
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": []}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--prompt-ms", type=float, default=args.prompt_ms, help="Prefill time per 1,000 prompt characters")
+    parser.add_argument("--token-ms", type=float, default=args.token_ms, help="Time per generated word")
+    parser.add_argument("--embed-ms", type=float, default=args.embed_ms, help="Time per embedded text")
+    parser.add_argument("--reply-words", type=int, default=args.reply_words, help="Length of chat replies")
+    parser.add_argument("--dim", type=int, default=args.dim, help="Embedding dimensions")
+    parsed = parser.parse_args()
+    vars(args).update(vars(parsed))
+    uvicorn.run(app, host=parsed.host, port=parsed.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
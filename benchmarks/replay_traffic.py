@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Replay a captured /api/chat trace against a running build and compare runs.
+
+`run` re-drives a trace written with TRAFFIC_CAPTURE=true. Each request is sent at its captured
+offset from the trace's first request, divided by --speed (2 replays twice as fast; 0 sends
+everything as fast as --max-in-flight allows). A session's requests stay in order: one is sent
+no earlier than the response to the previous one, as a real client would. Messages are synthetic
+text of the captured length, and users and sessions keep their (anonymized) ids under
+--user-prefix, so memory builds up as it did in production. Point the build at
+benchmarks/ollama_stand_in.py so model time is deterministic.
+
+Every response's Server-Timing breakdown is read, and the run is written in the capture format
+(plus `lag_s`, how late a request was sent), so `compare` reads captures and runs alike.
+
+`compare` prints the two files side by side: request and error counts, latency percentiles and
+the p50/p95 of every stage, each with the change from the first file to the second.
+
+Usage:
+    python benchmarks/replay_traffic.py run traffic.ndjson [--target http://localhost:8000]
+                                        [--speed 1.0] [--out run.ndjson] [--limit N]
+                                        [--max-in-flight 64] [--user-prefix replay-]
+    python benchmarks/replay_traffic.py compare baseline.ndjson candidate.ndjson
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import List, Dict, Any, Optional
+import httpx
+import numpy as np
+
+WORDS = ("remember", "that", "my", "sister", "moved", "to", "the", "city", "last", "spring", "and", "we",
+         "planned", "a", "trip", "for", "her", "birthday", "next", "month", "with", "friends", "from", "work")
+
+def load(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+def synthetic_message(record: Dict[str, Any], index: int) -> str:
+    """Deterministic text with the captured length; the index varies it between turns"""
+    words = []
+    length = -1
+    i = index
+    while length < record["chars"]:
+        word = WORDS[i % len(WORDS)]
+        words.append(word)
+        length += len(word) + 1
+        i += 7
+    return " ".join(words)[:max(record["chars"], 1)]
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """Server-Timing `stage;dur=ms` entries as seconds per stage, without the total"""
+    stages = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name and name != "total":
+                stages[name] = round(float(value) / 1000, 6)
+    return stages
+
+async def replay(args) -> List[Dict[str, Any]]:
+    trace = load(args.trace, args.limit)
+    if not trace:
+        return []
+    t0 = trace[0]["ts"]
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    previous: Dict[str, asyncio.Task] = {}
+    results: List[Dict[str, Any]] = []
+    done = 0
+
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout,
+                                 limits=httpx.Limits(max_connections=args.max_in_flight)) as client:
+        start = time.perf_counter()
+
+        async def send(index: int, record: Dict[str, Any], after: Optional[asyncio.Task]):
+            nonlocal done
+            due = (record["ts"] - t0) / args.speed if args.speed > 0 else 0.0
+            delay = due - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if after is not None:
+                await asyncio.wait([after])
+            async with in_flight:
+                sent = time.perf_counter() - start
+                body = {
+                    "user_id": args.user_prefix + record["user"],
+                    "session_id": record["session"],
+                    "message": synthetic_message(record, index)
+                }
+                stages: Dict[str, float] = {}
+                error = None
+                began = time.perf_counter()
+                try:
+                    response = await client.post("/api/chat", json=body, headers={"X-Timing-Breakdown": "1"})
+                    status = response.status_code
+                    stages = parse_server_timing(response.headers.get("server-timing", ""))
+                except httpx.HTTPError as e:
+                    status, error = 599, type(e).__name__
+                latency = time.perf_counter() - began
+            results.append({
+                "ts": round(time.time(), 6),
+                "user": record["user"],
+                "session": record["session"],
+                "chars": record["chars"],
+                "words": record["words"],
+                "status": status,
+                "latency_s": round(latency, 6),
+                "lag_s": round(max(sent - due, 0.0), 6),
+                "stages": stages
+            })
+            if error:
+                results[-1]["error"] = error
+            done += 1
+            if done % 100 == 0:
+                print(f"  {done}/{len(trace)} sent", file=sys.stderr)
+
+        tasks = []
+        for index, record in enumerate(trace):
+            key = record["user"] + "/" + record["session"]
+            task = asyncio.create_task(send(index, record, previous.get(key)))
+            previous[key] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - start
+
+    span_s = trace[-1]["ts"] - t0
+    print(f"Replayed {len(trace)} requests in {elapsed:.1f}s (trace spans {span_s:.1f}s, speed {args.speed:g})")
+    return results
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q)) if values else None
+
+def summarize(records: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+    ok = [record for record in records if record["status"] < 400]
+    latencies = [record["latency_s"] for record in ok]
+    rows: Dict[str, Optional[float]] = {
+        "requests": len(records),
+        "errors": len(records) - len(ok),
+        "latency p50": percentile(latencies, 50),
+        "latency p90": percentile(latencies, 90),
+        "latency p99": percentile(latencies, 99),
+        "latency max": max(latencies) if latencies else None,
+        "latency mean": float(np.mean(latencies)) if latencies else None
+    }
+    lags = [record["lag_s"] for record in records if "lag_s" in record]
+    if lags:
+        rows["send lag p99"] = percentile(lags, 99)
+    stages: Dict[str, List[float]] = {}
+    for record in ok:
+        for stage, seconds in record.get("stages", {}).items():
+            stages.setdefault(stage, []).append(seconds)
+    for stage in sorted(stages):
+        rows[f"{stage} p50"] = percentile(stages[stage], 50)
+        rows[f"{stage} p95"] = percentile(stages[stage], 95)
+    return rows
+
+def format_value(row: str, value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if row in ("requests", "errors"):
+        return str(int(value))
+    return f"{value * 1000:.1f}ms"
+
+def compare(args):
+    a, b = summarize(load(args.a)), summarize(load(args.b))
+    rows = list(a) + [row for row in b if row not in a]
+    width = max(len(row) for row in rows) + 2
+    print(f"{'':<{width}}{os.path.basename(args.a):>16}{os.path.basename(args.b):>16}{'change':>12}")
+    for row in rows:
+        before, after = a.get(row), b.get(row)
+        change = ""
+        if before and after is not None:
+            change = f"{(after - before) / before * 100:+.1f}%"
+        print(f"{row:<{width}}{format_value(row, before):>16}{format_value(row, after):>16}{change:>12}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Replay a trace against a running build")
+    run.add_argument("trace", help="Trace written with TRAFFIC_CAPTURE=true")
+    run.add_argument("--target", default="http://localhost:8000")
+    run.add_argument("--speed", type=float, default=1.0, help="Inter-arrival time divisor; 0 sends without waiting")
+    run.add_argument("--out", default="run.ndjson", help="Where to write the run's records")
+    run.add_argument("--limit", type=int, help="Replay only the first N requests")
+    run.add_argument("--max-in-flight", type=int, default=64, help="Cap on concurrent requests")
+    run.add_argument("--user-prefix", default="replay-", help="Prepended to user ids, to keep replayed memory apart")
+    run.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+
+    diff = commands.add_parser("compare", help="Compare two captures or runs side by side")
+    diff.add_argument("a", help="Baseline capture or run")
+    diff.add_argument("b", help="Candidate capture or run")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        compare(args)
+        return
+    results = asyncio.run(replay(args))
+    with open(args.out, "w") as f:
+        for record in results:
+            f.write(json.dumps(record) + "\n")
+    print(f"Wrote {len(results)} records to {args.out}")
+
+if __name__ == "__main__":
+    main()
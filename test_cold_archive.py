@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Check that archiving a session and resuming it from another worker never loses records.
+
+Runs against the in-memory storage backend with a scratch ARCHIVE_DIR. Two ColdArchive instances
+share the directory and play two worker processes (each has its own session locks). The archive
+run is paused while it deletes the hot records, and the other worker resumes the session in that
+window: the resume must wait until the archive has finished and then bring every record back.
+
+Usage:
+    python test_cold_archive.py
+"""
+
+import asyncio
+import glob
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from app.storage import set_storage, get_storage
+from app.storage.memory import MemoryStorage
+from app.services.cold_archive import ColdArchive
+
+USER_ID = "archive_user"
+MESSAGES = 6
+EPISODES = 2
+
+def check(label: str, ok: bool) -> int:
+    print(f"{label:<60}{'ok' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+async def seed(session_id: str):
+    storage = get_storage()
+    start = datetime.utcnow() - timedelta(days=40)
+    await storage.insert_messages([{
+        "user_id": USER_ID, "session_id": session_id, "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"message {i}", "created_at": start + timedelta(minutes=i)
+    } for i in range(MESSAGES)])
+    for i in range(EPISODES):
+        await storage.insert_episode({
+            "user_id": USER_ID, "session_id": session_id, "fact": f"fact {i}", "importance": 0.5,
+            "embedding": [0.1, 0.2, float(i)], "created_at": start + timedelta(minutes=i)
+        })
+
+async def hot_counts(session_id: str) -> tuple:
+    storage = get_storage()
+    return await storage.count_messages(USER_ID, session_id), len(await storage.find_episodes(USER_ID, session_id))
+
+def workers(directory: str) -> tuple:
+    archives = ColdArchive(), ColdArchive()
+    for archive in archives:
+        archive.directory = directory
+        archive.manifest_path = os.path.join(directory, "manifest.db")
+    return archives
+
+async def test_cold_archive() -> int:
+    set_storage(MemoryStorage())
+    storage = get_storage()
+    directory = tempfile.mkdtemp(prefix="cold_archive_check_")
+    archiver, other = workers(directory)
+    idle_before = datetime.utcnow() - timedelta(days=30)
+    failures = 0
+
+    # Pause the archive run between the manifest insert and the deletes
+    deleting, proceed = asyncio.Event(), asyncio.Event()
+    delete_messages = storage.delete_messages
+
+    async def paused_delete(message_ids):
+        deleting.set()
+        await proceed.wait()
+        return await delete_messages(message_ids)
+    storage.delete_messages = paused_delete
+
+    await seed("raced")
+    archiving = asyncio.create_task(archiver.archive_session(USER_ID, "raced", idle_before))
+    await deleting.wait()
+    failures += check("other worker sees the session as archived", await other.is_archived(USER_ID, "raced"))
+    resume = asyncio.create_task(other.ensure_hot(USER_ID, "raced"))
+    await asyncio.sleep(0.5)
+    failures += check("resume waits while the session is being archived", not resume.done())
+    proceed.set()
+    moved = await archiving
+    await resume
+    failures += check("archive run completed", moved is not None and moved["messages"] == MESSAGES)
+    failures += check("resume restored every record", await hot_counts("raced") == (MESSAGES, EPISODES))
+    failures += check("manifest and files are cleaned up",
+                      not await other.archived_sessions(USER_ID) and not glob.glob(os.path.join(directory, "**", "*.npz"), recursive=True))
+    storage.delete_messages = delete_messages
+
+    # A delete that fails part-way still leaves the session restorable
+    async def failing_delete(episode_ids):
+        raise RuntimeError("storage unavailable")
+    delete_episodes = storage.delete_episodes
+    storage.delete_episodes = failing_delete
+    await seed("failed")
+    try:
+        await archiver.archive_session(USER_ID, "failed", idle_before)
+        raised = False
+    except RuntimeError:
+        raised = True
+    storage.delete_episodes = delete_episodes
+    failures += check("failed delete is reported", raised)
+    failures += check("failed archive run is released for rehydration", await other.archived_sessions(USER_ID) == ["failed"])
+    await other.ensure_hot(USER_ID, "failed")
+    failures += check("resume restores the partly deleted session", await hot_counts("failed") == (MESSAGES, EPISODES))
+
+    # Plain archive and resume, and no session locks left behind
+    await seed("plain")
+    moved = await archiver.archive_session(USER_ID, "plain", idle_before)
+    failures += check("idle session is archived", moved is not None and await hot_counts("plain") == (0, 0))
+    await other.ensure_hot(USER_ID, "plain")
+    failures += check("resume brings it back", await hot_counts("plain") == (MESSAGES, EPISODES))
+    failures += check("no session locks are left behind", not archiver._locks and not other._locks)
+
+    shutil.rmtree(directory)
+    print(f"\n{failures} failed check{'' if failures == 1 else 's'}")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(test_cold_archive()) else 0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Check that a reader takes over the shared embedding store when the writer process dies.
+
+Seeds a scratch SQLite database, starts a writer in a child process and two readers in this one,
+then kills the writer with SIGKILL. One reader must take over, rebuild from storage (picking up an
+episode stored while no writer was running) and retire the old file, so the other reader sees the
+rebuilt store too. The takeover is polled every 5 seconds, so this takes a few seconds.
+
+Usage:
+    python test_embedding_store.py
+"""
+
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# The writer child inherits the parent's scratch directory
+SCRATCH = os.environ.get("EMBEDDING_STORE_CHECK_DIR") or tempfile.mkdtemp(prefix="embedding_store_check_")
+os.environ.update({
+    "EMBEDDING_STORE_CHECK_DIR": SCRATCH,
+    "STORAGE_BACKEND": "sqlite",
+    "SQLITE_PATH": os.path.join(SCRATCH, "memory.db"),
+    "EMBEDDING_STORE": "shared",
+    "EMBEDDING_STORE_PATH": os.path.join(SCRATCH, "store"),
+    "EMBEDDING_STORE_REBUILD_S": "0",
+})
+
+from app.storage import connect_storage, close_storage, get_storage
+from app.services.embedding_store import SharedEmbeddingStore
+from app.services.ollama_client import ollama_client
+
+USER_ID = "store_user"
+
+def check(label: str, ok: bool) -> int:
+    print(f"{label:<60}{'ok' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+async def store_episode(i: int):
+    return await get_storage().insert_episode({
+        "user_id": USER_ID, "session_id": "store_session", "fact": f"fact {i}",
+        "embedding": [1.0, float(i), 0.5], "embed_model": ollama_client.embedding_model_tag,
+        "created_at": datetime.utcnow()
+    })
+
+async def wait_for(condition, timeout: float = 15.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.1)
+    return True
+
+async def run_writer():
+    """Child process: become the writer and serve until killed"""
+    await connect_storage()
+    store = SharedEmbeddingStore()
+    await store.start()
+    print("writer" if store.is_writer else "reader", flush=True)
+    await asyncio.Event().wait()
+
+async def test_embedding_store() -> int:
+    await connect_storage()
+    failures = 0
+    for i in range(2):
+        await store_episode(i)
+
+    child = subprocess.Popen([sys.executable, __file__, "--writer"], stdout=subprocess.PIPE, text=True)
+    readers = []
+    try:
+        failures += check("child process became the writer", child.stdout.readline().strip() == "writer")
+        readers = [SharedEmbeddingStore(), SharedEmbeddingStore()]
+        for reader in readers:
+            await reader.start()
+        failures += check("readers see the writer's vectors",
+                          await wait_for(lambda: all(r.count(USER_ID) == 2 for r in readers)))
+
+        # A write forwarded by a reader reaches the writer's file
+        await readers[0].add([await store_episode(2)])
+        failures += check("forwarded add is published", await wait_for(lambda: readers[1].count(USER_ID) == 3))
+
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+        # Stored while no writer is running, so only a rebuild can pick it up
+        await store_episode(3)
+
+        failures += check("a reader takes over as writer",
+                          await wait_for(lambda: sum(r.is_writer for r in readers) == 1))
+        writer = next(r for r in readers if r.is_writer)
+        other = next(r for r in readers if not r.is_writer)
+        failures += check("new writer rebuilds from storage", await wait_for(lambda: writer.count(USER_ID) == 4))
+        failures += check("other reader reopens the rebuilt file", await wait_for(lambda: other.count(USER_ID) == 4))
+
+        # The new writer keeps serving forwarded writes
+        await other.add([await store_episode(4)])
+        failures += check("forwarded add after takeover is published",
+                          await wait_for(lambda: other.count(USER_ID) == 5 and writer.count(USER_ID) == 5))
+    finally:
+        if child.poll() is None:
+            child.kill()
+        # Readers first, so the writer's connection handlers see them hang up
+        for reader in sorted(readers, key=lambda r: r.is_writer):
+            await reader.stop()
+            await asyncio.sleep(0.1)
+        await close_storage()
+
+    print(f"\n{failures} failed check{'' if failures == 1 else 's'}")
+    return failures
+
+if __name__ == "__main__":
+    if "--writer" in sys.argv:
+        asyncio.run(run_writer())
+    else:
+        sys.exit(1 if asyncio.run(test_embedding_store()) else 0)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Check that the bucketed message layout answers every message query the way MongoStorage does.
+
+Writes the same messages through MongoStorage and BucketedMongoStorage into a scratch database
+(DATABASE_NAME + "_bucketcheck", dropped afterwards), with MESSAGE_BUCKET_SIZE set to 4 so short
+sessions span several buckets. Covers bucket rollover, get_recent_messages and get_messages_after
+with and without a keyset anchor, count_messages by role, and delete_messages across buckets.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python test_message_buckets.py
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.database import db, create_indexes
+from app.storage.mongo import MongoStorage
+from app.storage.mongo_buckets import BucketedMongoStorage
+
+load_dotenv()
+
+BUCKET_SIZE = 4
+USER_ID = "bucket_user"
+LIMITS = (1, 3, BUCKET_SIZE, BUCKET_SIZE + 1, 10, 50)
+
+def check(label: str, ok: bool) -> int:
+    print(f"{label:<60}{'ok' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+def make_messages(session_id: str, n: int, start: int = 0) -> list:
+    base = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    return [{
+        "_id": ObjectId(),
+        "user_id": USER_ID,
+        "session_id": session_id,
+        "role": "user" if i % 2 == 0 else "assistant",
+        "content": f"message {i}",
+        # Every third message shares a timestamp so keyset ties on _id are exercised
+        "created_at": base + timedelta(seconds=i - i % 3)
+    } for i in range(start, start + n)]
+
+def rows(messages: list) -> list:
+    return [(m["_id"], m["role"], m["content"], m["created_at"]) for m in messages]
+
+def key(message: dict) -> tuple:
+    return message["created_at"], message["_id"]
+
+async def bucket_counts(session_id: str) -> list:
+    buckets = await db.db.message_buckets.find({"user_id": USER_ID, "session_id": session_id}).sort("seq", 1).to_list(None)
+    return [bucket["count"] for bucket in buckets]
+
+async def buckets_consistent(session_id: str) -> bool:
+    """Each bucket's count, role_counts and first/last timestamps agree with the messages it holds"""
+    async for bucket in db.db.message_buckets.find({"user_id": USER_ID, "session_id": session_id}):
+        messages = bucket["messages"]
+        roles = {}
+        for message in messages:
+            roles[message["role"]] = roles.get(message["role"], 0) + 1
+        if (bucket["count"] != len(messages) or {r: n for r, n in bucket["role_counts"].items() if n} != roles
+                or bucket["first_at"] != min(m["created_at"] for m in messages)
+                or bucket["last_at"] != max(m["created_at"] for m in messages)):
+            return False
+    return True
+
+async def reads_match(documents: MongoStorage, buckets: BucketedMongoStorage, session_id: str) -> dict:
+    """Compare windowed reads for every limit, unanchored and anchored at every message"""
+    every = await documents.get_messages_after(USER_ID, session_id, None, 1000)
+    anchors = [None] + [key(message) for message in every]
+    result = {"recent": True, "after": True, "counts": True}
+    for limit in LIMITS:
+        for anchor in anchors:
+            if rows(await documents.get_recent_messages(USER_ID, session_id, limit, anchor)) != \
+                    rows(await buckets.get_recent_messages(USER_ID, session_id, limit, anchor)):
+                result["recent"] = False
+            if rows(await documents.get_messages_after(USER_ID, session_id, anchor, limit)) != \
+                    rows(await buckets.get_messages_after(USER_ID, session_id, anchor, limit)):
+                result["after"] = False
+    for role in (None, "user", "assistant"):
+        if await documents.count_messages(USER_ID, session_id, role) != await buckets.count_messages(USER_ID, session_id, role):
+            result["counts"] = False
+    return result
+
+async def test_message_buckets() -> int:
+    os.environ["MESSAGE_BUCKET_SIZE"] = str(BUCKET_SIZE)
+    db.client = AsyncIOMotorClient(os.getenv("MONGODB_URI"))
+    db.db = db.client[os.getenv("DATABASE_NAME", "assignment06") + "_bucketcheck"]
+    await db.client.drop_database(db.db.name)
+    await create_indexes()
+
+    documents, buckets = MongoStorage(), BucketedMongoStorage()
+    failures = 0
+    try:
+        # Rollover: one batched insert, and one message at a time
+        batched = make_messages("batched", 10)
+        await documents.insert_messages([dict(m) for m in batched])
+        await buckets.insert_messages([dict(m) for m in batched])
+        failures += check("batched insert rolls over at MESSAGE_BUCKET_SIZE", await bucket_counts("batched") == [4, 4, 2])
+
+        single = make_messages("single", 9)
+        for message in single:
+            await documents.insert_message(dict(message))
+            await buckets.insert_message(dict(message))
+        failures += check("single inserts roll over at MESSAGE_BUCKET_SIZE", await bucket_counts("single") == [4, 4, 1])
+
+        # A batch that overfills the open bucket tops it up and opens the next one
+        extra = make_messages("batched", 5, start=10)
+        await documents.insert_messages([dict(m) for m in extra])
+        await buckets.insert_messages([dict(m) for m in extra])
+        failures += check("batch tops up the open bucket first", await bucket_counts("batched") == [4, 4, 4, 3])
+        failures += check("bucket metadata matches its messages",
+                          await buckets_consistent("batched") and await buckets_consistent("single"))
+
+        for session_id in ("batched", "single"):
+            result = await reads_match(documents, buckets, session_id)
+            failures += check(f"get_recent_messages with before matches ({session_id})", result["recent"])
+            failures += check(f"get_messages_after matches ({session_id})", result["after"])
+            failures += check(f"count_messages by role matches ({session_id})", result["counts"])
+
+        # Deletes spanning buckets, including one that empties a bucket
+        messages = batched + extra
+        victims = [messages[i]["_id"] for i in (1, 3, 4, 5, 6, 7, 9, 14)]
+        deleted = (await documents.delete_messages(victims), await buckets.delete_messages(victims))
+        failures += check("delete_messages across buckets counts every removal", deleted == (len(victims), len(victims)))
+        failures += check("emptied bucket is removed", await bucket_counts("batched") == [2, 3, 2])
+        deleted = (await documents.delete_messages(victims), await buckets.delete_messages(victims))
+        failures += check("repeated delete_messages removes nothing", deleted == (0, 0))
+        failures += check("bucket metadata matches after deletes", await buckets_consistent("batched"))
+        result = await reads_match(documents, buckets, "batched")
+        failures += check("reads and counts match after deletes", all(result.values()))
+
+        # Appends after deletes go to the newest bucket
+        tail = make_messages("batched", 3, start=15)
+        await documents.insert_messages([dict(m) for m in tail])
+        await buckets.insert_messages([dict(m) for m in tail])
+        failures += check("appends after deletes fill the newest bucket", await bucket_counts("batched") == [2, 3, 4, 1])
+        result = await reads_match(documents, buckets, "batched")
+        failures += check("reads and counts match after appends", all(result.values()))
+    finally:
+        await db.client.drop_database(db.db.name)
+        db.client.close()
+
+    print(f"\n{failures} failed check{'' if failures == 1 else 's'}")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(test_message_buckets()) else 0)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Check that every MongoDB query the memory modules issue is served by an index.
+
+Seeds a scratch database (DATABASE_NAME + "_plancheck", dropped afterwards), runs each storage
+call the memory modules make, captures the commands they send with a pymongo command listener
+and explains them. Exits non-zero if any winning plan contains a COLLSCAN or an in-memory SORT.
+
+Set MESSAGE_LAYOUT=buckets to check the bucketed message layout instead.
+
+Usage:
+    MONGODB_URI=mongodb://localhost:27017 python test_query_plans.py
+    MONGODB_URI=mongodb://localhost:27017 MESSAGE_LAYOUT=buckets python test_query_plans.py
+"""
+
+import asyncio
+import copy
+import os
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+
+from app.database import db, create_indexes
+from app.storage.mongo import MongoStorage
+from app.storage.mongo_buckets import BucketedMongoStorage
+
+load_dotenv()
+
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+BAD_STAGES = {"COLLSCAN", "SORT"}
+
+USERS = [f"plan_user_{i}" for i in range(3)]
+SESSIONS = [f"plan_session_{i}" for i in range(4)]
+MESSAGES_PER_SESSION = 100
+EPISODES_PER_SESSION = 25
+
+class CommandCapture(monitoring.CommandListener):
+    """Records the commands sent while enabled"""
+
+    def __init__(self):
+        self.enabled = False
+        self.commands = []
+
+    def started(self, event):
+        if self.enabled and event.command_name in EXPLAINABLE:
+            self.commands.append(copy.deepcopy(dict(event.command)))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+def explain_commands(command: dict) -> list:
+    """Turn a captured command into one or more explainable commands (one per update/delete statement)"""
+    command = {k: v for k, v in command.items() if not k.startswith("$") and k not in ("lsid", "txnNumber")}
+    if "updates" in command:
+        return [dict(command, updates=[statement]) for statement in command["updates"]]
+    if "deletes" in command:
+        return [dict(command, deletes=[statement]) for statement in command["deletes"]]
+    return [command]
+
+def winning_plan_stages(node) -> list:
+    """All stage names in an explain result, skipping rejected plans"""
+    stages = []
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "rejectedPlans":
+                continue
+            if key == "stage" and isinstance(value, str):
+                stages.append(value)
+            else:
+                stages.extend(winning_plan_stages(value))
+    elif isinstance(node, list):
+        for item in node:
+            stages.extend(winning_plan_stages(item))
+    return stages
+
+async def seed(storage: MongoStorage):
+    base = datetime.utcnow() - timedelta(days=10)
+    messages = []
+    for u, user_id in enumerate(USERS):
+        for s, session_id in enumerate(SESSIONS):
+            for i in range(MESSAGES_PER_SESSION):
+                messages.append({
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": f"message {i}",
+                    # Every third message shares a timestamp so keyset ties on _id are exercised
+                    "created_at": base + timedelta(minutes=s * 1000 + i - i % 3)
+                })
+            await storage.upsert_summary({
+                "user_id": user_id, "session_id": session_id, "scope": "session",
+                "text": f"summary of {session_id}", "created_at": base + timedelta(hours=s)
+            })
+            for i in range(EPISODES_PER_SESSION):
+                await storage.insert_episode({
+                    "user_id": user_id, "session_id": session_id, "fact": f"fact {i}",
+                    "importance": 0.5, "embedding": [0.1 * (i % 7), 0.2, 0.3],
+                    "mention_count": 1, "created_at": base + timedelta(minutes=s * 1000 + i)
+                })
+        await storage.upsert_summary({
+            "user_id": user_id, "session_id": None, "scope": "user",
+            "text": "profile", "created_at": base + timedelta(days=1)
+        })
+        await storage.mark_profile_dirty(user_id, base + timedelta(minutes=u))
+    await storage.insert_messages(messages)
+
+def storage_calls(storage: MongoStorage, user_id: str, session_id: str, anchor: dict, episode: dict) -> list:
+    """(label, awaitable factory) for every storage call the memory modules and jobs make"""
+    message_key = (anchor["created_at"], anchor["_id"])
+    episode_key = (episode["created_at"], episode["_id"])
+    now = datetime.utcnow()
+
+    async def drain(iterator):
+        async for _ in iterator:
+            pass
+
+    return [
+        # With buckets, an append is a newest-bucket lookup plus a conditional $push
+        ("insert_message", lambda: storage.insert_message({
+            "user_id": user_id, "session_id": session_id, "role": "user", "content": "appended", "created_at": now})),
+        ("get_recent_messages", lambda: storage.get_recent_messages(user_id, session_id, 10)),
+        ("get_recent_messages(before)", lambda: storage.get_recent_messages(user_id, session_id, 10, before=message_key)),
+        ("get_messages_after", lambda: storage.get_messages_after(user_id, session_id, None, 50)),
+        ("get_messages_after(watermark)", lambda: storage.get_messages_after(user_id, session_id, message_key, 50)),
+        ("count_messages", lambda: storage.count_messages(user_id, session_id)),
+        ("count_messages(role)", lambda: storage.count_messages(user_id, session_id, role="user")),
+        ("get_recent_user_ids", lambda: storage.get_recent_user_ids(now - timedelta(days=1), 10)),
+        ("get_daily_message_counts", lambda: storage.get_daily_message_counts(user_id, 30)),
+        ("iter_messages", lambda: drain(storage.iter_messages(user_id))),
+        ("get_messages_by_ids", lambda: storage.get_messages_by_ids([anchor["_id"]])),
+        ("delete_messages", lambda: storage.delete_messages([ObjectId()])),
+        # One index key per session (DISTINCT_SCAN), not every message
+        ("get_idle_sessions", lambda: storage.get_idle_sessions(now, 10)),
+        ("upsert_message_embeddings", lambda: storage.upsert_message_embeddings([{
+            "_id": anchor["_id"], "user_id": user_id, "session_id": session_id, "created_at": anchor["created_at"],
+            "embed_model": "plan-model", "embedding": [0.1, 0.2, 0.3]}])),
+        ("find_message_embeddings", lambda: storage.find_message_embeddings(user_id, "plan-model")),
+        ("find_message_embeddings(session, range)", lambda: storage.find_message_embeddings(
+            user_id, "plan-model", session_id, since=now - timedelta(days=30), until=now)),
+        ("get_latest_summary(session)", lambda: storage.get_latest_summary(user_id, "session", session_id)),
+        ("get_latest_summary(any session)", lambda: storage.get_latest_summary(user_id, "session")),
+        ("get_latest_summary(user)", lambda: storage.get_latest_summary(user_id, "user")),
+        ("get_latest_summaries", lambda: storage.get_latest_summaries([(user_id, session_id), ("other", session_id)])),
+        ("upsert_summary(session)", lambda: storage.upsert_summary({
+            "user_id": user_id, "session_id": session_id, "scope": "session", "text": "updated", "created_at": now})),
+        ("upsert_summary(user)", lambda: storage.upsert_summary({
+            "user_id": user_id, "session_id": None, "scope": "user", "text": "updated", "created_at": now})),
+        ("get_session_summaries", lambda: storage.get_session_summaries(user_id, 5)),
+        ("get_session_summaries(before)", lambda: storage.get_session_summaries(user_id, 5, before=(now, ObjectId()))),
+        ("iter_summaries", lambda: drain(storage.iter_summaries(user_id))),
+        ("find_episodes", lambda: storage.find_episodes(user_id)),
+        ("find_episodes(session)", lambda: storage.find_episodes(user_id, session_id)),
+        ("find_session_episodes", lambda: storage.find_session_episodes([(user_id, session_id), ("other", session_id)])),
+        ("get_episodes_by_ids", lambda: storage.get_episodes_by_ids([episode["_id"]])),
+        ("get_recent_episodes", lambda: storage.get_recent_episodes(user_id, session_id, 20)),
+        ("get_recent_episodes(before)", lambda: storage.get_recent_episodes(user_id, session_id, 20, before=episode_key)),
+        ("count_episodes", lambda: storage.count_episodes(user_id, session_id)),
+        ("iter_episodes(user)", lambda: drain(storage.iter_episodes(user_id=user_id, after_id=episode["_id"]))),
+        ("iter_episodes(all)", lambda: drain(storage.iter_episodes(after_id=episode["_id"]))),
+        ("update_episode", lambda: storage.update_episode(episode["_id"], {"importance": 0.6})),
+        ("touch_episodes", lambda: storage.touch_episodes([episode["_id"]], now)),
+        ("list_episode_user_ids", lambda: storage.list_episode_user_ids()),
+        ("list_message_user_ids", lambda: storage.list_message_user_ids()),
+        ("delete_episodes", lambda: storage.delete_episodes([ObjectId()])),
+        ("archive_episodes", lambda: storage.archive_episodes([episode["_id"]])),
+        ("mark_profile_dirty", lambda: storage.mark_profile_dirty(user_id, now)),
+        ("get_dirty_profiles", lambda: storage.get_dirty_profiles(10)),
+        ("get_dirty_profiles(before)", lambda: storage.get_dirty_profiles(10, dirty_before=now)),
+        ("clear_profile_dirty", lambda: storage.clear_profile_dirty(user_id, now - timedelta(days=365))),
+        ("acquire_lease", lambda: storage.acquire_lease("plancheck", "holder", now + timedelta(minutes=1), now)),
+    ]
+
+async def test_query_plans() -> int:
+    capture = CommandCapture()
+    db.client = AsyncIOMotorClient(os.getenv("MONGODB_URI"), event_listeners=[capture])
+    db.db = db.client[os.getenv("DATABASE_NAME", "assignment06") + "_plancheck"]
+    await db.client.drop_database(db.db.name)
+    await create_indexes()
+
+    buckets = os.getenv("MESSAGE_LAYOUT", "documents").lower() == "buckets"
+    storage = BucketedMongoStorage() if buckets else MongoStorage()
+    failures = 0
+    try:
+        await seed(storage)
+        user_id, session_id = USERS[1], SESSIONS[2]
+        messages = await storage.get_messages_after(user_id, session_id, None, MESSAGES_PER_SESSION)
+        episodes = await storage.get_recent_episodes(user_id, session_id, EPISODES_PER_SESSION)
+        calls = storage_calls(storage, user_id, session_id, messages[len(messages) // 2], episodes[len(episodes) // 2])
+
+        print(f"{'storage call':<42}{'command':<10}{'plan':<44}result")
+        for label, call in calls:
+            capture.commands.clear()
+            capture.enabled = True
+            try:
+                await call()
+            finally:
+                capture.enabled = False
+
+            for captured in list(capture.commands):
+                for command in explain_commands(captured):
+                    explained = await db.db.command({"explain": command, "verbosity": "queryPlanner"})
+                    stages = winning_plan_stages(explained)
+                    bad = sorted(set(stages) & BAD_STAGES)
+                    failures += bool(bad)
+                    name = next(iter(command))
+                    print(f"{label:<42}{name:<10}{' > '.join(stages)[:42]:<44}{'FAIL ' + ','.join(bad) if bad else 'ok'}")
+    finally:
+        await db.client.drop_database(db.db.name)
+        db.client.close()
+
+    print(f"\n{failures} quer{'y' if failures == 1 else 'ies'} without a fully indexed plan")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(test_query_plans()) else 0)
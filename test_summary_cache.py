@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Check the summary cache's hit accounting and versioned invalidation, in-process and across processes.
+
+Runs against the in-memory storage backend. Cross-process invalidation uses ChangeStreamStandIn in
+place of a MongoDB change stream, so no replica set is needed: two SummaryCache instances play two
+workers, and each write is published to the stand-in the way the change stream would report it.
+
+Usage:
+    python test_summary_cache.py
+"""
+
+import asyncio
+import sys
+from datetime import datetime
+
+from app.storage import set_storage, get_storage
+from app.storage.memory import MemoryStorage
+from app.services.summary_cache import SummaryCache, ChangeStreamStandIn
+
+USER_ID = "cache_user"
+SESSION_ID = "cache_session"
+
+def check(label: str, ok: bool) -> int:
+    print(f"{label:<60}{'ok' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+async def write_summary(text: str, scope: str = "session", stream: ChangeStreamStandIn = None):
+    summary = {
+        "user_id": USER_ID, "session_id": SESSION_ID if scope == "session" else None,
+        "scope": scope, "text": text, "created_at": datetime.utcnow()
+    }
+    await get_storage().upsert_summary(summary)
+    if stream is not None:
+        stream.publish(summary)
+
+def reader(cache: SummaryCache, scope: str = "session", session_id: str = SESSION_ID):
+    return cache.get(USER_ID, scope, session_id, lambda: get_storage().get_latest_summary(USER_ID, scope, session_id))
+
+async def test_summary_cache() -> int:
+    set_storage(MemoryStorage())
+    failures = 0
+
+    # One worker: misses, hits and local invalidation
+    cache = SummaryCache()
+    cache.enabled = True
+    failures += check("empty summary is cached as a miss", await reader(cache) is None)
+    failures += check("second lookup is a hit", await reader(cache) is None and cache.hits == 1)
+
+    await write_summary("first")
+    failures += check("without invalidation the cached value is served", await reader(cache) is None)
+    cache.invalidate(USER_ID, "session", SESSION_ID)
+    failures += check("invalidation exposes the new summary", (await reader(cache))["text"] == "first")
+    failures += check("any-session lookup dropped with the session key",
+                      (await reader(cache, session_id=None))["text"] == "first")
+
+    # A load that straddles an invalidation must not be cached
+    async def slow_load():
+        summary = await get_storage().get_latest_summary(USER_ID, "user")
+        await asyncio.sleep(0.05)
+        return summary
+    cache.invalidate(USER_ID, "user")
+    pending = asyncio.create_task(cache.get(USER_ID, "user", None, slow_load))
+    await asyncio.sleep(0.01)
+    await write_summary("profile", scope="user")
+    cache.invalidate(USER_ID, "user")
+    await pending
+    failures += check("stale in-flight load is not cached", (await reader(cache, "user", None))["text"] == "profile")
+
+    # Two workers: a write in A reaches B through the change stream stand-in
+    stream = ChangeStreamStandIn()
+    worker_a, worker_b = SummaryCache(), SummaryCache()
+    worker_a.enabled = worker_b.enabled = True
+    follower = asyncio.create_task(worker_b.follow(stream.watch()))
+    await asyncio.sleep(0)
+    failures += check("worker B caches the current summary", (await reader(worker_b))["text"] == "first")
+
+    await write_summary("second", stream=stream)
+    worker_a.invalidate(USER_ID, "session", SESSION_ID)
+    await asyncio.sleep(0.01)
+    failures += check("worker B sees worker A's write", (await reader(worker_b))["text"] == "second")
+
+    stream.publish({"user_id": None})
+    await asyncio.sleep(0.01)
+    failures += check("unattributed change clears the cache", worker_b.stats()["entries"] == 0)
+    follower.cancel()
+
+    stats = cache.stats()
+    print(f"\nhit rate {stats['hit_rate']} ({stats['hits']} hits, {stats['misses']} misses)")
+    print(f"{failures} failed check{'' if failures == 1 else 's'}")
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(test_summary_cache()) else 0)